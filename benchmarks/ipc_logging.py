@@ -0,0 +1,91 @@
+# Copyright 2019 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Time the logging overhead of FacadeInterface.res_register for a large Sender payload.
+
+to run: python benchmarks/ipc_logging.py
+"""
+
+from __future__ import print_function, absolute_import
+
+import logging
+import os
+import sys
+import timeit
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from nmoscommon.logger import Logger  # noqa E402
+from nmosnode.serviceinterface import FacadeInterface  # noqa E402
+
+CALLS = 20000
+
+
+class StubRegistry(object):
+    def register_resource(self, *args):
+        return 0
+
+
+def sender(num_tags=50):
+    key = str(uuid.uuid4())
+    return key, {
+        "id": key,
+        "label": "benchmark sender",
+        "description": "A sender with a reasonably large payload",
+        "version": "1:0",
+        "flow_id": str(uuid.uuid4()),
+        "device_id": str(uuid.uuid4()),
+        "transport": "urn:x-nmos:transport:rtp.mcast",
+        "manifest_href": "http://127.0.0.1/x-nmos/connection/v1.0/single/senders/{}/transportfile/".format(key),
+        "interface_bindings": ["eth0", "eth1"],
+        "subscription": {"receiver_id": None, "active": False},
+        "tags": dict(("urn:x-nmos:tag:{}".format(i), ["value {}".format(i)]) for i in range(num_tags)),
+        "max_api_version": "v1.3",
+    }
+
+
+def build_interface(log_payloads):
+    interface = FacadeInterface.__new__(FacadeInterface)
+    interface.registry = StubRegistry()
+    interface.logger = Logger("ipc_logging_benchmark")
+    interface.logger.log.handlers = [logging.StreamHandler(open(os.devnull, "w"))]
+    interface.logger.log.propagate = False
+    interface.log_payloads = log_payloads
+    return interface
+
+
+def legacy_res_register(interface, name, pid, type, key, value):
+    """The previous implementation, which always formatted the complete payload"""
+    interface.logger.writeInfo("Resource Register {} {} {} {} {}".format(name, pid, type, key, value))
+    return interface.registry.register_resource(name, pid, type, key, value)
+
+
+def per_call(function, *args):
+    return min(timeit.repeat(lambda: function(*args), number=CALLS, repeat=3)) * 1e6 / CALLS
+
+
+if __name__ == "__main__":
+    key, value = sender()
+    print("{:>8} {:>14} {:>14} {:>14}".format("level", "legacy (us)", "summary (us)", "payload (us)"))
+    for level in [logging.DEBUG, logging.INFO, logging.WARNING]:
+        summary = build_interface(False)
+        payload = build_interface(True)
+        for interface in [summary, payload]:
+            interface.logger.log.setLevel(level)
+        print("{:>8} {:>14.2f} {:>14.2f} {:>14.2f}".format(
+            logging.getLevelName(level),
+            per_call(legacy_res_register, summary, "bench", 1, "sender", key, value),
+            per_call(summary.res_register, "bench", 1, "sender", key, value),
+            per_call(payload.res_register, "bench", 1, "sender", key, value)))
@@ -0,0 +1,91 @@
+# Copyright 2019 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Time FacadeRegistry.list_resource for large numbers of resources spread over many services.
+
+to run: python benchmarks/list_resource.py
+"""
+
+from __future__ import print_function, absolute_import
+
+import logging
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from nmosnode.registry import FacadeRegistry  # noqa E402
+
+SERVICES = 50
+RESOURCE_COUNTS = [10000, 50000]
+REPEATS = 3
+
+
+class StubAggregator(object):
+    def register(self, *args, **kwargs):
+        pass
+
+    def register_into(self, *args, **kwargs):
+        pass
+
+    def unregister_from(self, *args, **kwargs):
+        pass
+
+
+def legacy_list_resource(registry, type, api_version="v1.0"):
+    """The previous implementation, which copied the accumulated response once per service"""
+    response = {}
+    for name in registry.services:
+        response = (dict(list(response.items()) + [
+            (k, registry.preprocess_resource(type, k, x, api_version))
+            for (k, x) in registry.services[name]["resource"][type].items()
+            if registry._api_version_permitted(x, api_version)
+        ]))
+    return response
+
+
+def build_registry(num_resources):
+    node_data = {"id": str(uuid.uuid4()), "label": "bench", "href": "http://127.0.0.1/", "host": "127.0.0.1",
+                 "services": [], "interfaces": []}
+    registry = FacadeRegistry(["flow"], StubAggregator(), None, node_data["id"], node_data)
+    for i in range(SERVICES):
+        registry.register_service("service_{}".format(i), "bench", i)
+    for i in range(num_resources):
+        key = str(uuid.uuid4())
+        registry.register_resource("service_{}".format(i % SERVICES), i % SERVICES, "flow", key,
+                                   {"id": key, "label": "flow {}".format(i), "max_api_version": "v1.3"})
+    return registry
+
+
+def best_time(function, *args):
+    best = None
+    for _ in range(REPEATS):
+        start = time.time()
+        function(*args)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)
+    print("{:>10} {:>14} {:>14} {:>14}".format("resources", "list (s)", "per item (us)", "legacy (s)"))
+    for count in RESOURCE_COUNTS:
+        registry = build_registry(count)
+        current = best_time(registry.list_resource, "flow", "v1.3")
+        legacy = best_time(legacy_list_resource, registry, "flow", "v1.3")
+        print("{:>10} {:>14.3f} {:>14.2f} {:>14.3f}".format(count, current, current * 1e6 / count, legacy))
@@ -0,0 +1,74 @@
+# Copyright 2019 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measure re-registration throughput for 10,000 resources with a local stub Registration API, sending resources
+individually and in batches, and with batching enabled against a registry which doesn't offer a batch endpoint.
+
+to run: python benchmarks/registration_batching.py
+"""
+
+from __future__ import print_function, absolute_import
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from nmosnode.aggregator import Aggregator  # noqa E402 (monkey patches for gevent)
+
+import gevent  # noqa E402
+import logging  # noqa E402
+import time  # noqa E402
+import uuid  # noqa E402
+
+from stub_registry import StubRegistry, LATENCY  # noqa E402
+
+RESOURCE_COUNTS = {"device": 100, "source": 2000, "flow": 2000, "sender": 2000, "receiver": 3900}
+# (batch size, whether the stub registry offers a batch endpoint)
+SCENARIOS = [(0, False), (50, True), (200, True), (50, False)]
+
+
+def time_reregistration(batch_size, registry_batches):
+    registry = StubRegistry(batch=registry_batches)
+    aggregator = Aggregator()
+    aggregator._batch_size = batch_size
+    aggregator._node_data["node"] = {"type": "node", "data": {"id": str(uuid.uuid4())}}
+    for (res_type, count) in RESOURCE_COUNTS.items():
+        aggregator._add_mirror_keys("resource", res_type)
+        for i in range(count):
+            key = str(uuid.uuid4())
+            aggregator._node_data["entities"]["resource"][res_type][key] = {"type": res_type, "data": {"id": key}}
+    aggregator.aggregator = registry.href
+
+    start = time.time()
+    aggregator._registered()
+    aggregator._register_node_resources()
+    while registry.resources < sum(RESOURCE_COUNTS.values()):
+        gevent.sleep(0.01)
+    elapsed = time.time() - start
+    aggregator.stop()
+    registry.server.stop()
+    return elapsed, registry.requests
+
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)
+    total = sum(RESOURCE_COUNTS.values())
+    print("{} resources, {}ms per request".format(total, LATENCY * 1000))
+    print("{:>10} {:>16} {:>10} {:>10} {:>16}".format(
+        "batch", "registry batches", "requests", "time (s)", "resources/s"))
+    for (batch_size, registry_batches) in SCENARIOS:
+        elapsed, requests = time_reregistration(batch_size, registry_batches)
+        print("{:>10} {:>16} {:>10} {:>10.2f} {:>16.0f}".format(
+            batch_size or "off", str(registry_batches), requests, elapsed, total / elapsed))
@@ -0,0 +1,75 @@
+# Copyright 2019 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Time re-registration of a Node's resources with a local stub Registration API, for several sizes of the pool of
+concurrent senders.
+
+to run: python benchmarks/registration_concurrency.py
+"""
+
+from __future__ import print_function, absolute_import
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from nmosnode.aggregator import Aggregator  # noqa E402 (monkey patches for gevent)
+
+import gevent  # noqa E402
+import gevent.pool  # noqa E402
+import logging  # noqa E402
+import time  # noqa E402
+import uuid  # noqa E402
+
+from stub_registry import StubRegistry, LATENCY  # noqa E402
+
+RESOURCE_COUNTS = {"device": 50, "source": 1000, "flow": 1000, "sender": 1000, "receiver": 1950}
+CONCURRENCY = [1, 4, 8, 16]
+
+
+def build_aggregator(registry, concurrency):
+    aggregator = Aggregator()
+    aggregator._send_pool = gevent.pool.Pool(concurrency)
+    node_id = str(uuid.uuid4())
+    aggregator._node_data["node"] = {"type": "node", "data": {"id": node_id}}
+    for (res_type, count) in RESOURCE_COUNTS.items():
+        aggregator._add_mirror_keys("resource", res_type)
+        for i in range(count):
+            key = str(uuid.uuid4())
+            aggregator._node_data["entities"]["resource"][res_type][key] = {"type": res_type, "data": {"id": key}}
+    aggregator.aggregator = registry.href
+    return aggregator
+
+
+def time_reregistration(registry, concurrency):
+    aggregator = build_aggregator(registry, concurrency)
+    expected = registry.resources + sum(RESOURCE_COUNTS.values())
+    start = time.time()
+    aggregator._registered()
+    aggregator._register_node_resources()
+    while registry.resources < expected:
+        gevent.sleep(0.01)
+    elapsed = time.time() - start
+    aggregator.stop()
+    return elapsed
+
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)
+    registry = StubRegistry()
+    print("{} resources, {}ms per request".format(sum(RESOURCE_COUNTS.values()), LATENCY * 1000))
+    print("{:>12} {:>10}".format("concurrency", "time (s)"))
+    for concurrency in CONCURRENCY:
+        print("{:>12} {:>10.2f}".format(concurrency, time_reregistration(registry, concurrency)))
@@ -0,0 +1,63 @@
+# Copyright 2019 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local stub Registration API used by the registration benchmarks"""
+
+from __future__ import print_function, absolute_import
+
+import gevent
+import json
+from gevent import socket
+from gevent.pywsgi import WSGIServer
+
+LATENCY = 0.005  # Seconds taken by the stub registry to handle each request
+
+
+class StubRegistry(object):
+    """Minimal Registration API which accepts every request after a short delay.
+    If `batch` is set, it also accepts a JSON list of resources POSTed to 'resource/batch'."""
+    def __init__(self, batch=False):
+        self.batch = batch
+        self.requests = 0
+        self.resources = 0
+        # Disable Nagle's algorithm, as production HTTP servers do, so that kept-alive connections don't stall
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(128)
+        self.server = WSGIServer(listener, self.application, log=None)
+        self.server.start()
+        self.href = "http://127.0.0.1:{}".format(self.server.server_port)
+
+    def application(self, environ, start_response):
+        body = environ["wsgi.input"].read()
+        gevent.sleep(LATENCY)
+        self.requests += 1
+        headers = [("Content-Type", "application/json"), ("Content-Length", "2")]
+        if environ["REQUEST_METHOD"] == "DELETE":
+            start_response("204 No Content", [])
+            return []
+        elif environ["PATH_INFO"].endswith("/resource"):
+            self.resources += 1
+            start_response("201 Created", headers)
+        elif environ["PATH_INFO"].endswith("/resource/batch"):
+            if not self.batch:
+                start_response("404 Not Found", headers)
+            else:
+                self.resources += len(json.loads(body.decode("utf-8")))
+                start_response("200 OK", headers)
+        else:
+            start_response("200 OK", headers)
+        return [b"{}"]
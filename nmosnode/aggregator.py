@@ -17,10 +17,14 @@ monkey.patch_all()
 
 import gevent # noqa E402
 import gevent.queue # noqa E402
+import gevent.event # noqa E402
+import gevent.pool # noqa E402
 import requests # noqa E402
 import traceback # noqa E402
 import json # noqa E402
 import time # noqa E402
+import random # noqa E402
+import sqlite3 # noqa E402
 import webbrowser  # noqa E402
 
 from six import itervalues # noqa E402
@@ -37,20 +41,64 @@ from mdnsbridge.mdnsbridgeclient import IppmDNSBridge, NoService, EndOfServiceLi
 
 from .api import NODE_APIROOT, PROTOCOL # noqa E402
 from .authclient import AuthRegistrar # noqa E402
+from .journal import MirrorJournal # noqa E402
 
 # MDNS Service Names
 LEGACY_REG_MDNSTYPE = "nmos-registration"
 REGISTRATION_MDNSTYPE = "nmos-register"
+QUERY_MDNSTYPE = "nmos-query"
 
 # Registry path
 AGGREGATOR_APINAMESPACE = "x-nmos"
 AGGREGATOR_APINAME = "registration"
 AGGREGATOR_APIROOT = AGGREGATOR_APINAMESPACE + '/' + AGGREGATOR_APINAME
+QUERY_APIROOT = AGGREGATOR_APINAMESPACE + '/query'
 
 # Exponential back off global vars
 BACKOFF_INITIAL_TIMOUT_SECONDS = 5
 BACKOFF_MAX_TIMEOUT_SECONDS = 40
 
+# Window in which successive Node updates are coalesced into a single registration
+NODE_UPDATE_WINDOW_SECONDS = _config.get('nodefacade', {}).get('NODE_UPDATE_WINDOW', 0.5)
+
+# Maximum number of requests to the Registration API in flight at once
+REGISTRATION_CONCURRENCY = _config.get('nodefacade', {}).get('REGISTRATION_CONCURRENCY', 8)
+
+# Maximum number of resources to POST in a single request to a registry which offers a batch endpoint.
+# The Registration API specification doesn't define one, so batching is disabled by default.
+REGISTRATION_BATCH_SIZE = _config.get('nodefacade', {}).get('REGISTRATION_BATCH_SIZE', 0)
+BATCH_PATH = "batch"
+
+# When a registry already holds the Node, e.g. after failing over to a registry sharing a database with the last one,
+# query what it holds and send only the resources which are missing or out of date, rather than re-registering all
+INCREMENTAL_RESYNC = _config.get('nodefacade', {}).get('INCREMENTAL_RESYNC', False)
+
+# Optional journal of the local mirror, from which it is restored on restart. Restored resources which no back-end
+# service has registered again within JOURNAL_RESTORE_GRACE seconds are assumed to have gone, and are unregistered.
+JOURNAL_PATH = _config.get('nodefacade', {}).get('JOURNAL_PATH', None)
+JOURNAL_RESTORE_GRACE_SECONDS = _config.get('nodefacade', {}).get('JOURNAL_RESTORE_GRACE', 30)
+
+# Heartbeat scheduling. Heartbeats are sent every HEARTBEAT_INTERVAL seconds, offset by up to HEARTBEAT_JITTER seconds
+HEARTBEAT_INTERVAL = _config.get('nodefacade', {}).get('HEARTBEAT_INTERVAL', 5)
+HEARTBEAT_JITTER = _config.get('nodefacade', {}).get('HEARTBEAT_JITTER', 0)
+HEARTBEAT_LATE_FRACTION = 0.1  # Heartbeats sent more than this fraction of the interval after they're due are late
+
+# Minimum period in seconds between updates to the Node's mDNS TXT records. Changes made in the meantime are coalesced
+MDNS_MIN_UPDATE_INTERVAL = _config.get('nodefacade', {}).get('MDNS_MIN_UPDATE_INTERVAL', 0.5)
+
+# Token bucket limits on mDNS announcements in peer-to-peer mode, as an average rate per second and a maximum burst.
+# The announcement limit applies to all updates of the TXT records, and the counter limit to each 'ver_*' counter.
+MDNS_ANNOUNCE_RATE = _config.get('nodefacade', {}).get('MDNS_ANNOUNCE_RATE', 1)
+MDNS_ANNOUNCE_BURST = _config.get('nodefacade', {}).get('MDNS_ANNOUNCE_BURST', 5)
+MDNS_COUNTER_RATE = _config.get('nodefacade', {}).get('MDNS_COUNTER_RATE', 0.5)
+MDNS_COUNTER_BURST = _config.get('nodefacade', {}).get('MDNS_COUNTER_BURST', 5)
+
+try:
+    monotonic = time.monotonic
+except AttributeError:
+    # Python 2 has no monotonic clock in the standard library
+    monotonic = time.time
+
 # OAuth client global vars
 FQDN = getfqdn()
 OAUTH_MODE = _config.get("oauth_mode", False)
@@ -71,6 +119,153 @@ class ServerSideError(Exception):
     pass
 
 
+class RegistrationQueue(object):
+    """Queue of requests to the Registration API, holding only the latest request for each resource.
+    A request for a resource which is already queued replaces the earlier request in its place in the queue, so a
+    resource which changes repeatedly while the registry is unavailable results in a single request. A request with a
+    different method, e.g. re-creating a deleted resource, goes to the back of the queue instead, so it isn't sent
+    ahead of requests it may depend on, such as for its parent.
+    Requests may also be returned to the front of the queue in constant time, e.g. to retry a failed request."""
+    def __init__(self):
+        # '_order' holds (sequence number, request key) pairs. Entries whose sequence number no longer matches the
+        # one held in '_requests' have been moved to the front of the queue, and are skipped.
+        self._order = deque()
+        self._requests = {}
+        self._seq = 0
+        self._not_empty = gevent.event.Event()
+
+    @staticmethod
+    def _request_key(request):
+        return (request["namespace"], request["res_type"], request["key"])
+
+    def put(self, request):
+        request_key = self._request_key(request)
+        if request_key in self._requests and self._requests[request_key][1]["method"] == request["method"]:
+            self._requests[request_key] = (self._requests[request_key][0], request)
+        else:
+            self._seq += 1
+            self._order.append((self._seq, request_key))
+            self._requests[request_key] = (self._seq, request)
+        self._not_empty.set()
+
+    def put_front(self, request):
+        """Return a request to the front of the queue. If a newer request for the same resource has been queued in
+        the meantime, the newer request is moved to the front instead"""
+        request_key = self._request_key(request)
+        if request_key in self._requests:
+            request = self._requests[request_key][1]
+        self._seq += 1
+        self._order.appendleft((self._seq, request_key))
+        self._requests[request_key] = (self._seq, request)
+        self._not_empty.set()
+
+    def get(self, block=True, timeout=None):
+        """Remove and return the request at the front of the queue, optionally waiting for one to be queued.
+        Raises gevent.queue.Empty if no request is available"""
+        if block:
+            self._not_empty.wait(timeout)
+        while len(self._order) > 0:
+            seq, request_key = self._order.popleft()
+            if request_key in self._requests and self._requests[request_key][0] == seq:
+                request = self._requests.pop(request_key)[1]
+                if len(self._requests) == 0:
+                    self._clear()
+                return request
+        self._clear()
+        raise gevent.queue.Empty
+
+    def _clear(self):
+        self._order.clear()
+        self._not_empty.clear()
+
+    def interrupt(self):
+        """Wake any greenlet blocked in get(), which will raise gevent.queue.Empty if nothing has been queued"""
+        self._not_empty.set()
+
+    def empty(self):
+        return len(self._requests) == 0
+
+    def __len__(self):
+        return len(self._requests)
+
+
+class HeartbeatScheduler(object):
+    """Schedules heartbeats at a fixed interval on a monotonic clock. Each heartbeat is due one interval after the
+    previous one was due, rather than after it completed, so request latency doesn't cause the schedule to drift.
+    A heartbeat sent before it was due restarts the schedule from when it was sent. Heartbeats sent late, and those
+    missed altogether, are counted in `metrics`."""
+    def __init__(self, interval=HEARTBEAT_INTERVAL, jitter=HEARTBEAT_JITTER, logger=None):
+        self.interval = interval
+        self.jitter = jitter
+        self.logger = logger
+        self._slot = None  # Time the next heartbeat is due, before jitter is applied
+        self._due = None
+        self.metrics = {"sent": 0, "late": 0, "missed": 0, "max_lateness": 0.0}
+
+    def reset(self):
+        """Make the next heartbeat due immediately, and restart the schedule from then"""
+        self._slot = None
+        self._due = None
+
+    def delay(self):
+        """Return the number of seconds until the next heartbeat is due"""
+        if self._due is None:
+            return 0
+        return max(self._due - monotonic(), 0)
+
+    def heartbeat_sent(self):
+        """Record that a heartbeat is being sent now, and schedule the next one"""
+        now = monotonic()
+        self.metrics["sent"] += 1
+        if self._slot is None or now < self._due:
+            # Heartbeats sent before they're due, e.g. to each registry tried during discovery, restart the schedule
+            # from now, so the next is due one interval after the last was sent
+            self._slot = now + self.interval
+        else:
+            lateness = now - self._due
+            self.metrics["max_lateness"] = max(self.metrics["max_lateness"], lateness)
+            self._slot += self.interval
+            if self._slot <= now:
+                # Skip the slots which have already passed, rather than sending heartbeats back to back
+                missed = int((now - self._slot) // self.interval) + 1
+                self._slot += missed * self.interval
+                self.metrics["missed"] += missed
+                if self.logger is not None:
+                    self.logger.writeWarning("Missed {} heartbeat(s), {:.1f}s behind schedule".format(missed, lateness))
+            elif lateness > self.interval * HEARTBEAT_LATE_FRACTION:
+                self.metrics["late"] += 1
+        self._due = self._slot + random.uniform(-self.jitter, self.jitter)
+
+
+class TokenBucket(object):
+    """Rate limiter allowing events at an average of `rate` per second, in bursts of up to `burst` events"""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = monotonic()
+
+    def _refill(self):
+        now = monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self):
+        """Return the number of seconds until an event will be allowed"""
+        self._refill()
+        if self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def consume(self):
+        """Take a token for an event if one is available, returning whether the event is allowed"""
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+
 class Aggregator(object):
     """This class serves as a proxy for the distant aggregation service running elsewhere on the network.
     It will search out aggregators and locate them, falling back to other ones if the one it is connected to
@@ -98,12 +293,36 @@ class Aggregator(object):
         self._aggregator_failure = False  # Variable to flag when aggregator has returned and unexpected error
         self._backoff_active = False
         self._backoff_period = 0
+        self._node_update_window = NODE_UPDATE_WINDOW_SECONDS
+        self._node_update_pending = False
+        self._heartbeat_scheduler = HeartbeatScheduler(logger=self.logger)
+        self._incremental_resync = INCREMENTAL_RESYNC
+        self._synced_aggregator = None  # Aggregator known to hold the current contents of the local mirror
 
         self.auth_registrar = None  # Class responsible for registering with Auth Server
         self.auth_registry = auth_registry  # Top level class that tracks locally registered OAuth clients
         self.auth_client = None  # Instance of Oauth client responsible for performing token requests
 
-        self._reg_queue = gevent.queue.Queue()
+        # Persistent HTTP session, so connections to the aggregator are kept alive between requests
+        self._session = None
+        self._session_key = None
+
+        self._reg_queue = RegistrationQueue()
+        # Set when the Node is registered, to wake the queue processing thread
+        self._registration_ready = gevent.event.Event()
+        # Pool of greenlets sending queued requests, all of which are for the same namespace and type
+        self._send_pool = gevent.pool.Pool(REGISTRATION_CONCURRENCY)
+        self._send_group = None
+        self._in_flight = set()
+        self._failed_requests = []
+        self._batch_size = REGISTRATION_BATCH_SIZE
+        self._batch_unsupported = None  # Aggregator found not to offer a batch endpoint
+
+        self._journal = None
+        self._restored_keys = set()  # Entities restored from the journal which haven't been registered since
+        if JOURNAL_PATH is not None:
+            self._restore_from_journal(JOURNAL_PATH)
+
         self.main_thread = gevent.spawn(self._main_thread)
         self.queue_thread = gevent.spawn(self._process_queue)
 
@@ -150,6 +369,9 @@ class Aggregator(object):
 
         self._aggregator_failure = False
 
+        # Heartbeat the new aggregator immediately, and don't count the time spent finding it as missed heartbeats
+        self._heartbeat_scheduler.reset()
+
         # Update cached list of aggregators
         if self._aggregator_list_stale:
             self._flush_cached_aggregators()
@@ -169,8 +391,15 @@ class Aggregator(object):
 
     def _registered_operation(self):
         """In Registered operation, the Node is registered so a heartbeat will be performed,
-        if the heartbeat is successful the Node will wait 5 seconds before attempting another heartbeat.
+        Heartbeats are sent when due according to the heartbeat scheduler.
         Else another aggregator will be selected"""
+        delay = self._heartbeat_scheduler.delay()
+        while delay > 0 and self._running:
+            # Wake at least once a second to check whether the aggregator is stopping
+            gevent.sleep(min(delay, 1))
+            delay = self._heartbeat_scheduler.delay()
+        if not self._running:
+            return
         if not self._heartbeat():
             # Heartbeat failed
             # Flag to update cached list of aggregators and immediately try new aggregator
@@ -184,18 +413,26 @@ class Aggregator(object):
         if not self.aggregator:
             return False
         try:
+            self._heartbeat_scheduler.heartbeat_sent()
             R = self._send("POST", self.aggregator, self.aggregator_apiversion,
                            "health/nodes/{}".format(self._node_data["node"]["data"]["id"]))
 
+            if R.status_code == 200 and self._incremental_resync and not self._synced_with(self.aggregator):
+                # The aggregator already holds the Node, so try sending only what it is missing or holds out of date
+                registered_versions = self._fetch_registered_versions()
+                if registered_versions is not None:
+                    return self._resync_node(registered_versions)
+                # Otherwise fall back to full re-registration, as the aggregator can't be assumed to be in sync
+                if self._unregister_node(R.headers.get('Location')):
+                    return self._register_node(self._node_data["node"])
+                return False
+
             if R.status_code == 200 and self._node_data["registered"]:
                 # Continue to registered operation
                 self.logger.writeDebug("Successful heartbeat for Node {}"
                                        .format(self._node_data["node"]["data"]["id"]))
                 self._registered()
-                heartbeat_wait = 5
-                while heartbeat_wait > 0 and self._running:
-                    gevent.sleep(1)
-                    heartbeat_wait -= 1
+                self._synced_aggregator = self.aggregator
                 return True
 
             elif R.status_code in [200, 409]:
@@ -247,12 +484,7 @@ class Aggregator(object):
         if node_obj is None:
             return False
 
-        # Drain the queue
-        while not self._reg_queue.empty():
-            try:
-                self._reg_queue.get(block=False)
-            except gevent.queue.Queue.Empty:
-                break
+        self._clear_queue()
 
         try:
             # Try register the Node 3 times with aggregator before failing back to next aggregator
@@ -265,6 +497,7 @@ class Aggregator(object):
                     self.logger.writeInfo("Node Registered with {} at version {}"
                                           .format(self.aggregator, self.aggregator_apiversion))
                     self._registered()
+                    self._synced_aggregator = self.aggregator
 
                     # Trigger registration of Nodes resources
                     self._register_node_resources()
@@ -282,7 +515,48 @@ class Aggregator(object):
             self.logger.writeError("Failed to register node {}".format(e))
         return False
 
-    def _register_node_resources(self):
+    def _resync_node(self, registered_versions):
+        """Bring an aggregator which already holds the Node up to date, given the versions of the Node's resources it
+        holds. The Node is registered again in place, then only resources which are missing or out of date are queued
+        for registration, and resources the Node no longer has are queued for deletion.
+        Returns True if the Node was registered with the aggregator, else False"""
+        self._clear_queue()
+
+        R = self._send("POST", self.aggregator, self.aggregator_apiversion, "resource", self._node_data["node"])
+        if R.status_code in [200, 201]:
+            self.logger.writeInfo("Node re-synchronised with {} at version {}"
+                                  .format(self.aggregator, self.aggregator_apiversion))
+            self._registered()
+            self._synced_aggregator = self.aggregator
+            self._register_node_resources(registered_versions)
+            return True
+
+        # Delete node from aggregator & re-register
+        if self._unregister_node(R.headers.get('Location')):
+            return self._register_node(self._node_data["node"])
+        return False
+
+    def _clear_queue(self):
+        """Discard queued requests, which are superseded when the Node's resources are re-registered"""
+        # Requests still in flight which fail will be added to the list being replaced, and so dropped too
+        self._failed_requests = []
+        while not self._reg_queue.empty():
+            try:
+                self._reg_queue.get(block=False)
+            except gevent.queue.Empty:
+                break
+
+    def _synced_with(self, aggregator):
+        """Whether `aggregator` is believed to hold the current contents of the local mirror"""
+        return self._node_data["registered"] and self._synced_aggregator == aggregator
+
+    def _register_node_resources(self, registered_versions=None):
+        """Queue registration of the Node's resources. If `registered_versions` is given, as a dict of (type, id) to
+        the version held by the aggregator, resources the aggregator holds at their current version are skipped and
+        resources the Node no longer has are deleted"""
+        if registered_versions is not None:
+            self._queue_stale_resource_deletions(registered_versions)
+
         # Re-register items that must be ordered
         # Re-register things we have in the local cache.
         # "namespace" is e.g. "resource"
@@ -293,7 +567,8 @@ class Aggregator(object):
                     self.logger.writeInfo("Ordered re-registration for type: '{}' in namespace '{}'"
                                           .format(res_type, namespace))
                     for key in entities[res_type]:
-                        self._queue_request("POST", namespace, res_type, key)
+                        if self._needs_registration(namespace, res_type, key, registered_versions):
+                            self._queue_request("POST", namespace, res_type, key)
 
         # Re-register everything else
         # Re-register things we have in the local cache.
@@ -307,6 +582,85 @@ class Aggregator(object):
                     for key in entities[res_type]:
                         self._queue_request("POST", namespace, res_type, key)
 
+    def _needs_registration(self, namespace, res_type, key, registered_versions):
+        """Whether a resource in the local mirror differs from the version held by the aggregator"""
+        if registered_versions is None or namespace != "resource":
+            return True
+        data = self._node_data["entities"][namespace][res_type][key]["data"]
+        version = data.get("version")
+        return version is None or registered_versions.get((res_type, data["id"])) != version
+
+    def _queue_stale_resource_deletions(self, registered_versions):
+        """Queue deletion of resources held by the aggregator which are no longer in the local mirror, children first"""
+        entities = self._node_data["entities"].get("resource", {})
+        local_ids = set((res_type, obj["data"]["id"]) for (res_type, objs) in entities.items() for obj in objs.values())
+        for res_type in reversed(self.registration_order):
+            for (registered_type, res_id) in registered_versions:
+                if registered_type == res_type and (res_type, res_id) not in local_ids:
+                    self._queue_request("DELETE", "resource", res_type, res_id)
+
+    def _fetch_registered_versions(self):
+        """Find the versions of the Node's resources held by the aggregator, from a Query API on the same host, as a
+        dict of (type, id) to version. Returns None if they can't be found, e.g. if there is no such Query API"""
+        if self.aggregator_apiversion == "v1.0":
+            # Flows can only be found by Device from v1.1
+            return None
+        query_api = self._get_query_api()
+        if query_api is None:
+            self.logger.writeInfo("No Query API found on the same host as {}".format(self.aggregator))
+            return None
+
+        session = self._new_session()
+        try:
+            if OAUTH_MODE is True and self.auth_client is not None:
+                with self.auth_registry.app.app_context():
+                    session.token = self.auth_registry.fetch_local_token()
+            node_id = self._node_data["node"]["data"]["id"]
+            devices = self._query_resources(session, query_api, "device", {"node_id": node_id})
+            registered_versions = dict((("device", device["id"]), device["version"]) for device in devices)
+            for res_type in self.registration_order:
+                if res_type == "device":
+                    continue
+                for device in devices:
+                    for resource in self._query_resources(session, query_api, res_type, {"device_id": device["id"]}):
+                        registered_versions[(res_type, resource["id"])] = resource["version"]
+            return registered_versions
+        except (requests.exceptions.RequestException, ValueError, KeyError, TypeError) as e:
+            self.logger.writeWarning("Failed to query resources held by {}: {}".format(query_api, e))
+            return None
+        finally:
+            session.close()
+
+    def _get_query_api(self):
+        """Find a Query API on the same host as the current aggregator, so that it reflects the aggregator's contents"""
+        aggregator_host = urlparse(self.aggregator).hostname
+        self.mdnsbridge.updateServices(QUERY_MDNSTYPE)
+        while True:
+            try:
+                query_api = self.mdnsbridge.getHrefWithException(
+                    QUERY_MDNSTYPE, None, self.aggregator_apiversion, PROTOCOL, OAUTH_MODE)
+            except (NoService, EndOfServiceList):
+                return None
+            if urlparse(query_api).hostname == aggregator_host:
+                return query_api
+
+    def _query_resources(self, session, query_api, res_type, params):
+        """Return all resources of `res_type` matching `params` from a Query API, following pages of older results"""
+        url = urljoin(query_api, "{}/{}/{}s/".format(QUERY_APIROOT, self.aggregator_apiversion, res_type))
+        resources = []
+        while url is not None:
+            resp = session.get(url, params=params, timeout=1.0)
+            resp.raise_for_status()
+            page = resp.json()
+            resources.extend(page)
+            url = None
+            # The previous page's link carries the query, and the last page is the first to be less than full
+            limit = resp.headers.get("X-Paging-Limit")
+            if limit is not None and len(page) >= int(limit) and "prev" in resp.links:
+                url = resp.links["prev"]["url"]
+                params = None
+        return resources
+
     def _registered(self):
         """Mark Node as registered and reset counters"""
         if(self._mdns_updater is not None):
@@ -316,6 +670,7 @@ class Aggregator(object):
         self._aggregator_list_stale = True
 
         self._reset_backoff_period()
+        self._registration_ready.set()
 
     def _reset_backoff_period(self):
         self.logger.writeDebug("Resetting backoff period")
@@ -395,68 +750,201 @@ class Aggregator(object):
             return False
 
     def _process_queue(self):
-        """Provided the Node is believed to be correctly registered, hand off a single request to the SEND method
+        """Provided the Node is believed to be correctly registered, hand off requests to a pool of senders.
+           Requests for the same namespace and type are sent concurrently, but the pool is allowed to empty before
+           moving on to another type or sending another request for a resource which is still in flight, so that
+           resources are registered in the order they were queued (e.g. following 'registration_order').
            On client error, clear the resource from the local mirror
+           On server side error, return failed requests to the front of the queue and choose another aggregator
            On other error, mark Node as unregistered and trigger re-registration"""
         self.logger.writeDebug("Starting HTTP queue processing thread")
-        # Checks queue not empty before quitting to make sure unregister node gets done
         while self._running:
-            if (not self._node_data["registered"] or self._reg_queue.empty()
-                    or self._backoff_active or not self.aggregator):
-                gevent.sleep(1)
+            if self._failed_requests:
+                # Retry failed requests before anything else, even if another aggregator has already been chosen
+                self._drain_send_pool()
+            if not self._ready_to_send():
+                self._drain_send_pool()
+                if not self._ready_to_send():
+                    # Block until the Node is registered, rather than polling
+                    self._registration_ready.clear()
+                    self._registration_ready.wait()
+                continue
+            try:
+                # Block until a request is queued
+                queue_item = self._reg_queue.get()
+            except gevent.queue.Empty:
+                # Woken by stop() or by a failed request
+                continue
+            except Exception as e:
+                self._handle_queue_error(e)
+                continue
+            send_group = (queue_item["namespace"], queue_item["res_type"])
+            request_key = send_group + (queue_item["key"],)
+            if len(self._send_pool) > 0 and (send_group != self._send_group or request_key in self._in_flight):
+                self._send_pool.join()
+            if not self._ready_to_send() or self._failed_requests:
+                # Registration was lost while waiting, or an earlier request failed and must be retried first
+                self._add_request_to_front_of_queue(queue_item)
+                self._drain_send_pool()
+                continue
+            self._send_group = send_group
+            batch = self._take_batch(queue_item)
+            if len(batch) > 1:
+                self._in_flight.update(self._request_keys(batch))
+                self._send_pool.spawn(self._send_queued_batch, batch, self._failed_requests)
             else:
-                try:
-                    queue_item = self._reg_queue.get()
-                    namespace = queue_item["namespace"]
-                    res_type = queue_item["res_type"]
-                    res_key = queue_item["key"]
-                    if queue_item["method"] == "POST":
-                        if res_type == "node":
-                            send_obj = self._node_data.get("node")
-                        else:
-                            send_obj = self._node_data["entities"][namespace][res_type].get(res_key)
-
-                        if send_obj is None:
-                            self.logger.writeError("No data to send for resource {}".format(res_type))
-                            continue
-                        try:
-                            self._send("POST", self.aggregator, self.aggregator_apiversion,
-                                       "{}".format(namespace), send_obj)
-                            self.logger.writeInfo("Registered {} {} {}".format(namespace, res_type, res_key))
-                        except InvalidRequest as e:
-                            self.logger.writeWarning("Error registering {} {}: {}".format(res_type, res_key, e))
-                            self.logger.writeWarning("Request data: {}".format(send_obj))
-                            del self._node_data["entities"][namespace][res_type][res_key]
-
-                    elif queue_item["method"] == "DELETE":
-                        translated_type = res_type + 's'
-                        if namespace == "resource" and res_type == "node":
-                            # Handle special Node type
-                            self._node_data["node"] = None
-                            self._node_data["registered"] = False
-                        try:
-                            self._send("DELETE", self.aggregator, self.aggregator_apiversion,
-                                       "{}/{}/{}".format(namespace, translated_type, res_key))
-                            self.logger.writeInfo("Un-registered {} {} {}".format(namespace, translated_type, res_key))
-                        except InvalidRequest as e:
-                            self.logger.writeWarning("Error deleting resource {} {}: {}"
-                                                     .format(translated_type, res_key, e))
-                    else:
-                        self.logger.writeWarning("Method {} not supported for Registration API interactions"
-                                                 .format(queue_item["method"]))
-                except ServerSideError:
-                    self.aggregator = None
-                    self._aggregator_failure = True
-                    self._add_request_to_front_of_queue(queue_item)
-                except Exception as e:
-                    self.logger.writeError("Unexpected Error while processing queue, marking Node for re-registration\n"
-                                           "{}".format(e))
-                    self._node_data["registered"] = False
-                    self.aggregator = None
-                    if(self._mdns_updater is not None):
-                        self._mdns_updater.P2P_disable()
+                self._in_flight.add(request_key)
+                self._send_pool.spawn(self._send_queued_request, queue_item, request_key, self._failed_requests)
+        self._send_pool.join()
         self.logger.writeDebug("Stopping HTTP queue processing thread")
 
+    def _drain_send_pool(self):
+        """Wait for in-flight requests to complete, then return any which failed to the front of the queue in the
+        order they were originally queued"""
+        self._send_pool.join()
+        failed_requests = self._failed_requests
+        self._failed_requests = []
+        for queue_item in reversed(failed_requests):
+            self._add_request_to_front_of_queue(queue_item)
+
+    def _request_failed(self, failed_requests, queue_items):
+        """Hold on to requests which couldn't be sent, and wake the queue processing thread to return them to the front
+        of the queue. `failed_requests` is the list in use when they were taken from the queue, so requests taken
+        before the queue was cleared are dropped"""
+        failed_requests.extend(queue_items)
+        self._reg_queue.interrupt()
+
+    def _send_queued_request(self, queue_item, request_key, failed_requests=None):
+        """Send a single request taken from the queue, run within the pool of senders"""
+        if failed_requests is None:
+            failed_requests = self._failed_requests
+        try:
+            if not self._ready_to_send():
+                self._request_failed(failed_requests, [queue_item])
+                return
+            self._process_request(queue_item)
+        except ServerSideError:
+            self.aggregator = None
+            self._aggregator_failure = True
+            self._request_failed(failed_requests, [queue_item])
+        except Exception as e:
+            self._handle_queue_error(e)
+        finally:
+            self._in_flight.discard(request_key)
+
+    @staticmethod
+    def _request_keys(batch):
+        return [(queue_item["namespace"], queue_item["res_type"], queue_item["key"]) for queue_item in batch]
+
+    def _batch_enabled(self):
+        return self._batch_size > 1 and self._batch_unsupported != self.aggregator
+
+    def _take_batch(self, queue_item):
+        """Take further POSTs for the same namespace and type from the queue, to be sent along with `queue_item` to
+        the aggregator's batch endpoint. Returns a list of the requests to send together."""
+        batch = [queue_item]
+        if not self._batch_enabled() or queue_item["method"] != "POST" or queue_item["res_type"] == "node":
+            return batch
+        while len(batch) < self._batch_size:
+            try:
+                next_item = self._reg_queue.get(block=False)
+            except gevent.queue.Empty:
+                break
+            if (next_item["method"] != "POST" or next_item["namespace"] != queue_item["namespace"] or
+                    next_item["res_type"] != queue_item["res_type"] or
+                    self._request_keys([next_item])[0] in self._in_flight):
+                self._add_request_to_front_of_queue(next_item)
+                break
+            batch.append(next_item)
+        return batch
+
+    def _send_queued_batch(self, batch, failed_requests=None):
+        """Send a batch of POSTs for one namespace and type in a single request, run within the pool of senders.
+        If the aggregator rejects the batch, each request is sent individually instead."""
+        namespace = batch[0]["namespace"]
+        res_type = batch[0]["res_type"]
+        if failed_requests is None:
+            failed_requests = self._failed_requests
+        try:
+            if not self._ready_to_send():
+                self._request_failed(failed_requests, batch)
+                return
+            entities = self._node_data["entities"][namespace][res_type]
+            send_objs = [entities[queue_item["key"]] for queue_item in batch if queue_item["key"] in entities]
+            try:
+                self._send("POST", self.aggregator, self.aggregator_apiversion,
+                           "{}/{}".format(namespace, BATCH_PATH), send_objs)
+                self.logger.writeInfo("Registered {} {} {} in a batch".format(len(send_objs), namespace, res_type))
+            except InvalidRequest as e:
+                if e.status_code in [404, 405]:
+                    self.logger.writeInfo("Aggregator {} does not offer a batch endpoint".format(self.aggregator))
+                    self._batch_unsupported = self.aggregator
+                else:
+                    self.logger.writeWarning("Error registering batch of {} {}: {}".format(res_type, namespace, e))
+                for (queue_item, request_key) in zip(batch, self._request_keys(batch)):
+                    self._send_queued_request(queue_item, request_key, failed_requests)
+        except ServerSideError:
+            self.aggregator = None
+            self._aggregator_failure = True
+            self._request_failed(failed_requests, batch)
+        except Exception as e:
+            self._handle_queue_error(e)
+        finally:
+            self._in_flight.difference_update(self._request_keys(batch))
+
+    def _process_request(self, queue_item):
+        namespace = queue_item["namespace"]
+        res_type = queue_item["res_type"]
+        res_key = queue_item["key"]
+        if queue_item["method"] == "POST":
+            if res_type == "node":
+                send_obj = self._node_data.get("node")
+            else:
+                send_obj = self._node_data["entities"][namespace][res_type].get(res_key)
+
+            if send_obj is None:
+                self.logger.writeError("No data to send for resource {}".format(res_type))
+                return
+            try:
+                self._send("POST", self.aggregator, self.aggregator_apiversion,
+                           "{}".format(namespace), send_obj)
+                self.logger.writeInfo("Registered {} {} {}".format(namespace, res_type, res_key))
+            except InvalidRequest as e:
+                self.logger.writeWarning("Error registering {} {}: {}".format(res_type, res_key, e))
+                self.logger.writeWarning("Request data: {}".format(send_obj))
+                del self._node_data["entities"][namespace][res_type][res_key]
+                self._record(namespace, res_type, res_key)
+
+        elif queue_item["method"] == "DELETE":
+            translated_type = res_type + 's'
+            if namespace == "resource" and res_type == "node":
+                # Handle special Node type
+                self._node_data["node"] = None
+                self._node_data["registered"] = False
+                self._record("resource", "node", "")
+            try:
+                self._send("DELETE", self.aggregator, self.aggregator_apiversion,
+                           "{}/{}/{}".format(namespace, translated_type, res_key))
+                self.logger.writeInfo("Un-registered {} {} {}".format(namespace, translated_type, res_key))
+            except InvalidRequest as e:
+                self.logger.writeWarning("Error deleting resource {} {}: {}"
+                                         .format(translated_type, res_key, e))
+        else:
+            self.logger.writeWarning("Method {} not supported for Registration API interactions"
+                                     .format(queue_item["method"]))
+
+    def _handle_queue_error(self, e):
+        self.logger.writeError("Unexpected Error while processing queue, marking Node for re-registration\n"
+                               "{}".format(e))
+        self._node_data["registered"] = False
+        self.aggregator = None
+        if(self._mdns_updater is not None):
+            self._mdns_updater.P2P_disable()
+
+    def _ready_to_send(self):
+        """Whether requests may be sent to the Registration API"""
+        return self._node_data["registered"] and self.aggregator and not self._backoff_active
+
     def _queue_request(self, method, namespace, res_type, key):
         """Queue a request to be processed.
            Handles all requests except initial Node POST which is done in _process_reregister"""
@@ -464,23 +952,7 @@ class Aggregator(object):
 
     def _add_request_to_front_of_queue(self, request):
         """Adds item to the front of the queue"""
-
-        new_queue = deque()
-        new_queue.append(request)
-
-        # Drain the queue
-        while not self._reg_queue.empty():
-            try:
-                new_queue.append(self._reg_queue.get())
-            except gevent.queue.Queue.Empty:
-                break
-
-        # Add items back to the queue
-        while True:
-            try:
-                self._reg_queue.put(new_queue.popleft())
-            except IndexError:
-                break
+        self._reg_queue.put_front(request)
 
     def register_auth_client(self, client_name, client_uri):
         """Function for Registering OAuth client with Auth Server and instantiating OAuth Client class"""
@@ -533,29 +1005,76 @@ class Aggregator(object):
         """Unregister 'resource' type data including the Node"""
         self.unregister_from("resource", res_type, key)
 
-    def register_into(self, namespace, res_type, key, **kwargs):
-        """General register method for 'resource' types"""
-        data = kwargs
+    def _send_obj(self, res_type, key, data):
         send_obj = {"type": res_type, "data": data}
         if 'id' not in send_obj["data"]:
             self.logger.writeWarning("No 'id' present in data, using key='{}': {}".format(key, data))
             send_obj["data"]["id"] = key
+        return send_obj
+
+    def register_into(self, namespace, res_type, key, **kwargs):
+        """General register method for 'resource' types"""
+        data = kwargs
+        send_obj = self._send_obj(res_type, key, data)
 
         if namespace == "resource" and res_type == "node":
             # Ensure Registered with Auth Server (is there a better place for this)
             if OAUTH_MODE is True:
                 self.register_auth_client("nmos-node-{}".format(data["id"]), FQDN)
             # Handle special Node type when Node is not registered, by immediately registering
+            self._record("resource", "node", "", send_obj)
             if self._node_data["node"] is None:
                 # Will trigger registration in main thread
                 self._node_data["node"] = send_obj
                 return
             # Update Node Data
             self._node_data["node"] = send_obj
+            self._queue_node_update()
+            return
+        elif self._mirror_resource(namespace, res_type, key, send_obj):
+            self._queue_request("POST", namespace, res_type, key)
+
+    def register_many_into(self, namespace, res_type, resources):
+        """Register several resources of one type, given as a dict of key to resource data.
+        The local mirror is updated for every resource before their POSTs are queued back to back, so that when
+        batching is enabled the queue processing thread sends them to the batch endpoint together"""
+        if namespace == "resource" and res_type == "node":
+            for (key, data) in resources.items():
+                self.register_into(namespace, res_type, key, **data)
+            return
+        changed = [key for (key, data) in resources.items()
+                   if self._mirror_resource(namespace, res_type, key, self._send_obj(res_type, key, dict(data)))]
+        for key in changed:
+            self._queue_request("POST", namespace, res_type, key)
+
+    def _mirror_resource(self, namespace, res_type, key, send_obj):
+        """Store a resource in the local mirror, returning whether it needs to be sent to the aggregator"""
+        self._add_mirror_keys(namespace, res_type)
+        restored = (namespace, res_type, key) in self._restored_keys
+        self._restored_keys.discard((namespace, res_type, key))
+        if restored and self._node_data["entities"][namespace][res_type].get(key) == send_obj:
+            # Unchanged since it was restored from the journal, so the aggregator already has it
+            return False
+        self._node_data["entities"][namespace][res_type][key] = send_obj
+        self._record(namespace, res_type, key, send_obj)
+        return True
+
+    def _queue_node_update(self):
+        """Queue a Node update once the coalescing window has elapsed. Further updates made within the window only
+        modify the local mirror, so a burst of changes results in a single registration of the final Node data"""
+        if self._node_update_pending:
+            return
+        self._node_update_pending = True
+        if self._node_update_window > 0:
+            gevent.spawn_later(self._node_update_window, self._flush_node_update)
         else:
-            self._add_mirror_keys(namespace, res_type)
-            self._node_data["entities"][namespace][res_type][key] = send_obj
-        self._queue_request("POST", namespace, res_type, key)
+            self._flush_node_update()
+
+    def _flush_node_update(self):
+        """Queue the pending Node update, provided the Node hasn't been unregistered in the meantime"""
+        self._node_update_pending = False
+        if self._node_data["node"] is not None:
+            self._queue_request("POST", "resource", "node", self._node_data["node"]["data"]["id"])
 
     def unregister_from(self, namespace, res_type, key):
         """General unregister method for 'resource' types"""
@@ -563,11 +1082,14 @@ class Aggregator(object):
             # Handle special Node type
             self._unregister_node()
             self._node_data["node"] = None
+            self._record("resource", "node", "")
             return
         elif res_type in self._node_data["entities"][namespace]:
             self._add_mirror_keys(namespace, res_type)
             if key in self._node_data["entities"][namespace][res_type]:
                 del self._node_data["entities"][namespace][res_type][key]
+                self._record(namespace, res_type, key)
+        self._restored_keys.discard((namespace, res_type, key))
         self._queue_request("DELETE", namespace, res_type, key)
 
     def _add_mirror_keys(self, namespace, res_type):
@@ -577,18 +1099,64 @@ class Aggregator(object):
         if res_type not in self._node_data["entities"][namespace]:
             self._node_data["entities"][namespace][res_type] = {}
 
+    def _restore_from_journal(self, path):
+        """Open the journal of the local mirror, first restoring the mirror from it.
+        Restored resources are registered along with the Node, without waiting for back-end services to register
+        them again. Any which haven't been registered again after a grace period are unregistered."""
+        try:
+            journal = MirrorJournal(path)
+            entities = journal.replay()
+        except (sqlite3.Error, ValueError) as e:
+            self.logger.writeError("Unable to open journal {}: {}".format(path, e))
+            return
+        for (namespace, res_type, key, value) in entities:
+            if namespace == "resource" and res_type == "node":
+                self._node_data["node"] = value
+            else:
+                self._add_mirror_keys(namespace, res_type)
+                self._node_data["entities"][namespace][res_type][key] = value
+                self._restored_keys.add((namespace, res_type, key))
+        self._journal = journal
+        if self._restored_keys:
+            self.logger.writeInfo("Restored {} resources from journal {}".format(len(self._restored_keys), path))
+            gevent.spawn_later(JOURNAL_RESTORE_GRACE_SECONDS, self._expire_restored_resources)
+
+    def _expire_restored_resources(self):
+        """Unregister resources restored from the journal which no back-end service has registered again"""
+        for (namespace, res_type, key) in list(self._restored_keys):
+            self.logger.writeInfo("Unregistering {} {} {}, which was restored from the journal but not registered again"
+                                  .format(namespace, res_type, key))
+            self.unregister_from(namespace, res_type, key)
+
+    def _record(self, namespace, res_type, key, value=None):
+        """Record a change to the local mirror in the journal, if there is one. A value of None records removal"""
+        if self._journal is None:
+            return
+        try:
+            self._journal.record(namespace, res_type, key, value)
+        except sqlite3.Error as e:
+            self.logger.writeError("Unable to write to journal, which will no longer be kept: {}".format(e))
+            self._journal = None
+
     def stop(self):
         """Stop the Aggregator object running"""
         self.logger.writeDebug("Stopping aggregator proxy")
         self._running = False
+        self._registration_ready.set()
+        self._reg_queue.interrupt()
         self.main_thread.join()
         self.queue_thread.join()
+        self._close_session()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
 
     def status(self):
         """Return the current status of node in the aggregator"""
         return {"api_href": self.aggregator,
                 "api_version": self.aggregator_apiversion,
-                "registered": self._node_data["registered"]}
+                "registered": self._node_data["registered"],
+                "heartbeats": dict(self._heartbeat_scheduler.metrics)}
 
     def _send(self, method, aggregator, api_ver, url, data=None):
         """Handle sending request to the registration API, with error handling
@@ -642,22 +1210,70 @@ class Aggregator(object):
 
         # If not in OAuth mode, perform standard request
         if OAUTH_MODE is False or self.auth_client is None:
-            return requests.request(**kwargs)
+            return self._get_session(aggregator).request(**kwargs)
         else:
-            # If in OAuth Mode, use OAuth client to automatically fetch token / refresh token if expired
+            # If in OAuth Mode, use OAuth client session to automatically refresh token if expired
             with self.auth_registry.app.app_context():
                 try:
-                    return self.auth_client.request(**kwargs)
+                    session = self._get_session(aggregator)
+                    if not session.token:
+                        # No token was stored when the session was created, e.g. before authorization completed
+                        session.token = self.auth_registry.fetch_local_token()
+                    return session.request(**kwargs)
                 # General OAuth Error (e.g. incorrect request details, invalid client, etc.)
                 except OAuth2Error as e:
                     self.logger.writeError(
                         "Failed to fetch token before making API call to {}. {}".format(url, e))
                     self.auth_registrar = self.auth_client = None
 
+    def _get_session(self, aggregator):
+        """Return the persistent HTTP session used for requests to `aggregator`.
+        The session is replaced when a different aggregator is selected or the OAuth client changes"""
+        session_key = (aggregator, self.auth_client)
+        if self._session is None or self._session_key != session_key:
+            self._close_session()
+            self._session = self._new_session()
+            self._session_key = session_key
+        return self._session
+
+    def _new_session(self):
+        if OAUTH_MODE is False or self.auth_client is None:
+            session = requests.Session()
+        else:
+            # Authlib's OAuth2 session, which is also a requests.Session, configured as the OAuth client's own requests
+            # are. It refreshes the token when it expires, storing the new token in the auth registry
+            client_kwargs = dict(self.auth_client.client_kwargs)
+            client_kwargs["token_endpoint"] = (self.auth_client.access_token_url or
+                                               self.auth_client.load_server_metadata().get("token_endpoint"))
+            session = self.auth_client.client_cls(
+                client_id=self.auth_client.client_id,
+                client_secret=self.auth_client.client_secret,
+                token=self.auth_registry.fetch_local_token(),
+                update_token=self.auth_registry.update_local_token,
+                **client_kwargs)
+        # Allow a connection for each concurrent sender, plus one for heartbeats
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=REGISTRATION_CONCURRENCY + 1)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _close_session(self):
+        if self._session is not None:
+            self._session.close()
+        self._session = None
+        self._session_key = None
+
 
 class MDNSUpdater(object):
+    """Maintains the Node's mDNS advertisement, including the TXT records which announce changes to its resources
+    while in peer-to-peer mode. TXT records are updated from a background thread, which applies only the latest
+    state and waits at least `min_update_interval` seconds between updates.
+    Each 'ver_*' counter is incremented at most once per update, however many resources of its type have changed,
+    so that peers see each distinct state and the 8-bit counters don't wrap around during a burst of changes.
+    Updates are further limited by token buckets, overall and per counter. A counter which is out of tokens isn't
+    incremented until it has one, and the change it represents is announced then."""
     def __init__(self, mdns_engine, mdns_type, mdns_name, mappings, port, logger, p2p_enable=False, p2p_cut_in_count=2,
-                 txt_recs=None):
+                 txt_recs=None, min_update_interval=MDNS_MIN_UPDATE_INTERVAL):
         self.mdns = mdns_engine
         self.mdns_type = mdns_type
         self.mdns_name = mdns_name
@@ -678,25 +1294,73 @@ class MDNSUpdater(object):
         self.mdns.register(self.mdns_name, self.mdns_type, self.port, self.txt_rec_base)
 
         self._running = True
-        self._mdns_update_queue = gevent.queue.Queue()
+        self._min_update_interval = min_update_interval
+        self._last_update = None
+        self._applied_txt_recs = dict(self.txt_rec_base)
+        self._changed_types = set()  # Types with changes not yet announced by incrementing their counter
+        self._announce_bucket = TokenBucket(MDNS_ANNOUNCE_RATE, MDNS_ANNOUNCE_BURST)
+        self._counter_buckets = dict((mapValue, TokenBucket(MDNS_COUNTER_RATE, MDNS_COUNTER_BURST))
+                                     for mapValue in itervalues(self.mappings))
+        # Set when the TXT records need updating. The records to apply are derived from the current state when the
+        # update is made, so any number of changes in the meantime result in a single update
+        self._update_pending = gevent.event.Event()
         self.mdns_thread = gevent.spawn(self._modify_mdns)
 
     def _modify_mdns(self):
         while self._running:
-            if self._mdns_update_queue.empty():
-                gevent.sleep(0.2)
-            else:
-                try:
-                    txt_recs = self._mdns_update_queue.get()
-                    self.mdns.update(self.mdns_name, self.mdns_type, txt_recs)
-                except ServiceNotFoundException:
-                    self.logger.writeError("Unable to update mDNS record of type {} and name {}"
-                                           .format(self.mdns_name, self.mdns_type))
+            self._update_pending.wait()
+            delay = self._update_delay()
+            if delay > 0:
+                gevent.sleep(delay)
+            if not self._running:
+                break
+            self._update_pending.clear()
+            self._announce_changed_types()
+            txt_recs = self._current_txt_recs()
+            if txt_recs == self._applied_txt_recs:
+                continue
+            self._announce_bucket.consume()
+            self._last_update = monotonic()
+            try:
+                self.mdns.update(self.mdns_name, self.mdns_type, txt_recs)
+                self._applied_txt_recs = txt_recs
+            except ServiceNotFoundException:
+                self.logger.writeError("Unable to update mDNS record of type {} and name {}"
+                                       .format(self.mdns_name, self.mdns_type))
+
+    def _update_delay(self):
+        """Return the number of seconds to wait before the pending update may be made"""
+        delay = self._announce_bucket.delay()
+        if self._last_update is not None:
+            delay = max(delay, self._last_update + self._min_update_interval - monotonic())
+        if self._current_txt_recs() == self._applied_txt_recs and self._changed_types:
+            # Nothing to announce but changes to counters, so wait until one of them may be incremented
+            delay = max(delay, min(self._counter_buckets[self.mappings[type]].delay() for type in self._changed_types))
+        return delay
+
+    def _announce_changed_types(self):
+        """Increment the counter for each type with unannounced changes, unless it has been incremented too often.
+        Changes which can't yet be announced remain pending."""
+        if not self.p2p_enable:
+            self._changed_types.clear()
+            return
+        for type in list(self._changed_types):
+            if self._counter_buckets[self.mappings[type]].consume():
+                self._increment_service_version(type)
+                self._changed_types.discard(type)
+        if self._changed_types:
+            self._update_pending.set()
 
     def stop(self):
         self._running = False
+        self._update_pending.set()
         self.mdns_thread.join()
 
+    def _current_txt_recs(self):
+        if self.p2p_enable:
+            return self._p2p_txt_recs()
+        return dict(self.txt_rec_base)
+
     def _p2p_txt_recs(self):
         txt_recs = self.txt_rec_base.copy()
         txt_recs.update(self.service_versions)
@@ -706,8 +1370,8 @@ class MDNSUpdater(object):
         if self.p2p_enable:
             if (action == "register") or (action == "update") or (action == "unregister"):
                 self.logger.writeDebug("mDNS action: {} {}".format(action, type))
-                self._increment_service_version(type)
-                self._mdns_update_queue.put(self._p2p_txt_recs())
+                self._changed_types.add(type)
+                self._update_pending.set()
 
     def _increment_service_version(self, type):
         self.service_versions[self.mappings[type]] = self.service_versions[self.mappings[type]] + 1
@@ -728,14 +1392,14 @@ class MDNSUpdater(object):
         if not self.p2p_enable:
             self.logger.writeInfo("Enabling P2P Discovery")
             self.p2p_enable = True
-            self._mdns_update_queue.put(self._p2p_txt_recs())
+            self._update_pending.set()
 
     def P2P_disable(self):
         if self.p2p_enable:
             self.logger.writeInfo("Disabling P2P Discovery")
             self.p2p_enable = False
             self._reset_P2P_enable_count()
-            self._mdns_update_queue.put(self.txt_rec_base)
+            self._update_pending.set()
         else:
             self._reset_P2P_enable_count()
 
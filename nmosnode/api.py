@@ -14,15 +14,20 @@
 
 from __future__ import print_function
 
+import json
 import requests
 
 from os import urandom
-from flask import request, url_for, redirect
+from binascii import hexlify
+from flask import request, url_for, redirect, g
 from six import itervalues
-from six.moves.urllib.parse import urljoin
+from six.moves.urllib.parse import urljoin, urlencode
 
+from nmoscommon import ptptime
 from nmoscommon.nmoscommonconfig import config as _config
-from nmoscommon.webapi import WebAPI, route, resource_route, abort
+from nmoscommon.flask_cors import crossdomain
+from nmoscommon.json import NMOSJSONEncoder
+from nmoscommon.webapi import WebAPI, route, resource_route, abort, IppResponse
 
 # Config Parameters
 PROTOCOL = "https" if _config.get('https_mode') == "enabled" else "http"
@@ -38,6 +43,86 @@ if PROTOCOL == "https":
 
 RESOURCE_TYPES = ["sources", "flows", "devices", "senders", "receivers"]
 
+# Endpoints whose JSON responses carry an ETag, allowing conditional GETs. Lists are also served from a cache.
+RESOURCE_LIST_ENDPOINT = "_resource_list"
+ETAG_ENDPOINTS = [RESOURCE_LIST_ENDPOINT, "_resource_id"]
+
+# Indentation of each resource within a list, matching the layout of other JSON responses
+LIST_ITEM_INDENT = " " * 4
+
+# Query parameters for resource lists. Filters select resources with the given attribute value. Lists are paged by
+# resource version as in the IS-04 Query API, if any paging parameter is given
+FILTER_ATTRIBUTES = ["device_id", "format", "transport"]
+PAGING_PARAMS = ["paging.limit", "paging.since", "paging.until"]
+PAGING_DEFAULT_LIMIT = 10
+PAGING_MAX_LIMIT = 1000
+# Version given to resources without a valid version when paging, which sorts as the oldest
+UNVERSIONED = (0, 0)
+
+
+def resource_response(response):
+    """Add the CORS headers carried by responses from resource routes"""
+    return crossdomain(origin='*', methods=['GET', 'HEAD'],
+                       headers=['Content-Type', 'Authorization', 'api-key'])(lambda: response)()
+
+
+def encode_list_item(resource):
+    """Encode a resource as UTF-8 JSON, laid out as an item of a list so that lists can be built by joining items"""
+    document = json.dumps(resource, indent=4, cls=NMOSJSONEncoder)
+    return (LIST_ITEM_INDENT + document.replace("\n", "\n" + LIST_ITEM_INDENT)).encode("utf-8")
+
+
+def parse_version(version):
+    """Parse a resource version or paging timestamp, "<seconds>:<nanoseconds>", into a tuple which sorts by time"""
+    (seconds, nanoseconds) = version.split(":")
+    return (int(seconds), int(nanoseconds))
+
+
+def resource_version(resource):
+    """Return the parsed version of a resource for paging. Resources whose version is missing or invalid, which
+    back-end services may send, are treated as the oldest possible, with version 0:0"""
+    try:
+        return max(parse_version(resource["version"]), UNVERSIONED)
+    except (KeyError, ValueError, AttributeError, TypeError):
+        return UNVERSIONED
+
+
+def format_version(version):
+    return "{}:{}".format(*version)
+
+
+def page_resources(resources, limit, since=None, until=None):
+    """Select a page of resources with versions after `since` and up to `until`, most recent first, as in the IS-04
+    Query API. If only `since` is given the page holds the oldest resources in range, and otherwise the most recent.
+    Return the page along with the range of versions it covers, which is narrowed if some resources didn't fit"""
+    newest_first = sorted(((resource_version(resource), resource) for resource in resources),
+                          key=lambda entry: entry[0], reverse=True)
+    oldest_first = since is not None and until is None
+    if until is None:
+        until = tuple(ptptime.ptp_detail())
+    if since is None:
+        # Without a lower bound the range starts at, and includes, resources without a valid version
+        since = UNVERSIONED
+        in_range = [(version, resource) for (version, resource) in newest_first if version <= until]
+    else:
+        in_range = [(version, resource) for (version, resource) in newest_first if since < version <= until]
+    if len(in_range) <= limit:
+        page = in_range
+    elif oldest_first:
+        page = in_range[-limit:]
+        until = page[0][0]
+    else:
+        page = in_range[:limit]
+        since = in_range[limit][0]
+    return [resource for (version, resource) in page], since, until
+
+
+def encode_list(items):
+    """Join items from `encode_list_item` into a JSON list"""
+    if not items:
+        return b"[]"
+    return b"[\n" + b",\n".join(items) + b"\n]"
+
 
 class FacadeAPI(WebAPI):
     def __init__(self, nmos_registry, auth_registry=None):
@@ -49,6 +134,122 @@ class FacadeAPI(WebAPI):
         self.auth_client = None
         if self.auth_registry:
             self.auth_registry.init_app(self.app)
+        # Serialised resource lists by (api_version, resource_type), along with the ETag each was built for
+        self._response_cache = {}
+        # Distinguishes ETags from those issued before a restart, when the registry's change counts start again
+        self._etag_prefix = hexlify(urandom(4)).decode("ascii")
+        self.app.before_request(self._conditional_response)
+        self.app.after_request(self._tag_response)
+        self.app.after_request(self._add_headers)
+
+    def _etag(self, api_version, resource_type):
+        """Return the ETag for the current content of a resource type, or None if the request will be rejected"""
+        if api_version not in NODE_APIVERSIONS:
+            return None
+        if resource_type == "self":
+            return "{}-{}".format(self._etag_prefix, self.registry.change_count("node"))
+        elif resource_type in RESOURCE_TYPES:
+            return "{}-{}".format(self._etag_prefix, self.registry.change_count(resource_type.rstrip("s")))
+        return None
+
+    def _conditional_response(self):
+        """Answer a GET for a resource list or resource whose content hasn't changed without rebuilding it.
+        If the client already holds the current content, respond 304. Otherwise, serve a list from the cache, or
+        join the registry's encoded resources into a new list without serialising them again.
+        The ETag is found before the response is built, so it can never be newer than the content it's sent with."""
+        g.etag = None
+        if request.method not in ["GET", "HEAD"] or request.endpoint not in ETAG_ENDPOINTS:
+            return None
+        best_match = request.accept_mimetypes.best_match(['application/json', 'text/html', 'rick/roll'])
+        if best_match in ['text/html', 'rick/roll']:
+            # HTML renderings are built as usual, without an ETag
+            return None
+        api_version = request.view_args["api_version"]
+        resource_type = request.view_args["resource_type"]
+        etag = self._etag(api_version, resource_type)
+        if etag is None:
+            return None
+        g.etag = etag
+        if request.if_none_match.contains_weak(etag) and self._representation_exists(api_version, resource_type):
+            return resource_response(IppResponse(status=304, mimetype="application/json"))
+        if request.endpoint == RESOURCE_LIST_ENDPOINT and resource_type in RESOURCE_TYPES and not request.args:
+            cached = self._response_cache.get((api_version, resource_type))
+            if cached is not None and cached[0] == etag:
+                return resource_response(IppResponse(cached[1], mimetype='application/json'))
+            items = self.registry.list_resource_json(resource_type.rstrip("s"), api_version=api_version)
+            if isinstance(items, list):
+                return resource_response(IppResponse(encode_list(items), mimetype='application/json'))
+        return None
+
+    def _representation_exists(self, api_version, resource_type):
+        """Return whether the request is for content which can exist, so may be answered with 304.
+        A list always exists, but a single resource is looked up for an `If-None-Match: *` condition, as there's no
+        resource for the wildcard to match if it has been removed or was never registered."""
+        if request.endpoint == RESOURCE_LIST_ENDPOINT:
+            return True
+        if resource_type not in RESOURCE_TYPES:
+            # The Node itself is only served as a list
+            return False
+        if not request.if_none_match.star_tag:
+            return True
+        resource_id = request.view_args["resource_id"]
+        return self.registry.get_resource(resource_type.rstrip("s"), resource_id, api_version=api_version) is not None
+
+    def _tag_response(self, response):
+        """Add the ETag found for the request to its response, caching the body of a resource list"""
+        etag = g.get("etag")
+        if etag is None or response.status_code not in [200, 304]:
+            return response
+        response.set_etag(etag)
+        # Allow clients to store the response, provided they revalidate it
+        response.headers["Cache-Control"] = "no-cache"
+        if response.status_code == 200 and request.endpoint == RESOURCE_LIST_ENDPOINT and not request.args:
+            key = (request.view_args["api_version"], request.view_args["resource_type"])
+            cached = self._response_cache.get(key)
+            if cached is None or cached[0] != etag:
+                self._response_cache[key] = (etag, response.get_data())
+        return response
+
+    def _add_headers(self, response):
+        """Add any headers set aside by a route for its response"""
+        if response.status_code == 200:
+            response.headers.extend(g.get("headers", {}))
+        return response
+
+    def _paging_args(self):
+        """Return the limit, since and until for a paged resource list, or abort if any is invalid"""
+        try:
+            limit = int(request.args.get("paging.limit", PAGING_DEFAULT_LIMIT))
+            since = request.args.get("paging.since")
+            until = request.args.get("paging.until")
+            since = parse_version(since) if since is not None else None
+            until = parse_version(until) if until is not None else None
+        except ValueError:
+            abort(400, "Invalid paging parameters")
+        if limit < 1:
+            abort(400, "Invalid paging parameters")
+        if since is not None and until is not None and since > until:
+            abort(400, "paging.since is later than paging.until")
+        return min(limit, PAGING_MAX_LIMIT), since, until
+
+    def _page(self, resources):
+        """Return a page of resources, setting aside the paging headers for the response"""
+        (limit, since, until) = self._paging_args()
+        (page, since, until) = page_resources(resources, limit, since, until)
+        args = dict((key, value) for (key, value) in request.args.items() if key not in PAGING_PARAMS)
+        args["paging.limit"] = limit
+        links = [
+            ("next", dict(args, **{"paging.since": format_version(until)})),
+            ("prev", dict(args, **{"paging.until": format_version(since)})),
+        ]
+        g.headers = {
+            "Link": ", ".join('<{}?{}>; rel="{}"'.format(request.base_url, urlencode(sorted(link_args.items())), rel)
+                              for (rel, link_args) in links),
+            "X-Paging-Limit": str(limit),
+            "X-Paging-Since": format_version(since),
+            "X-Paging-Until": format_version(until),
+        }
+        return page
 
     @route('/')
     def root(self):
@@ -94,7 +295,12 @@ class FacadeAPI(WebAPI):
             return self.registry.list_self(api_version=api_version)
         elif resource_type not in RESOURCE_TYPES:
             abort(404)
-        return list(itervalues(self.registry.list_resource(resource_type.rstrip("s"), api_version=api_version)))
+        filters = dict((attr, request.args[attr]) for attr in FILTER_ATTRIBUTES if attr in request.args)
+        resources = list(itervalues(self.registry.list_resource(resource_type.rstrip("s"), api_version=api_version,
+                                                                filters=filters)))
+        if any(param in request.args for param in PAGING_PARAMS):
+            return self._page(resources)
+        return resources
 
     @resource_route(NODE_APIROOT + "<api_version>/<resource_type>/<resource_id>/")
     def resource_id(self, api_version, resource_type, resource_id):
@@ -102,11 +308,10 @@ class FacadeAPI(WebAPI):
             abort(404)
         if resource_type not in RESOURCE_TYPES:
             abort(404)
-        resources = self.registry.list_resource(resource_type.rstrip("s"), api_version=api_version)
-        if resource_id in resources:
-            return resources[resource_id]
-        else:
+        resource = self.registry.get_resource(resource_type.rstrip("s"), resource_id, api_version=api_version)
+        if resource is None:
             abort(404)
+        return resource
 
     @resource_route(NODE_APIROOT + "<api_version>/receivers/<receiver_id>/target",
                     methods=['PUT'])
@@ -16,7 +16,7 @@ from __future__ import absolute_import
 from __future__ import print_function
 import gevent
 import os
-from nmoscommon.ipc import Proxy
+from nmoscommon.ipc import Proxy, RemoteException
 from threading import Lock
 from nmoscommon.logger import Logger
 from copy import deepcopy
@@ -28,6 +28,8 @@ FAC_UNAUTHORISED = 3
 FAC_UNSUPPORTED = 4
 FAC_OTHERERROR = 5
 
+IPC_BATCH_SIZE = 100  # Maximum number of resources sent in a single IPC call
+
 
 class Facade(object):
     """This class serves as a proxy for the Facade running on the same machine if it exists. If no facade exists
@@ -47,11 +49,13 @@ class Facade(object):
         self.href = None
         self.proxy_path = None
         self.lock = Lock()  # Protect access to IPC socket
+        self.batch_ipc = True  # Flag whether the facade provides the batched IPC methods
 
     def setup_ipc(self):
         with self.lock:
             try:
                 self.ipc = Proxy(self.address)
+                self.batch_ipc = True
             except Exception:
                 self.ipc = None
 
@@ -120,22 +124,35 @@ class Facade(object):
 
         # TODO(clyntp): the following blocks are so similar...
 
-        # re-register resources
+        # re-register resources, in batches of each type
         for type in self.resources:
+            resources = {}
             for key in self.resources[type]:
+                resource = self.resources[type][key]
+                # Hide some implementation details for receivers
+                if type == "receiver":
+                    resource = deepcopy(self.resources[type][key])
+                    if "pipel_id" in self.resources[type][key]:
+                        resource.pop('pipel_id')
+                    if "pipeline_id" in self.resources[type][key]:
+                        resource.pop('pipeline_id')
+                resources[key] = resource
+            for keys in self._batches(list(resources.keys())):
                 try:
                     with self.lock:
-                        resource = self.resources[type][key]
-                        # Hide some implementation details for receivers
-                        if type == "receiver":
-                            resource = deepcopy(self.resources[type][key])
-                            if "pipel_id" in self.resources[type][key]:
-                                resource.pop('pipel_id')
-                            if "pipeline_id" in self.resources[type][key]:
-                                resource.pop('pipeline_id')
-                        self.ipc.res_register(self.srv_type, self.pid, type, key, resource)
+                        if self.batch_ipc:
+                            try:
+                                self.ipc.res_register_many(self.srv_type, self.pid, type,
+                                                           dict((key, resources[key]) for key in keys))
+                            except RemoteException as e:
+                                if not self._method_unsupported(e):
+                                    raise
+                                self._batch_ipc_unsupported()
+                        if not self.batch_ipc:
+                            for key in keys:
+                                self.ipc.res_register(self.srv_type, self.pid, type, key, resources[key])
                 except Exception as e:
-                    self.logger.writeError("Exception when re-registering resource: {}".format(str(e)))
+                    self.logger.writeError("Exception when re-registering resources: {}".format(str(e)))
                     self.ipc = None
                     gevent.sleep(0)
                     return
@@ -155,6 +172,32 @@ class Facade(object):
 
         self.reregister = False
 
+    def _batches(self, items):
+        """Split a list into chunks of at most IPC_BATCH_SIZE items"""
+        for i in range(0, len(items), IPC_BATCH_SIZE):
+            yield items[i:i + IPC_BATCH_SIZE]
+
+    def _method_unsupported(self, e):
+        """Return whether an exception from the IPC proxy reports that the facade doesn't provide the method"""
+        return isinstance(e, RemoteException) and e.args == ("AttributeError",)
+
+    def _batch_ipc_unsupported(self):
+        self.logger.writeWarning("Facade doesn't provide batched IPC methods, falling back to one call per resource")
+        self.batch_ipc = False
+
+    def _call_batch_ipc_method(self, method, type, batch):
+        """Call `res_register_many` with a dict of resources, or `res_unregister_many` with a list of keys, falling back
+        to a call per resource if the facade is an older one which doesn't provide the batched methods"""
+        if self.batch_ipc:
+            self._call_ipc_method(method, type, batch)
+            if self.batch_ipc:
+                return
+        for key in batch:
+            if method == "res_register_many":
+                self._call_ipc_method("res_register", type, key, batch[key])
+            else:
+                self._call_ipc_method("res_unregister", type, key)
+
     def _call_ipc_method(self, method, *args, **kwargs):
         if not self.srv_registered:
             # Don't attempt if not registered - will just hit many timeouts
@@ -169,6 +212,10 @@ class Facade(object):
             with self.lock:
                 return self.ipc.invoke_named(method, self.srv_type, self.pid, *args, **kwargs)
         except Exception as e:
+            if method in ["res_register_many", "res_unregister_many"] and self._method_unsupported(e):
+                # The connection is still good, so the caller can fall back to the unbatched methods
+                self._batch_ipc_unsupported()
+                return
             self.logger.writeError("Exception when calling IPC method: {}".format(str(e)))
             self.ipc = None
             self.reregister = True
@@ -187,7 +234,28 @@ class Facade(object):
         self.resources[type][key] = value
         self._call_ipc_method("res_update", type, key, value)
 
+    def addResources(self, type, resources):
+        """Register several resources of the same type, given as a dict of key to value"""
+        resources = deepcopy(resources)
+        if type not in self.resources:
+            self.resources[type] = {}
+        self.resources[type].update(resources)
+        for keys in self._batches(list(resources.keys())):
+            self._call_batch_ipc_method("res_register_many", type, dict((key, resources[key]) for key in keys))
+
     def delResource(self, type, key):
+        self._forget_resource(type, key)
+        self._call_ipc_method("res_unregister", type, key)
+
+    def delResources(self, type, keys):
+        """Unregister several resources of the same type, given as a list of keys"""
+        keys = list(keys)
+        for key in keys:
+            self._forget_resource(type, key)
+        for batch in self._batches(keys):
+            self._call_batch_ipc_method("res_unregister_many", type, batch)
+
+    def _forget_resource(self, type, key):
         if type in self.resources:
             # Hack until adoption of flow instances (Ensure transports for flow are deleted)
             if type == "flow" and "transport" in self.resources:
@@ -196,7 +264,6 @@ class Facade(object):
                         del self.resources["transport"][transport]
             if key in self.resources[type]:
                 del self.resources[type][key]
-        self._call_ipc_method("res_unregister", type, key)
 
     def addControl(self, device_id, control_data):
         if device_id not in self.controls:
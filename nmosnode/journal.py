@@ -0,0 +1,63 @@
+# Copyright 2019 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import sqlite3
+
+# Compact once this many records have been appended, or as many as were live after the last compaction if greater
+COMPACT_MIN_RECORDS = 1000
+
+
+class MirrorJournal(object):
+    """Append-only journal of changes to the Aggregator's local mirror, held in an SQLite database so that the mirror
+    can be rebuilt after a restart. Each change is appended as a record of the new value of one entity, or of its
+    removal. Compaction drops records superseded by a later record for the same entity, and records of removals."""
+    def __init__(self, path):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        # Commits to the write-ahead log don't wait for the disk, which is synced at each checkpoint instead
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS journal (seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                         "namespace TEXT NOT NULL, res_type TEXT NOT NULL, key TEXT NOT NULL, value TEXT)")
+        self._db.commit()
+        self._appended = 0
+        self._live = 0
+
+    def replay(self):
+        """Return the entities which haven't been removed, in the order they were last changed, as a list of
+        (namespace, res_type, key, value) tuples. The journal is compacted first, so this is a single read"""
+        self.compact()
+        cursor = self._db.execute("SELECT namespace, res_type, key, value FROM journal ORDER BY seq")
+        return [(namespace, res_type, key, json.loads(value)) for (namespace, res_type, key, value) in cursor]
+
+    def record(self, namespace, res_type, key, value=None):
+        """Append the new value of an entity, or its removal if `value` is None"""
+        self._db.execute("INSERT INTO journal (namespace, res_type, key, value) VALUES (?, ?, ?, ?)",
+                         (namespace, res_type, key, json.dumps(value) if value is not None else None))
+        self._db.commit()
+        self._appended += 1
+        if self._appended >= max(COMPACT_MIN_RECORDS, self._live):
+            self.compact()
+
+    def compact(self):
+        """Keep only the latest record for each entity, dropping entities which have been removed"""
+        with self._db:
+            self._db.execute("DELETE FROM journal WHERE seq NOT IN "
+                             "(SELECT MAX(seq) FROM journal GROUP BY namespace, res_type, key)")
+            self._db.execute("DELETE FROM journal WHERE value IS NULL")
+        self._live = self._db.execute("SELECT COUNT(*) FROM journal").fetchone()[0]
+        self._appended = 0
+
+    def close(self):
+        self._db.close()
@@ -16,17 +16,20 @@ from __future__ import print_function, absolute_import
 
 import json
 import time
+import hashlib
+import heapq
 import threading
 import copy
+import functools
 from six.moves.urllib.parse import urlparse, urlunparse
-from six import itervalues
+from six import itervalues, string_types
 
 from nmoscommon.logger import Logger
 from nmoscommon import ptptime
 from nmoscommon.mdns.mdnsExceptions import ServiceAlreadyExistsException
 from nmoscommon.utils import translate_api_version, api_ver_compare
 
-from .api import NODE_REGVERSION, PROTOCOL
+from .api import NODE_APIVERSIONS, NODE_REGVERSION, PROTOCOL, FILTER_ATTRIBUTES, encode_list_item
 
 try:
     # Use internal BBC RD ipputils to get PTP if available
@@ -37,7 +40,9 @@ except ImportError:
     IPP_UTILS_CLOCK_AVAILABLE = False
 
 HEARTBEAT_TIMEOUT = 12  # Seconds
-CLEANUP_INTERVAL = 5  # Seconds
+
+# Attempts a reader makes to build a snapshot without the lock while writers are making changes, before taking the lock
+SNAPSHOT_ATTEMPTS = 3
 
 # TODO: Enumerate return codes better?
 
@@ -49,6 +54,15 @@ RES_UNSUPPORTED = 4
 RES_OTHERERROR = 5
 
 
+def locked(function):
+    """Decorator for FacadeRegistry methods which modify its state, serialising them on the registry's lock"""
+    @functools.wraps(function)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return function(self, *args, **kwargs)
+    return wrapper
+
+
 class FacadeRegistryCleaner(threading.Thread):
     def __init__(self, registry):
         self.stopping = False
@@ -57,16 +71,15 @@ class FacadeRegistryCleaner(threading.Thread):
         self.daemon = True
 
     def run(self):
-        loopcount = 0
         while not self.stopping:
-            time.sleep(1)
-            loopcount += 1
-            if loopcount >= CLEANUP_INTERVAL:
-                self.registry.cleanup_services()
-                loopcount = 0
+            # Sleep until the next service is due to expire, or until an earlier expiry is scheduled
+            delay = self.registry.cleanup_services()
+            self.registry.expiry_changed.wait(delay)
+            self.registry.expiry_changed.clear()
 
     def stop(self):
         self.stopping = True
+        self.registry.expiry_changed.set()
         self.join()
 
 
@@ -75,6 +88,11 @@ class FacadeRegistry(object):
         # `node_data` must be correctly structured
         self.permitted_resources = resources
         self.services = {}
+        # Heap of (expiry time, sequence number, service name), used to time out services lacking a heartbeat.
+        # Entries are checked against the service's latest heartbeat when they reach the top of the heap.
+        self._expiry_heap = []
+        self._expiry_seq = 0
+        self.expiry_changed = threading.Event()
         self.clocks = {"clk0": {"name": "clk0", "ref_type": "internal"}}
         self.aggregator = aggregator
         self.mdns_updater = mdns_updater
@@ -82,13 +100,50 @@ class FacadeRegistry(object):
         assert "interfaces" in node_data  # Check data conforms to latest supported API version
         self.node_data = node_data
         self.logger = Logger("facade_registry", logger)
-
+        # Writers (IPC calls, the cleaner and PTP updates) are serialised on this lock. Readers serving the Node API
+        # don't take it, but work from snapshots and values which writers replace rather than modify in place.
+        self._lock = threading.RLock()
+        # Index of registered resources by type and key, mapping to the name of the owning service
+        self._resource_index = {}
+        # Index of registered resources by type, attribute and attribute value, mapping to a frozenset of keys, so
+        # that the Node API can filter resources without scanning every resource. Writers replace the sets rather than
+        # modifying them, so readers can use them without the lock
+        self._attribute_index = {}
+        for resource_name in self.permitted_resources:
+            self._resource_index[resource_name] = {}
+            self._attribute_index[resource_name] = dict((attr, {}) for attr in FILTER_ATTRIBUTES)
+        # Immutable snapshot of registered resources by type, mapping key to value, along with the change count it was
+        # built at. Rebuilt by the next reader once the count has moved on, so that listing never iterates over dicts
+        # which are being modified
+        self._snapshots = {}
+        # Cache of preprocess_resource output, and of its encoding as JSON, by (type, key). Each entry records the
+        # value and cache epoch it was built from, so that output from a reader holding an outdated value is never
+        # returned for a newer one
+        self._resource_cache = {}
+        self._cache_epoch = 0
+        # Count of changes to each type of resource, and to the Node as type "node", from which the Node API derives
+        # ETags. Writers increment a count after making a change, so content read after a count reflects that change
+        self._change_counts = {}
+        # Translated Node resource by API version, rebuilt whenever the Node is updated
+        self._node_documents = {}
+        self._build_node_documents()
+        self._node_hash = self._hash_node()
+
+    @locked
     def modify_node(self, **kwargs):
+        old_host = self.node_data.get("host")
         for key in kwargs.keys():
             if key in self.node_data:
                 self.node_data[key] = kwargs[key]
+        if self.node_data.get("host") != old_host:
+            # Control and manifest URLs are rewritten using the Node's host
+            self._cache_epoch += 1
+            self._resource_cache.clear()
+            for type in self.permitted_resources:
+                self._changed(type)
         self.update_node()
 
+    @locked
     def update_node(self):
         self.node_data["services"] = []
         for service_name in self.services:
@@ -102,13 +157,37 @@ class FacadeRegistry(object):
                 "authorization": self.services[service_name]["authorization"]
             })
         self.node_data["clocks"] = list(itervalues(self.clocks))
+        node_hash = self._hash_node()
+        if node_hash == self._node_hash:
+            # Nothing has changed, so don't bump the version or re-register
+            return
+        self._node_hash = node_hash
         self.node_data["version"] = str(ptptime.ptp_detail()[0]) + ":" + str(ptptime.ptp_detail()[1])
+        self._build_node_documents()
+        self._changed("node")
         try:
-            self.aggregator.register("node", self.node_id, **self.preprocess_resource("node", self.node_data["id"],
-                                     self.node_data, NODE_REGVERSION))
+            self.aggregator.register("node", self.node_id, **self._node_document(NODE_REGVERSION))
         except Exception as e:
             self.logger.writeError("Exception re-registering node: {}".format(e))
 
+    def _hash_node(self):
+        """Hash the content of the Node resource, excluding its version"""
+        content = dict((k, v) for (k, v) in self.node_data.items() if k != "version")
+        return hashlib.sha1(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _build_node_documents(self):
+        # Build the new set of documents before replacing the old one, so readers never see a partial set
+        self._node_documents = dict(
+            (api_version, translate_api_version(self.node_data, "node", api_version))
+            for api_version in NODE_APIVERSIONS
+        )
+
+    def _node_document(self, api_version):
+        if api_version not in self._node_documents:
+            self._node_documents[api_version] = translate_api_version(self.node_data, "node", api_version)
+        return self._node_documents[api_version]
+
+    @locked
     def register_service(self, name, srv_type, pid, href=None, proxy_path=None, authorization=False):
         if name in self.services:
             return RES_EXISTS
@@ -127,9 +206,11 @@ class FacadeRegistry(object):
         for resource_name in self.permitted_resources:
             self.services[name]["resource"][resource_name] = {}
 
+        self._schedule_expiry(name, self.services[name]["heartbeat"] + HEARTBEAT_TIMEOUT)
         self.update_node()
         return RES_SUCCESS
 
+    @locked
     def update_service(self, name, pid, href=None, proxy_path=None):
         if name not in self.services:
             return RES_NOEXISTS
@@ -141,14 +222,15 @@ class FacadeRegistry(object):
         self.update_node()
         return RES_SUCCESS
 
+    @locked
     def unregister_service(self, name, pid):
         if name not in self.services:
             return RES_NOEXISTS
         if self.services[name]["pid"] != pid:
             return RES_UNAUTHORISED
         for namespace in ["resource", "control"]:
-            for type in self.services[name][namespace].keys():
-                for key in self.services[name][namespace][type].keys():
+            for type in list(self.services[name][namespace].keys()):
+                for key in list(self.services[name][namespace][type].keys()):
                     if namespace == "control":
                         self._register(name, "control", pid, type, "remove", self.services[name][namespace][type][key])
                     else:
@@ -157,6 +239,7 @@ class FacadeRegistry(object):
         self.update_node()
         return RES_SUCCESS
 
+    @locked
     def heartbeat_service(self, name, pid):
         if name not in self.services:
             return RES_NOEXISTS
@@ -165,17 +248,40 @@ class FacadeRegistry(object):
         self.services[name]["heartbeat"] = time.time()
         return RES_SUCCESS
 
+    def _schedule_expiry(self, name, expiry):
+        self._expiry_seq += 1
+        self.services[name]["expiry_seq"] = self._expiry_seq
+        heapq.heappush(self._expiry_heap, (expiry, self._expiry_seq, name))
+        if self._expiry_heap[0][1] == self._expiry_seq:
+            # Wake the cleaner if this is now the earliest expiry
+            self.expiry_changed.set()
+
+    @locked
     def cleanup_services(self):
-        timed_out = time.time() - HEARTBEAT_TIMEOUT
-        for name in list(self.services.keys()):
-            if self.services[name]["heartbeat"] < timed_out:
+        """Unregister services whose heartbeat has expired. Returns the number of seconds until the next service is
+        due to expire, or None if no services are registered"""
+        now = time.time()
+        while len(self._expiry_heap) > 0 and self._expiry_heap[0][0] <= now:
+            expiry, seq, name = heapq.heappop(self._expiry_heap)
+            if name not in self.services or self.services[name]["expiry_seq"] != seq:
+                # Service has since been unregistered or registered again
+                continue
+            heartbeat_expiry = self.services[name]["heartbeat"] + HEARTBEAT_TIMEOUT
+            if heartbeat_expiry > now:
+                self._schedule_expiry(name, heartbeat_expiry)
+            else:
                 self.unregister_service(name, self.services[name]["pid"])
+        if len(self._expiry_heap) > 0:
+            return max(self._expiry_heap[0][0] - now, 0)
+        return None
 
+    @locked
     def register_resource(self, service_name, pid, type, key, value):
         if type not in self.permitted_resources:
             return RES_UNSUPPORTED
         return self._register(service_name, "resource", pid, type, key, value)
 
+    @locked
     def register_control(self, service_name, pid, device_id, control_data):
         return self._register(
             service_name=service_name,
@@ -186,17 +292,32 @@ class FacadeRegistry(object):
             value=control_data
         )
 
+    def _check_api_version(self, service_name, key, value):
+        if "max_api_version" not in value:
+            self.logger.writeWarning(
+                "Service {}: Registration without valid api version specified".format(service_name)
+            )
+            value["max_api_version"] = "v1.0"
+        elif api_ver_compare(value["max_api_version"], NODE_REGVERSION) < 0:
+            self.logger.writeWarning(
+                "Trying to register resource with api version too low: '{}' : {}".format(key, json.dumps(value))
+            )
+
+    def _store_resource(self, service_name, type, key, value):
+        # Add a node_id to those resources which need one
+        if type == 'device':
+            value['node_id'] = self.node_id
+
+        old_value = self._registered_value(type, key)
+        self.services[service_name]["resource"][type][key] = value
+        self._resource_index[type][key] = service_name
+        self._reindex_resource(type, key, old_value, value)
+        self._invalidate_resource(type, key)
+        self._changed(type)
+
     def _register(self, service_name, namespace, pid, type, key, value):
         if namespace != "control":
-            if "max_api_version" not in value:
-                self.logger.writeWarning(
-                    "Service {}: Registration without valid api version specified".format(service_name)
-                )
-                value["max_api_version"] = "v1.0"
-            elif api_ver_compare(value["max_api_version"], NODE_REGVERSION) < 0:
-                self.logger.writeWarning(
-                    "Trying to register resource with api version too low: '{}' : {}".format(key, json.dumps(value))
-                )
+            self._check_api_version(service_name, key, value)
         if service_name not in self.services:
             return RES_NOEXISTS
         if not self.services[service_name]["pid"] == pid:
@@ -204,10 +325,6 @@ class FacadeRegistry(object):
         if key == "00000000-0000-0000-0000-000000000000":
             return RES_OTHERERROR
 
-        # Add a node_id to those resources which need one
-        if type == 'device':
-            value['node_id'] = self.node_id
-
         if namespace == "control":
             if type not in self.services[service_name][namespace]:
                 # 'type' is the Device ID in this case
@@ -219,6 +336,7 @@ class FacadeRegistry(object):
             else:
                 # Unregister
                 self.services[service_name][namespace][type].pop(value["href"], None)
+            self._invalidate_resource("device", type)
 
             # Reset the parameters below to force re-registration of the corresponding Device
             namespace = "resource"
@@ -226,15 +344,17 @@ class FacadeRegistry(object):
             type = "device"
             value = None
 
-            for name in self.services:  # Find the service which registered the Device in question
-                if key in self.services[name]["resource"][type]:
-                    value = self.services[name]["resource"][type][key]
-                    break
+            owner = self.find_service(type, key)  # Find the service which registered the Device in question
+            if owner is not None:
+                # Replace the Device with a copy, so readers can tell its controls have changed
+                value = dict(self.services[owner]["resource"][type][key])
+                self.services[owner]["resource"][type][key] = value
+                self._changed(type)
 
             if not value:  # Device isn't actually registered at present
                 return RES_SUCCESS
         else:
-            self.services[service_name][namespace][type][key] = value
+            self._store_resource(service_name, type, key, value)
 
         # Don't pass non-registration exceptions to clients
         try:
@@ -252,20 +372,96 @@ class FacadeRegistry(object):
             return RES_OTHERERROR
         return RES_SUCCESS
 
+    @locked
+    def register_resources(self, service_name, pid, type, resources):
+        """Register a dict of resources of one type, returning a dict of result codes by key.
+        All of the resources are stored before mDNS is updated once and the aggregator is passed the whole batch."""
+        if type not in self.permitted_resources:
+            return dict((key, RES_UNSUPPORTED) for key in resources)
+        if service_name not in self.services:
+            return dict((key, RES_NOEXISTS) for key in resources)
+        if self.services[service_name]["pid"] != pid:
+            return dict((key, RES_UNAUTHORISED) for key in resources)
+
+        results = {}
+        registered = []
+        for (key, value) in resources.items():
+            if key == "00000000-0000-0000-0000-000000000000":
+                results[key] = RES_OTHERERROR
+                continue
+            self._check_api_version(service_name, key, value)
+            self._store_resource(service_name, type, key, value)
+            registered.append(key)
+            results[key] = RES_SUCCESS
+
+        if not registered:
+            return results
+
+        # Don't pass non-registration exceptions to clients
+        try:
+            self._update_mdns(type)
+        except Exception as e:
+            self.logger.writeError("Exception registering with mDNS: {}".format(e))
+
+        try:
+            self.aggregator.register_many_into("resource", type, dict(
+                (key, self.preprocess_resource(type, key, resources[key], NODE_REGVERSION)) for key in registered
+            ))
+            self.logger.writeDebug("registering {} {} resources".format(len(registered), type))
+        except Exception as e:
+            self.logger.writeError("Exception registering resources: {}".format(e))
+            for key in registered:
+                results[key] = RES_OTHERERROR
+        return results
+
     def update_resource(self, service_name, pid, type, key, value):
         return self.register_resource(service_name, pid, type, key, value)
 
+    def update_resources(self, service_name, pid, type, resources):
+        return self.register_resources(service_name, pid, type, resources)
+
     def find_service(self, type, key):
-        for service_name in self.services.keys():
-            if key in self.services[service_name]["resource"][type]:
-                return service_name
-        return None
+        return self._resource_index.get(type, {}).get(key)
 
+    @locked
     def unregister_resource(self, service_name, pid, type, key):
         if type not in self.permitted_resources:
             return RES_UNSUPPORTED
         return self._unregister(service_name, "resource", pid, type, key)
 
+    @locked
+    def unregister_resources(self, service_name, pid, type, keys):
+        """Unregister a list of resources of one type, returning a dict of result codes by key.
+        mDNS is updated once all of the resources have been removed."""
+        if type not in self.permitted_resources:
+            return dict((key, RES_UNSUPPORTED) for key in keys)
+        if service_name not in self.services:
+            return dict((key, RES_NOEXISTS) for key in keys)
+        if self.services[service_name]["pid"] != pid:
+            return dict((key, RES_UNAUTHORISED) for key in keys)
+
+        results = {}
+        for key in keys:
+            if key == "00000000-0000-0000-0000-000000000000":
+                results[key] = RES_OTHERERROR
+                continue
+            self._remove_resource(service_name, "resource", type, key)
+            # Don't pass non-registration exceptions to clients
+            try:
+                self.aggregator.unregister_from("resource", type, key)
+                results[key] = RES_SUCCESS
+            except Exception as e:
+                self.logger.writeError("Exception unregistering resource: {}".format(e))
+                results[key] = RES_OTHERERROR
+
+        if len(results) > 0:
+            try:
+                self._update_mdns(type)
+            except Exception as e:
+                self.logger.writeError("Exception unregistering from mDNS: {}".format(e))
+        return results
+
+    @locked
     def unregister_control(self, service_name, pid, device_id, control_data):
         # Note use of register here, as we're updating an existing Device
         return self._register(service_name, "control", pid, device_id, "remove", control_data)
@@ -278,7 +474,7 @@ class FacadeRegistry(object):
         if key == "00000000-0000-0000-0000-000000000000":
             return RES_OTHERERROR
 
-        self.services[service_name][namespace][type].pop(key, None)
+        self._remove_resource(service_name, namespace, type, key)
 
         # Don't pass non-registration exceptions to clients
         try:
@@ -297,6 +493,53 @@ class FacadeRegistry(object):
             return RES_OTHERERROR
         return RES_SUCCESS
 
+    def _remove_resource(self, service_name, namespace, type, key):
+        if namespace == "resource":
+            old_value = self._registered_value(type, key)
+        self.services[service_name][namespace][type].pop(key, None)
+        self._invalidate_resource(type, key)
+        if namespace == "resource" and self._resource_index[type].get(key) == service_name:
+            del self._resource_index[type][key]
+            # Hand the key over to any other service which has also registered it
+            for name in self.services:
+                if key in self.services[name][namespace][type]:
+                    self._resource_index[type][key] = name
+                    break
+            self._reindex_resource(type, key, old_value, self._registered_value(type, key))
+        self._changed(type)
+
+    def _registered_value(self, type, key):
+        """Return the value of a resource held by the service which owns it, or None if it isn't registered"""
+        owner = self._resource_index[type].get(key)
+        if owner is None:
+            return None
+        return self.services[owner]["resource"][type].get(key)
+
+    def _reindex_resource(self, type, key, old_value, new_value):
+        """Move a resource's key between the attribute index entries for its old and new values"""
+        for (attr, index) in self._attribute_index[type].items():
+            old_attr = old_value.get(attr) if old_value else None
+            new_attr = new_value.get(attr) if new_value else None
+            if old_attr == new_attr:
+                continue
+            if isinstance(old_attr, string_types):
+                keys = index.get(old_attr, frozenset()) - {key}
+                if keys:
+                    index[old_attr] = keys
+                else:
+                    index.pop(old_attr, None)
+            if isinstance(new_attr, string_types):
+                index[new_attr] = index.get(new_attr, frozenset()) | {key}
+
+    def _changed(self, type):
+        """Record a change to resources of `type`, once it has been made, so that the snapshot is rebuilt on the next
+        read"""
+        self._change_counts[type] = self.change_count(type) + 1
+
+    def change_count(self, type):
+        """Return the number of changes made to resources of `type`"""
+        return self._change_counts.get(type, 0)
+
     def list_services(self, api_version="v1.0"):
         return list(self.services.keys())
 
@@ -327,12 +570,39 @@ class FacadeRegistry(object):
         parsed_url = parsed_url._replace(netloc=netloc, scheme=scheme)
         return urlunparse(parsed_url)
 
+    def _invalidate_resource(self, type, key):
+        self._resource_cache.pop((type, key), None)
+
+    def _cache_entry(self, type, key, value):
+        epoch = self._cache_epoch
+        entry = self._resource_cache.get((type, key))
+        if entry is None or entry[0] is not value or entry[1] != epoch:
+            entry = (value, epoch, {}, {})
+            self._resource_cache[(type, key)] = entry
+        return entry
+
     def preprocess_resource(self, type, key, value, api_version="v1.0"):
+        cached = self._cache_entry(type, key, value)[2]
+        cache_key = (api_version, value.get("version"))
+        if cache_key not in cached:
+            cached[cache_key] = self._preprocess_resource(type, key, value, api_version)
+        return cached[cache_key]
+
+    def encode_resource(self, type, key, value, api_version="v1.0"):
+        """Return preprocess_resource output encoded by `encode_list_item`, encoding it only once per version"""
+        encoded = self._cache_entry(type, key, value)[3]
+        cache_key = (api_version, value.get("version"))
+        if cache_key not in encoded:
+            encoded[cache_key] = encode_list_item(self.preprocess_resource(type, key, value, api_version))
+        return encoded[cache_key]
+
+    def _preprocess_resource(self, type, key, value, api_version):
         if type == "device":
             value_copy = copy.deepcopy(value)
-            for name in self.services:
-                if key in self.services[name]["control"] and "controls" in value_copy:
-                    value_copy["controls"] = value_copy["controls"] + list(self.services[name]["control"][key].values())
+            for service in list(self.services.values()):
+                if key in service["control"] and "controls" in value_copy:
+                    value_copy["controls"] = value_copy["controls"] + \
+                        copy.deepcopy(list(service["control"][key].values()))
             if "controls" in value_copy:
                 for control in value_copy["controls"]:
                     control["href"] = self.preprocess_url(control["href"])
@@ -345,25 +615,84 @@ class FacadeRegistry(object):
         else:
             return translate_api_version(value, type, api_version)
 
-    def list_resource(self, type, api_version="v1.0"):
+    def _api_version_permitted(self, value, api_version):
+        return api_version == "v1.0" or (
+            "max_api_version" in value and api_ver_compare(value["max_api_version"], api_version) >= 0
+        )
+
+    def list_resource(self, type, api_version="v1.0", filters=None):
+        """Return resources of `type` translated to `api_version`, by key. If given, `filters` maps attributes in
+        FILTER_ATTRIBUTES to the values which resources must have, and matching resources are found in the index"""
         if type not in self.permitted_resources:
             return RES_UNSUPPORTED
+        snapshot = self._snapshot(type)
+        if filters:
+            snapshot = self._filter_snapshot(type, snapshot, filters)
         response = {}
-        for name in self.services:
-            response = (dict(list(response.items()) + [
-                (k, self.preprocess_resource(type, k, x, api_version))
-                for (k, x) in self.services[name]["resource"][type].items()
-                if (api_version == "v1.0" or (
-                    "max_api_version" in x and api_ver_compare(x["max_api_version"], api_version) >= 0
-                ))
-            ]))
+        for (k, x) in snapshot.items():
+            if self._api_version_permitted(x, api_version):
+                response[k] = self.preprocess_resource(type, k, x, api_version)
         return response
 
+    def _filter_snapshot(self, type, snapshot, filters):
+        keys = None
+        for (attr, value) in filters.items():
+            matches = self._attribute_index[type][attr].get(value, frozenset())
+            keys = matches if keys is None else keys & matches
+        # The index may have been updated since the snapshot was taken, so check each value against the filters
+        return dict((key, snapshot[key]) for key in keys if key in snapshot and
+                    all(snapshot[key].get(attr) == value for (attr, value) in filters.items()))
+
+    def list_resource_json(self, type, api_version="v1.0"):
+        """As list_resource, but return a list of the resources encoded by `encode_list_item`"""
+        if type not in self.permitted_resources:
+            return RES_UNSUPPORTED
+        return [self.encode_resource(type, k, x, api_version) for (k, x) in self._snapshot(type).items()
+                if self._api_version_permitted(x, api_version)]
+
+    def _snapshot(self, type):
+        """Return the snapshot of resources of `type`, rebuilding it if there have been changes since it was built.
+        It's rebuilt without the lock, so readers don't wait for writers, unless writers keep making changes"""
+        count = self.change_count(type)
+        entry = self._snapshots.get(type)
+        if entry is not None and entry[0] == count:
+            return entry[1]
+        for _ in range(SNAPSHOT_ATTEMPTS):
+            snapshot = self._build_snapshot(type)
+            if self.change_count(type) == count:
+                # No change was completed while building, so the snapshot is consistent with the count
+                self._snapshots[type] = (count, snapshot)
+                return snapshot
+            count = self.change_count(type)
+        with self._lock:
+            snapshot = self._build_snapshot(type)
+            self._snapshots[type] = (self.change_count(type), snapshot)
+        return snapshot
+
+    def _build_snapshot(self, type):
+        # Copying a dict is atomic, but a resource may be removed by a writer before its value is looked up
+        snapshot = {}
+        for (key, name) in dict(self._resource_index[type]).items():
+            try:
+                snapshot[key] = self.services[name]["resource"][type][key]
+            except KeyError:
+                pass
+        return snapshot
+
+    def get_resource(self, type, key, api_version="v1.0"):
+        """Return a single resource translated to `api_version`, or None if it isn't available at that version"""
+        service_name = self.find_service(type, key)
+        try:
+            value = self.services[service_name]["resource"][type][key]
+        except KeyError:
+            # Not registered, or unregistered since the service was found
+            return None
+        if not self._api_version_permitted(value, api_version):
+            return None
+        return self.preprocess_resource(type, key, value, api_version)
+
     def _len_resource(self, type):
-        response = 0
-        for name in self.services:
-            response += len(self.services[name]["resource"][type])
-        return response
+        return len(self._resource_index[type])
 
     def _update_mdns(self, type):
         if type not in self.permitted_resources:
@@ -382,7 +711,7 @@ class FacadeRegistry(object):
             self.mdns_updater.update_mdns(type, "update")
 
     def list_self(self, api_version="v1.0"):
-        return self.preprocess_resource("node", self.node_data["id"], self.node_data, api_version)
+        return self._node_document(api_version)
 
     def _ptp_clock(self):
         clk = {
@@ -411,6 +740,7 @@ class FacadeRegistry(object):
             elif clk != old_clk:
                 self.update_clock(clk)
 
+    @locked
     def register_clock(self, clk_data):
         if "name" not in clk_data:
             return RES_OTHERERROR
@@ -420,6 +750,7 @@ class FacadeRegistry(object):
         self.update_node()
         return RES_SUCCESS
 
+    @locked
     def update_clock(self, clk_data):
         if "name" not in clk_data:
             return RES_OTHERERROR
@@ -429,6 +760,7 @@ class FacadeRegistry(object):
             return RES_SUCCESS
         return RES_NOEXISTS
 
+    @locked
     def unregister_clock(self, clk_name):
         if clk_name in self.clocks:
             del self.clocks[clk_name]
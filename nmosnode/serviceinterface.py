@@ -14,9 +14,23 @@
 
 from nmoscommon.ipc import Host
 from nmoscommon.logger import Logger
+from nmoscommon.nmoscommonconfig import config as _config
 
 ADDRESS = "ipc:///tmp/ips-nodefacade"
 
+# Log complete resource payloads received over IPC (at debug level), rather than just their type and key
+LOG_IPC_PAYLOADS = _config.get('nodefacade', {}).get('LOG_IPC_PAYLOADS', False)
+
+
+class LazyMessage(object):
+    """Log message which is only formatted if and when the logger renders it"""
+    def __init__(self, fmt, *args):
+        self.fmt = fmt
+        self.args = args
+
+    def __str__(self):
+        return self.fmt.format(*self.args)
+
 
 def ipcmethod(name=None):
     def decorator(function):
@@ -33,6 +47,7 @@ class FacadeInterface(object):
         self.host = Host(ADDRESS)
         self.registry = registry
         self.logger = Logger("facade_interface", logger)
+        self.log_payloads = LOG_IPC_PAYLOADS
 
         def getbases(cl):
             bases = list(cl.__bases__)
@@ -53,6 +68,11 @@ class FacadeInterface(object):
     def stop(self):
         self.host.stop()
 
+    def _log_resource(self, action, name, pid, type, key, value=None):
+        self.logger.writeInfo(LazyMessage("{} {} {} {} {}", action, name, pid, type, key))
+        if value is not None and self.log_payloads:
+            self.logger.writeDebug(LazyMessage("{} {} {}: {}", action, type, key, value))
+
     @ipcmethod
     def srv_register(self, name, srv_type, pid, href, proxy_path, authorization=False):
         self.logger.writeInfo("Service Register {}, {}, {}, {}, {}".format(name, srv_type, pid, href, proxy_path))
@@ -76,19 +96,33 @@ class FacadeInterface(object):
 
     @ipcmethod
     def res_register(self, name, pid, type, key, value):
-        self.logger.writeInfo("Resource Register {} {} {} {} {}".format(name, pid, type, key, value))
+        self._log_resource("Resource Register", name, pid, type, key, value)
         return self.registry.register_resource(name, pid, type, key, value)
 
     @ipcmethod
     def res_update(self, name, pid, type, key, value):
-        self.logger.writeInfo("Resource Update {} {} {} {} {}".format(name, pid, type, key, value))
+        self._log_resource("Resource Update", name, pid, type, key, value)
         return self.registry.update_resource(name, pid, type, key, value)
 
     @ipcmethod
     def res_unregister(self, name, pid, type, key):
-        self.logger.writeInfo("Resource Unregister {} {} {} {}".format(name, pid, type, key))
+        self._log_resource("Resource Unregister", name, pid, type, key)
         return self.registry.unregister_resource(name, pid, type, key)
 
+    @ipcmethod
+    def res_register_many(self, name, pid, type, resources):
+        self.logger.writeInfo(LazyMessage("Resource Register Many {} {} {} ({} resources)",
+                                          name, pid, type, len(resources)))
+        if self.log_payloads:
+            self.logger.writeDebug(LazyMessage("Resource Register Many {}: {}", type, resources))
+        return self.registry.register_resources(name, pid, type, resources)
+
+    @ipcmethod
+    def res_unregister_many(self, name, pid, type, keys):
+        self.logger.writeInfo(LazyMessage("Resource Unregister Many {} {} {} ({} resources)",
+                                          name, pid, type, len(keys)))
+        return self.registry.unregister_resources(name, pid, type, keys)
+
     @ipcmethod
     def control_register(self, name, pid, device_id, control_data):
         self.logger.writeInfo("Control Register {} {} {} {}".format(name, pid, device_id, control_data))
@@ -21,11 +21,16 @@ from six import PY2
 import unittest
 import mock
 import requests
+import time
+from authlib.integrations.requests_client import OAuth2Session
 import gevent
+import os
+import shutil
+import tempfile
 from copy import deepcopy
 from nmosnode.aggregator import Aggregator, InvalidRequest, REGISTRATION_MDNSTYPE
 from nmosnode.aggregator import AGGREGATOR_APINAMESPACE, LEGACY_REG_MDNSTYPE, AGGREGATOR_APINAME
-from nmosnode.aggregator import ServerSideError
+from nmosnode.aggregator import ServerSideError, RegistrationQueue, HeartbeatScheduler
 from nmosnode.aggregator import BACKOFF_INITIAL_TIMOUT_SECONDS, BACKOFF_MAX_TIMEOUT_SECONDS
 from mdnsbridge.mdnsbridgeclient import NoService, EndOfServiceList
 import nmosnode
@@ -43,6 +48,7 @@ class TestAggregator(unittest.TestCase):
         paths = ['nmosnode.aggregator.Logger',
                  'nmosnode.aggregator.IppmDNSBridge',
                  'gevent.queue.Queue',
+                 'nmosnode.aggregator.RegistrationQueue',
                  'gevent.spawn']
         patchers = {name: mock.patch(name) for name in paths}
         self.mocks = {name: patcher.start() for (name, patcher) in iteritems(patchers)}
@@ -73,7 +79,7 @@ class TestAggregator(unittest.TestCase):
         self.mocks['nmosnode.aggregator.Logger'].assert_called_once_with('aggregator_proxy', None)
         self.assertEqual(a.logger, self.mocks['nmosnode.aggregator.Logger'].return_value)
         self.mocks['nmosnode.aggregator.IppmDNSBridge'].assert_called_once_with(logger=a.logger)
-        self.assertEqual(a._reg_queue, self.mocks['gevent.queue.Queue'].return_value)
+        self.assertEqual(a._reg_queue, self.mocks['nmosnode.aggregator.RegistrationQueue'].return_value)
         self.assertEqual(a.main_thread.thread_function, a._main_thread)
         self.assertEqual(a.queue_thread.thread_function, a._process_queue)
 
@@ -143,6 +149,45 @@ class TestAggregator(unittest.TestCase):
 
                     self.assertEqual(a._node_data["entities"][namespace][o[0]][o[1]], send_obj)
 
+    def test_register_node_updates_are_coalesced(self):
+        """Successive updates to an already registered Node should result in a single queued registration once the
+        coalescing window has elapsed, carrying the most recent Node data."""
+        a = Aggregator()
+        a._node_data["node"] = {"type": "node", "data": {"id": "testnode", "label": "initial"}}
+
+        with mock.patch("nmosnode.aggregator.OAUTH_MODE", False):
+            with mock.patch("gevent.spawn_later") as spawn_later:
+                for i in range(0, 5):
+                    a.register("node", "testnode", id="testnode", label="update {}".format(i))
+
+                spawn_later.assert_called_once_with(a._node_update_window, a._flush_node_update)
+                a._reg_queue.put.assert_not_called()
+
+                a._flush_node_update()
+
+        a._reg_queue.put.assert_called_once_with({
+            "method": "POST",
+            "namespace": "resource",
+            "res_type": "node",
+            "key": "testnode"})
+        self.assertEqual(a._node_data["node"]["data"]["label"], "update 4")
+        self.assertFalse(a._node_update_pending)
+
+    def test_register_node_updates_without_window(self):
+        """With no coalescing window, each Node update should be queued immediately."""
+        a = Aggregator()
+        a._node_data["node"] = {"type": "node", "data": {"id": "testnode"}}
+        a._node_update_window = 0
+
+        with mock.patch("nmosnode.aggregator.OAUTH_MODE", False):
+            a.register("node", "testnode", id="testnode", label="updated")
+
+        a._reg_queue.put.assert_called_once_with({
+            "method": "POST",
+            "namespace": "resource",
+            "res_type": "node",
+            "key": "testnode"})
+
     def test_unregister(self):
         """unregister() should schedule a call to unregister the specified devices.
         Special behaviour is expected when unregistering a node, where the request should be made immediately."""
@@ -184,6 +229,40 @@ class TestAggregator(unittest.TestCase):
         a.main_thread.join.assert_called_with()
         a.queue_thread.join.assert_called_with()
 
+    def test_mirror_restored_from_journal(self):
+        """With a journal configured, changes to the local mirror are recorded, and restored by the next Aggregator.
+        Restored resources registered again unchanged aren't re-sent, and any not registered again are unregistered"""
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        node = {"id": "node1"}
+        with mock.patch("nmosnode.aggregator.JOURNAL_PATH", os.path.join(tmpdir, "journal.db")):
+            a = Aggregator()
+            a.register("node", "node1", **node)
+            for key in ["device1", "device2", "device3"]:
+                a.register("device", key, id=key, version="1:0")
+            a.unregister("device", "device3")
+            a.stop()
+
+            with mock.patch("gevent.spawn_later") as spawn_later:
+                a = Aggregator()
+        self.addCleanup(a.stop)
+        a._reg_queue.reset_mock()
+
+        self.assertDictEqual(a._node_data["node"], {"type": "node", "data": node})
+        self.assertDictEqual(a._node_data["entities"]["resource"]["device"], {
+            "device1": {"type": "device", "data": {"id": "device1", "version": "1:0"}},
+            "device2": {"type": "device", "data": {"id": "device2", "version": "1:0"}}})
+        spawn_later.assert_called_once_with(nmosnode.aggregator.JOURNAL_RESTORE_GRACE_SECONDS,
+                                            a._expire_restored_resources)
+
+        a.register("device", "device1", id="device1", version="1:0")
+        a._reg_queue.put.assert_not_called()
+
+        a._expire_restored_resources()
+        a._reg_queue.put.assert_called_once_with(
+            {"method": "DELETE", "namespace": "resource", "res_type": "device", "key": "device2"})
+        self.assertListEqual(list(a._node_data["entities"]["resource"]["device"]), ["device1"])
+
     def test_get_aggregator_returns_services_in_order(self):
         """Test that each aggregator is returned in order"""
         a = Aggregator(mdns_updater=mock.MagicMock())
@@ -287,7 +366,7 @@ class TestAggregator(unittest.TestCase):
 
     def test_heartbeat_200_when_registered(self):
         """Test heartbeat operation when heartbeat request returns HTTP 200 when registered
-        After HTTP 200 heartbeat, Node should still be registered and should wait 5 seconds"""
+        After HTTP 200 heartbeat, Node should still be registered and the next heartbeat should be scheduled"""
         DUMMYNODEID = "90f7c2c0-cfa9-11e7-9b9d-2fe338e1e7ce"
         a = Aggregator(mdns_updater=mock.MagicMock())
         a._node_data["registered"] = True
@@ -311,7 +390,9 @@ class TestAggregator(unittest.TestCase):
                 self.assertTrue(a._node_data["registered"])
                 self.assertTrue(a._aggregator_list_stale)
                 self.assertEqual(a._backoff_period, 0)
-                sleep.assert_called_with(1)
+                sleep.assert_not_called()
+                self.assertEqual(1, a._heartbeat_scheduler.metrics["sent"])
+                self.assertGreater(a._heartbeat_scheduler.delay(), 0)
 
     def test_heartbeat_200_when_not_registered(self):
         """Test heartbeat operation when heartbeat request returns HTTP 200 when not registered
@@ -360,6 +441,74 @@ class TestAggregator(unittest.TestCase):
                 a._mdns_updater.inc_P2P_enable_count.assert_not_called()
                 un_reg.assert_called_once_with('path/xxx')
 
+    def test_heartbeat_200_with_incremental_resync(self):
+        """Test heartbeat operation when heartbeat request returns HTTP 200 from a newly selected aggregator with
+        incremental resync enabled. The Node should re-synchronise with the aggregator rather than re-register"""
+        DUMMYNODEID = "90f7c2c0-cfa9-11e7-9b9d-2fe338e1e7ce"
+        a = Aggregator(mdns_updater=mock.MagicMock())
+        a._incremental_resync = True
+        a._synced_aggregator = "http://example1.com"
+        a._node_data["registered"] = True
+        a._node_data["node"] = {"type": "node", "data": {"id": DUMMYNODEID}}
+        a.aggregator = "http://example2.com"
+        registered_versions = {("device", "dummydevice"): "1:0"}
+
+        with mock.patch.object(a, '_send', return_value=mock.MagicMock(status_code=200)):
+            with mock.patch.object(a, '_fetch_registered_versions', return_value=registered_versions):
+                with mock.patch.object(a, '_resync_node', return_value=True) as resync:
+                    with mock.patch.object(a, '_unregister_node') as un_reg:
+                        self.assertTrue(a._heartbeat())
+
+                        resync.assert_called_once_with(registered_versions)
+                        un_reg.assert_not_called()
+
+    def test_heartbeat_200_with_incremental_resync_and_no_query_api(self):
+        """Test heartbeat operation when heartbeat request returns HTTP 200 when not registered with incremental resync
+        enabled, but the aggregator's holdings can't be found. The Node should be unregistered and re-registered"""
+        DUMMYNODEID = "90f7c2c0-cfa9-11e7-9b9d-2fe338e1e7ce"
+        a = Aggregator(mdns_updater=mock.MagicMock())
+        a._incremental_resync = True
+        a._node_data["registered"] = False
+        a._node_data["node"] = {"type": "node", "data": {"id": DUMMYNODEID}}
+        a.aggregator = "http://example.com"
+
+        def request(*args, **kwargs):
+            return mock.MagicMock(status_code=200, headers={'Location': 'path/xxx'})
+
+        with mock.patch.object(a, '_send', side_effect=request):
+            with mock.patch.object(a, '_fetch_registered_versions', return_value=None):
+                with mock.patch.object(a, '_unregister_node', return_value=True) as un_reg:
+                    with mock.patch.object(a, '_register_node', return_value=True) as register:
+                        self.assertTrue(a._heartbeat())
+
+                        un_reg.assert_called_once_with('path/xxx')
+                        register.assert_called_once_with(a._node_data["node"])
+
+    def test_heartbeat_200_from_new_aggregator_with_incremental_resync_and_no_query_api(self):
+        """Test heartbeat operation when heartbeat request returns HTTP 200 from a newly selected aggregator with
+        incremental resync enabled, but the aggregator's holdings can't be found. The Node should be unregistered and
+        re-registered, rather than assumed to be in sync with the aggregator"""
+        DUMMYNODEID = "90f7c2c0-cfa9-11e7-9b9d-2fe338e1e7ce"
+        a = Aggregator(mdns_updater=mock.MagicMock())
+        a._incremental_resync = True
+        a._synced_aggregator = "http://example1.com"
+        a._node_data["registered"] = True
+        a._node_data["node"] = {"type": "node", "data": {"id": DUMMYNODEID}}
+        a.aggregator = "http://example2.com"
+
+        def request(*args, **kwargs):
+            return mock.MagicMock(status_code=200, headers={'Location': 'path/xxx'})
+
+        with mock.patch.object(a, '_send', side_effect=request):
+            with mock.patch.object(a, '_fetch_registered_versions', return_value=None):
+                with mock.patch.object(a, '_unregister_node', return_value=True) as un_reg:
+                    with mock.patch.object(a, '_register_node', return_value=True) as register:
+                        self.assertTrue(a._heartbeat())
+
+                        un_reg.assert_called_once_with('path/xxx')
+                        register.assert_called_once_with(a._node_data["node"])
+                        self.assertEqual("http://example1.com", a._synced_aggregator)
+
     def test_heartbeat_409(self):
         """Test heartbeat operation when heartbeat request returns HTTP 409
         After HTTP 409 heartbeat, Node should unregister Node then perform re-registration with same aggregator"""
@@ -663,6 +812,20 @@ class TestAggregator(unittest.TestCase):
             self.assertEqual(a.aggregator, AGGREGATOR_1)
             a._mdns_updater.inc_P2P_enable_count.assert_not_called()
 
+    def test_registered_operation_waits_for_heartbeat_due(self):
+        """The registered operation sleeps until the heartbeat scheduler says the next heartbeat is due"""
+        a = Aggregator(mdns_updater=mock.MagicMock())
+        a.aggregator = "http://example1.com"
+        delays = [2.5, 1.5, 0]
+
+        with mock.patch.object(a._heartbeat_scheduler, 'delay', side_effect=lambda: delays.pop(0)):
+            with mock.patch('gevent.sleep') as sleep:
+                with mock.patch.object(a, '_heartbeat', return_value=True) as heartbeat:
+                    a._registered_operation()
+
+                    self.assertEqual([mock.call(1), mock.call(1)], sleep.mock_calls)
+                    heartbeat.assert_called_once_with()
+
     def test_registered_operation_when_heartbeat_fails(self):
         """Test the registered operation when the heartbeat fails"""
         AGGREGATOR_1 = "http://example1.com"
@@ -1005,10 +1168,109 @@ class TestAggregator(unittest.TestCase):
         a._register_node_resources()
         self.assertListEqual(a._reg_queue.put.mock_calls, expected_put_calls)
 
+    def test_resync_node_sends_only_missing_and_changed_resources(self):
+        """Re-synchronising with an aggregator which already holds the Node should register the Node, then queue only
+        resources it is missing or holds at another version, after deleting resources the Node no longer has"""
+        DUMMYNODEID = "90f7c2c0-cfa9-11e7-9b9d-2fe338e1e7ce"
+        a = Aggregator(mdns_updater=mock.MagicMock())
+        a.aggregator = "http://example.com"
+        a._node_data["node"] = {"type": "node", "data": {"id": DUMMYNODEID}}
+        for (res_type, key, version) in [("device", "device1", "1:0"),
+                                         ("flow", "unchanged", "1:0"),
+                                         ("flow", "changed", "2:0"),
+                                         ("flow", "missing", "1:0"),
+                                         ("sender", "unversioned", None)]:
+            a._add_mirror_keys("resource", res_type)
+            data = {"id": key}
+            if version is not None:
+                data["version"] = version
+            a._node_data["entities"]["resource"][res_type][key] = {"type": res_type, "data": data}
+        registered_versions = {("device", "device1"): "1:0",
+                               ("flow", "unchanged"): "1:0",
+                               ("flow", "changed"): "1:0",
+                               ("flow", "removed"): "1:0",
+                               ("device", "removed_device"): "1:0",
+                               ("sender", "unversioned"): "1:0"}
+        a._reg_queue.empty.return_value = True
+
+        with mock.patch.object(a, '_send', return_value=mock.MagicMock(status_code=200)) as send:
+            self.assertTrue(a._resync_node(registered_versions))
+
+        send.assert_called_once_with("POST", "http://example.com", a.aggregator_apiversion, "resource",
+                                     a._node_data["node"])
+        self.assertTrue(a._node_data["registered"])
+        self.assertTrue(a._synced_with("http://example.com"))
+        self.assertListEqual(a._reg_queue.put.mock_calls, [
+            mock.call({"method": "DELETE", "namespace": "resource", "res_type": "flow", "key": "removed"}),
+            mock.call({"method": "DELETE", "namespace": "resource", "res_type": "device", "key": "removed_device"}),
+            mock.call({"method": "POST", "namespace": "resource", "res_type": "flow", "key": "changed"}),
+            mock.call({"method": "POST", "namespace": "resource", "res_type": "flow", "key": "missing"}),
+            mock.call({"method": "POST", "namespace": "resource", "res_type": "sender", "key": "unversioned"})])
+
+    def test_fetch_registered_versions_queries_by_node_and_device(self):
+        """The versions of the Node's resources held by the aggregator are found from the Query API on its host,
+        following pages of results"""
+        DUMMYNODEID = "90f7c2c0-cfa9-11e7-9b9d-2fe338e1e7ce"
+        a = Aggregator(mdns_updater=mock.MagicMock())
+        a.aggregator = "http://registry.example.com:8235"
+        a._set_api_version_and_srv_type("v1.3")
+        a._node_data["node"] = {"type": "node", "data": {"id": DUMMYNODEID}}
+        a.mdnsbridge.getHrefWithException.side_effect = ["http://other.example.com:8870",
+                                                         "http://registry.example.com:8870"]
+        query_root = "http://registry.example.com:8870/x-nmos/query/v1.3/"
+
+        def response(page, limit=None, prev=None):
+            resp = mock.MagicMock(headers={}, links={})
+            resp.json.return_value = page
+            if limit is not None:
+                resp.headers["X-Paging-Limit"] = str(limit)
+            if prev is not None:
+                resp.links["prev"] = {"url": prev}
+            return resp
+
+        responses = {
+            (query_root + "devices/", "node_id", DUMMYNODEID): response([{"id": "device1", "version": "1:0"}]),
+            (query_root + "flows/", "device_id", "device1"): response(
+                [{"id": "flow2", "version": "2:0"}], limit=1, prev=query_root + "flows/?older"),
+            (query_root + "flows/?older", None, None): response([{"id": "flow1", "version": "1:0"}], limit=2,
+                                                                prev=query_root + "flows/?oldest")}
+
+        def get(url, params=None, timeout=None):
+            key = (url,) + (tuple(params.items())[0] if params else (None, None))
+            return responses.get(key, response([]))
+
+        with mock.patch("requests.Session.get", side_effect=get):
+            versions = a._fetch_registered_versions()
+
+        a.mdnsbridge.updateServices.assert_called_once_with("nmos-query")
+        self.assertDictEqual(versions, {("device", "device1"): "1:0",
+                                        ("flow", "flow1"): "1:0",
+                                        ("flow", "flow2"): "2:0"})
+
+    def test_fetch_registered_versions_without_query_api(self):
+        """If there is no Query API on the aggregator's host, the aggregator's holdings can't be found"""
+        a = Aggregator(mdns_updater=mock.MagicMock())
+        a.aggregator = "http://registry.example.com:8235"
+        a._set_api_version_and_srv_type("v1.3")
+        a.mdnsbridge.getHrefWithException.side_effect = ["http://other.example.com:8870", EndOfServiceList]
+
+        with mock.patch("requests.Session.get") as get:
+            self.assertIsNone(a._fetch_registered_versions())
+            get.assert_not_called()
+
     # # ================================================================================================================
     # # Test queue handelling
     # # ================================================================================================================
 
+    def mock_queue_get(self, a, queue):
+        """Mock blocking gets from the registration queue, stopping the processing thread once `queue` is empty"""
+        def _get():
+            if len(queue) == 0:
+                a._running = False
+                raise gevent.queue.Empty
+            return queue.pop(0)
+        a._reg_queue.get.side_effect = _get
+
     def test_process_queue_does_nothing_when_not_registered(self):
         """The queue processing thread should not send any messages when the node is not registered."""
         a = Aggregator(mdns_updater=mock.MagicMock())
@@ -1018,13 +1280,13 @@ class TestAggregator(unittest.TestCase):
         def killloop(*args, **kwargs):
             a._running = False
 
-        with mock.patch('gevent.sleep', side_effect=killloop) as sleep:
+        with mock.patch.object(a, '_registration_ready', **{'wait.side_effect': killloop}) as ready:
             with mock.patch.object(a, '_send') as send:
                 a._process_queue()
 
                 send.assert_not_called()
                 a._mdns_updater.P2P_disable.assert_not_called()
-                sleep.assert_called_with(mock.ANY)
+                ready.wait.assert_called_with()
 
     def test_process_queue_does_nothing_when_queue_empty(self):
         """The queue processing thread should not send any messages when the queue is empty."""
@@ -1032,18 +1294,20 @@ class TestAggregator(unittest.TestCase):
         a = Aggregator(mdns_updater=mock.MagicMock())
         a._node_data["registered"] = True
         a._node_data["node"] = {"type": "node", "data": {"id": DUMMYNODEID}}
-        a._reg_queue.empty.return_value = True
+        a.aggregator = "www.example.com"
 
         def killloop(*args, **kwargs):
             a._running = False
+            raise gevent.queue.Empty
 
-        with mock.patch('gevent.sleep', side_effect=killloop) as sleep:
-            with mock.patch.object(a, '_send') as send:
-                a._process_queue()
+        a._reg_queue.get.side_effect = killloop
 
-                send.assert_not_called()
-                a._mdns_updater.P2P_disable.assert_not_called()
-                sleep.assert_called_with(mock.ANY)
+        with mock.patch.object(a, '_send') as send:
+            a._process_queue()
+
+            send.assert_not_called()
+            a._mdns_updater.P2P_disable.assert_not_called()
+            a._reg_queue.get.assert_called_once_with()
 
     def test_process_queue_processes_queue_when_running(self):
         """The queue processing thread should check the queue and send a registration/deregistration request
@@ -1072,7 +1336,7 @@ class TestAggregator(unittest.TestCase):
         ]
 
         a._reg_queue.empty.side_effect = lambda: (len(queue) == 0)
-        a._reg_queue.get.side_effect = lambda: queue.pop(0)
+        self.mock_queue_get(a, queue)
 
         expected_calls = [
             mock.call('POST', "www.example.com", "v1.2", 'resource',
@@ -1085,11 +1349,231 @@ class TestAggregator(unittest.TestCase):
         def killloop(*args, **kwargs):
             a._running = False
 
-        with mock.patch('gevent.sleep', side_effect=killloop):
+        with mock.patch.object(a, '_registration_ready', **{'wait.side_effect': killloop}):
             with mock.patch.object(a, '_send') as send:
                 a._process_queue()
                 send.assert_has_calls(expected_calls)
 
+    def test_process_queue_sends_once_registered(self):
+        """The queue processing thread blocks until the Node is registered, then forwards queued requests"""
+        a = Aggregator(mdns_updater=mock.MagicMock())
+        a._reg_queue = RegistrationQueue()
+        a._node_data["node"] = {"type": "node", "data": {"id": "dummynodeid"}}
+        a._node_data["entities"]["resource"]["dummy"] = {"dummykey": {"dummyparamkey": "dummyparamval"}}
+
+        with mock.patch.object(a, '_send') as send:
+            queue_thread = gevent.Greenlet.spawn(a._process_queue)
+            a._queue_request("POST", "resource", "dummy", "dummykey")
+            gevent.sleep(0.01)
+            send.assert_not_called()
+
+            a.aggregator = "www.example.com"
+            a._registered()
+            gevent.sleep(0.01)
+            send.assert_called_once_with("POST", "www.example.com", a.aggregator_apiversion, "resource",
+                                         {"dummyparamkey": "dummyparamval"})
+
+            a._queue_request("DELETE", "resource", "dummy", "dummykey")
+            gevent.sleep(0.01)
+            send.assert_called_with("DELETE", "www.example.com", a.aggregator_apiversion, "resource/dummys/dummykey")
+
+            a.stop()
+            queue_thread.join(1)
+            self.assertTrue(queue_thread.ready())
+
+    def run_queue_with_slow_send(self, a, requests, on_start=None):
+        """Process `requests` with a real queue and a _send that takes 10ms, returning (start, end, url) events"""
+        a._reg_queue = RegistrationQueue()
+        a.aggregator = "www.example.com"
+        a._node_data["node"] = {"type": "node", "data": {"id": "dummynodeid"}}
+        a._node_data["registered"] = True
+        events = []
+
+        def _send(method, aggregator, api_ver, url, data=None):
+            events.append(("start", data["data"]["id"] if data else url))
+            if on_start is not None:
+                on_start(data)
+            gevent.sleep(0.01)
+            events.append(("end", data["data"]["id"] if data else url))
+
+        for (method, res_type, key) in requests:
+            if method == "POST":
+                a._add_mirror_keys("resource", res_type)
+                a._node_data["entities"]["resource"][res_type][key] = {"type": res_type, "data": {"id": key}}
+            a._queue_request(method, "resource", res_type, key)
+
+        with mock.patch.object(a, '_send', side_effect=_send):
+            queue_thread = gevent.Greenlet.spawn(a._process_queue)
+            gevent.sleep(0.2)
+            a.stop()
+            queue_thread.join(1)
+        return events
+
+    def test_process_queue_sends_same_type_concurrently_in_order(self):
+        """Requests for one type are in flight together, but all complete before those for the next type start"""
+        a = Aggregator(mdns_updater=mock.MagicMock())
+        events = self.run_queue_with_slow_send(a, [
+            ("POST", "device", "device_a"), ("POST", "device", "device_b"),
+            ("POST", "source", "source_a"), ("POST", "source", "source_b"), ("POST", "source", "source_c"),
+        ])
+        self.assertEqual([("start", "device_a"), ("start", "device_b")], sorted(events[:2]))
+        self.assertEqual([("end", "device_a"), ("end", "device_b")], sorted(events[2:4]))
+        self.assertEqual(["start"] * 3 + ["end"] * 3, [event[0] for event in events[4:]])
+
+    def test_process_queue_waits_for_resource_in_flight(self):
+        """A request for a resource is not sent while an earlier request for it is in flight"""
+        a = Aggregator(mdns_updater=mock.MagicMock())
+
+        def _unregister_flow_a(data):
+            if data is not None and data["data"]["id"] == "flow_a":
+                a._queue_request("DELETE", "resource", "flow", "flow_a")
+
+        events = self.run_queue_with_slow_send(a, [("POST", "flow", "flow_a"), ("POST", "flow", "flow_b")],
+                                               on_start=_unregister_flow_a)
+        self.assertEqual([("start", "flow_a"), ("start", "flow_b"), ("end", "flow_a"), ("end", "flow_b"),
+                          ("start", "resource/flows/flow_a"), ("end", "resource/flows/flow_a")], events)
+
+    def run_queue_with_batching(self, a, requests, send, before_start=None):
+        """Process `requests` with a real queue and batching enabled, using the given `send` in place of _send"""
+        a._reg_queue = RegistrationQueue()
+        a._batch_size = 10
+        a.aggregator = "www.example.com"
+        a._node_data["node"] = {"type": "node", "data": {"id": "dummynodeid"}}
+        a._node_data["registered"] = True
+        for (res_type, key) in requests:
+            a._add_mirror_keys("resource", res_type)
+            a._node_data["entities"]["resource"][res_type][key] = {"type": res_type, "data": {"id": key}}
+            a._queue_request("POST", "resource", res_type, key)
+        if before_start is not None:
+            before_start()
+
+        with mock.patch.object(a, '_send', side_effect=send) as _send:
+            queue_thread = gevent.Greenlet.spawn(a._process_queue)
+            gevent.sleep(0.05)
+            a.stop()
+            queue_thread.join(1)
+        return _send
+
+    def test_process_queue_sends_batches(self):
+        """With batching enabled, queued POSTs of one type are sent to the batch endpoint together"""
+        a = Aggregator(mdns_updater=mock.MagicMock())
+        _send = self.run_queue_with_batching(a, [("flow", "flow_a"), ("flow", "flow_b"), ("flow", "flow_c"),
+                                                 ("sender", "sender_a")], send=None)
+        self.assertEqual([
+            mock.call("POST", "www.example.com", a.aggregator_apiversion, "resource/batch",
+                      [{"type": "flow", "data": {"id": key}} for key in ["flow_a", "flow_b", "flow_c"]]),
+            mock.call("POST", "www.example.com", a.aggregator_apiversion, "resource",
+                      {"type": "sender", "data": {"id": "sender_a"}}),
+        ], _send.mock_calls)
+
+    def test_process_queue_falls_back_when_batches_unsupported(self):
+        """If the aggregator doesn't offer a batch endpoint, resources are sent individually from then on"""
+        a = Aggregator(mdns_updater=mock.MagicMock())
+
+        def _send(method, aggregator, api_ver, url, data=None):
+            if url == "resource/batch":
+                raise InvalidRequest(404)
+
+        _send = self.run_queue_with_batching(a, [("flow", "flow_a"), ("flow", "flow_b"),
+                                                 ("sender", "sender_a"), ("sender", "sender_b")], send=_send)
+        self.assertEqual([
+            mock.call("POST", "www.example.com", a.aggregator_apiversion, "resource/batch",
+                      [{"type": "flow", "data": {"id": key}} for key in ["flow_a", "flow_b"]]),
+            mock.call("POST", "www.example.com", a.aggregator_apiversion, "resource",
+                      {"type": "flow", "data": {"id": "flow_a"}}),
+            mock.call("POST", "www.example.com", a.aggregator_apiversion, "resource",
+                      {"type": "flow", "data": {"id": "flow_b"}}),
+            mock.call("POST", "www.example.com", a.aggregator_apiversion, "resource",
+                      {"type": "sender", "data": {"id": "sender_a"}}),
+            mock.call("POST", "www.example.com", a.aggregator_apiversion, "resource",
+                      {"type": "sender", "data": {"id": "sender_b"}}),
+        ], _send.mock_calls)
+        self.assertEqual("www.example.com", a._batch_unsupported)
+
+    def test_register_many_into_is_sent_as_one_batch(self):
+        """Resources registered together are mirrored, then queued back to back so they're sent in a single batch"""
+        a = Aggregator(mdns_updater=mock.MagicMock())
+        resources = dict((key, {"id": key}) for key in ["flow_a", "flow_b", "flow_c"])
+        _send = self.run_queue_with_batching(a, [], send=None, before_start=lambda: a.register_many_into(
+            "resource", "flow", resources))
+        self.assertEqual(dict((key, {"type": "flow", "data": {"id": key}}) for key in resources),
+                         a._node_data["entities"]["resource"]["flow"])
+        self.assertEqual(1, len(_send.mock_calls))
+        self.assertEqual("resource/batch", _send.mock_calls[0][1][3])
+        self.assertCountEqual([{"type": "flow", "data": {"id": key}} for key in resources], _send.mock_calls[0][1][4])
+
+    def test_process_queue_requeues_failed_requests_in_order(self):
+        """Requests which fail with a server side error return to the front of the queue in their original order"""
+        a = Aggregator(mdns_updater=mock.MagicMock())
+        a._reg_queue = RegistrationQueue()
+        a.aggregator = "www.example.com"
+        a._node_data["registered"] = True
+        for key in ["flow_a", "flow_b", "flow_c"]:
+            a._add_mirror_keys("resource", "flow")
+            a._node_data["entities"]["resource"]["flow"][key] = {"type": "flow", "data": {"id": key}}
+            a._queue_request("POST", "resource", "flow", key)
+        a._queue_request("POST", "resource", "sender", "sender_a")
+
+        def _send(*args, **kwargs):
+            gevent.sleep(0.01)
+            raise ServerSideError
+
+        def killloop(*args, **kwargs):
+            a._running = False
+
+        with mock.patch.object(a, '_registration_ready', **{'wait.side_effect': killloop}):
+            with mock.patch.object(a, '_send', side_effect=_send):
+                a._process_queue()
+
+        self.assertIsNone(a.aggregator)
+        self.assertEqual(["flow_a", "flow_b", "flow_c", "sender_a"],
+                         [a._reg_queue.get(block=False)["key"] for i in range(4)])
+
+    def test_process_queue_resends_failed_request_after_failover(self):
+        """A request which fails while in flight is resent to the next aggregator, even if the Node is registered with
+        it before the queue processing thread notices the failure"""
+        a = Aggregator(mdns_updater=mock.MagicMock())
+        a._reg_queue = RegistrationQueue()
+        a.aggregator = "r1"
+        a._node_data["registered"] = True
+        a._add_mirror_keys("resource", "flow")
+        a._node_data["entities"]["resource"]["flow"]["flow_a"] = {"type": "flow", "data": {"id": "flow_a"}}
+
+        def failover():
+            # As the main thread does on finding the Node already registered with another aggregator
+            a.aggregator = "r2"
+            a._registered()
+
+        def _send(method, aggregator, api_ver, url, data=None):
+            if aggregator == "r1":
+                gevent.sleep(0.01)
+                gevent.Greenlet.spawn(failover)
+                raise ServerSideError
+
+        with mock.patch.object(a, '_send', side_effect=_send) as send:
+            queue_thread = gevent.Greenlet.spawn(a._process_queue)
+            a._queue_request("POST", "resource", "flow", "flow_a")
+            gevent.sleep(0.1)
+            a.stop()
+            queue_thread.join(1)
+
+        self.assertEqual(["r1", "r2"], [call[1][1] for call in send.mock_calls])
+        self.assertEqual([], a._failed_requests)
+        self.assertTrue(a._reg_queue.empty())
+
+    def test_clear_queue_discards_failed_requests(self):
+        """Requests which failed before the queue was cleared, or fail afterwards, aren't retried"""
+        a = Aggregator(mdns_updater=mock.MagicMock())
+        a._reg_queue = RegistrationQueue()
+        a._queue_request("POST", "resource", "flow", "flow_a")
+        in_flight = a._failed_requests
+        in_flight.append({"method": "DELETE", "namespace": "resource", "res_type": "flow", "key": "flow_b"})
+        a._clear_queue()
+        a._request_failed(in_flight, [{"method": "DELETE", "namespace": "resource", "res_type": "flow",
+                                       "key": "flow_c"}])
+        self.assertEqual([], a._failed_requests)
+        self.assertTrue(a._reg_queue.empty())
+
     def test_process_queue_stops_when_not_running(self):
         """The process queue method should stop as soon as running set to false"""
         DUMMYNODEID = "90f7c2c0-cfa9-11e7-9b9d-2fe338e1e7ce"
@@ -1115,7 +1599,7 @@ class TestAggregator(unittest.TestCase):
         ]
 
         a._reg_queue.empty.side_effect = lambda: (len(queue) == 0)
-        a._reg_queue.get.side_effect = lambda: queue.pop(0)
+        self.mock_queue_get(a, queue)
 
         with mock.patch('gevent.sleep', side_effect=Exception) as sleep:
             with mock.patch.object(a, '_send') as send:
@@ -1152,7 +1636,7 @@ class TestAggregator(unittest.TestCase):
         ]
 
         a._reg_queue.empty.side_effect = lambda: (len(queue) == 0)
-        a._reg_queue.get.side_effect = lambda: queue.pop(0)
+        self.mock_queue_get(a, queue)
 
         expected_calls = [
             mock.call('POST', "www.example.com", "v1.2", 'resource',
@@ -1162,7 +1646,7 @@ class TestAggregator(unittest.TestCase):
         def killloop(*args, **kwargs):
             a._running = False
 
-        with mock.patch('gevent.sleep', side_effect=killloop):
+        with mock.patch.object(a, '_registration_ready', **{'wait.side_effect': killloop}):
             with mock.patch.object(a, '_send', side_effect=InvalidRequest) as send:
                 a._process_queue()
 
@@ -1194,7 +1678,7 @@ class TestAggregator(unittest.TestCase):
         ]
 
         a._reg_queue.empty.side_effect = lambda: (len(queue) == 0)
-        a._reg_queue.get.side_effect = lambda: queue.pop(0)
+        self.mock_queue_get(a, queue)
 
         expected_calls = [
             mock.call('DELETE', "www.example.com", "v1.2", 'resource/dummys/' + DUMMYKEY)
@@ -1203,7 +1687,7 @@ class TestAggregator(unittest.TestCase):
         def killloop(*args, **kwargs):
             a._running = False
 
-        with mock.patch('gevent.sleep', side_effect=killloop):
+        with mock.patch.object(a, '_registration_ready', **{'wait.side_effect': killloop}):
             with mock.patch.object(a, '_send', side_effect=InvalidRequest) as send:
                 a._process_queue()
 
@@ -1235,11 +1719,10 @@ class TestAggregator(unittest.TestCase):
             {"method": "POST", "namespace": "resource", "res_type": "left", "key": DUMMYKEY},
         ]
         queue = deepcopy(expected_queue)
-        updated_queue = []
 
         a._reg_queue.empty.side_effect = lambda: (len(queue) == 0)
-        a._reg_queue.get.side_effect = lambda: queue.pop(0)
-        a._reg_queue.put.side_effect = lambda data: updated_queue.append(data)
+        self.mock_queue_get(a, queue)
+        a._reg_queue.put_front.side_effect = lambda data: queue.insert(0, data)
 
         expected_calls = [
             mock.call('POST', "www.example.com", "v1.2", 'resource',
@@ -1249,14 +1732,14 @@ class TestAggregator(unittest.TestCase):
         def killloop(*args, **kwargs):
             a._running = False
 
-        with mock.patch('gevent.sleep', side_effect=killloop):
+        with mock.patch.object(a, '_registration_ready', **{'wait.side_effect': killloop}):
             with mock.patch.object(a, '_send', side_effect=ServerSideError) as send:
                 a._process_queue()
 
                 send.assert_has_calls(expected_calls)
                 a._mdns_updater.P2P_disable.assert_not_called()
                 self.assertIsNone(a.aggregator)
-                self.assertListEqual(updated_queue, expected_queue)
+                self.assertListEqual(queue, expected_queue)
 
     def test_process_queue_processes_queue_when_running_and_ignores_unknown_methods(self):
         """Unknown verbs in the queue should be ignored."""
@@ -1282,12 +1765,12 @@ class TestAggregator(unittest.TestCase):
         ]
 
         a._reg_queue.empty.side_effect = lambda: (len(queue) == 0)
-        a._reg_queue.get.side_effect = lambda: queue.pop(0)
+        self.mock_queue_get(a, queue)
 
         def killloop(*args, **kwargs):
             a._running = False
 
-        with mock.patch('gevent.sleep', side_effect=killloop):
+        with mock.patch.object(a, '_registration_ready', **{'wait.side_effect': killloop}):
             with mock.patch.object(a, '_send', side_effect=InvalidRequest) as send:
                 a._process_queue()
 
@@ -1307,7 +1790,7 @@ class TestAggregator(unittest.TestCase):
         def killloop(*args, **kwargs):
             a._running = False
 
-        with mock.patch('gevent.sleep', side_effect=killloop):
+        with mock.patch.object(a, '_registration_ready', **{'wait.side_effect': killloop}):
             with mock.patch.object(a, '_send') as send:
                 a._process_queue()
 
@@ -1358,7 +1841,7 @@ class TestAggregator(unittest.TestCase):
         )
 
         with mock.patch.dict(nmosnode.aggregator._config, {'prefer_ipv6': prefer_ipv6}):
-            with mock.patch("requests.request", side_effect=request) as _request:
+            with mock.patch("requests.Session.request", side_effect=request) as _request:
                 R = None
                 if expected_exception is not None:
                     with self.assertRaises(expected_exception):
@@ -1373,6 +1856,73 @@ class TestAggregator(unittest.TestCase):
                 if R:
                     self.assertEqual(R.content, expected_return)
 
+    def test_send_request_reuses_session_per_aggregator(self):
+        """Requests to one aggregator share a session, which is replaced when another aggregator is used"""
+        a = Aggregator(mdns_updater=mock.MagicMock())
+        with mock.patch("nmosnode.aggregator.OAUTH_MODE", False):
+            with mock.patch("requests.Session") as Session:
+                Session.side_effect = lambda: mock.MagicMock()
+                a._send_request("POST", "http://example1.com", "path1")
+                session = a._session
+                a._send_request("POST", "http://example1.com", "path2")
+                self.assertIs(session, a._session)
+                self.assertEqual(2, len(session.request.mock_calls))
+
+                a._send_request("POST", "http://example2.com", "path1")
+                self.assertIsNot(session, a._session)
+                session.close.assert_called_once_with()
+                a._session.request.assert_called_once_with(method="POST", url="http://example2.com/path1",
+                                                           json=None, timeout=1.0)
+
+                a.stop()
+                self.assertIsNone(a._session)
+
+    def oauth_aggregator(self, token):
+        """Return an aggregator in OAuth mode whose client uses authlib's requests session, and stored `token`"""
+        a = Aggregator(mdns_updater=mock.MagicMock(), auth_registry=mock.MagicMock())
+        a.auth_registry.fetch_local_token.return_value = token
+        a.auth_client = mock.MagicMock(client_cls=OAuth2Session, client_id="dummyclient", client_secret="secret",
+                                       access_token_url="http://auth.example.com/token", client_kwargs={})
+        return a
+
+    def test_send_request_uses_oauth_session(self):
+        """In OAuth mode, requests are made with a persistent OAuth session, starting from the stored token"""
+        a = self.oauth_aggregator({"access_token": "token1", "token_type": "Bearer", "expires_at": time.time() + 3600})
+        with mock.patch("nmosnode.aggregator.OAUTH_MODE", True):
+            with mock.patch("requests.Session.request") as request:
+                a._send_request("POST", "http://example1.com", "path1")
+                session = a._session
+                a._send_request("POST", "http://example1.com", "path2")
+        self.assertIs(session, a._session)
+        self.assertIsInstance(session, OAuth2Session)
+        self.assertEqual(2, len(request.mock_calls))
+        self.assertEqual(1, len(a.auth_registry.fetch_local_token.mock_calls))
+        a.auth_client.request.assert_not_called()
+
+    def test_send_request_refreshes_oauth_token(self):
+        """An expired token is refreshed through the persistent OAuth session, and the new token stored"""
+        a = self.oauth_aggregator({"access_token": "token1", "token_type": "Bearer", "refresh_token": "refresh1",
+                                   "expires_at": time.time() - 10})
+        new_token = {"access_token": "token2", "token_type": "Bearer", "refresh_token": "refresh2",
+                     "expires_in": 3600}
+        sent = []
+
+        def _request(session, method, url, **kwargs):
+            if url == "http://auth.example.com/token":
+                return mock.MagicMock(status_code=200, json=mock.MagicMock(return_value=dict(new_token)))
+            prepared = requests.Request(method, url, auth=kwargs.get("auth")).prepare()
+            sent.append(prepared.headers.get("Authorization"))
+            return mock.MagicMock(status_code=200)
+
+        with mock.patch("nmosnode.aggregator.OAUTH_MODE", True):
+            with mock.patch("requests.Session.request", autospec=True, side_effect=_request):
+                a._send_request("POST", "http://example1.com", "path1")
+                a._send_request("POST", "http://example1.com", "path2")
+
+        self.assertEqual(["Bearer token2", "Bearer token2"], sent)
+        a.auth_registry.update_local_token.assert_called_once_with(mock.ANY, refresh_token="refresh1")
+        self.assertEqual("token2", a.auth_registry.update_local_token.call_args[0][0]["access_token"])
+
     def test_send_200_response(self):
         TEST_CONTENT = "kasjhdlkhnjgsn"
 
@@ -1462,7 +2012,6 @@ class TestAggregator(unittest.TestCase):
         request_mocks = [
             mock.MagicMock(name="request1()", status_code=404),
             mock.MagicMock(name="request2()", status_code=201),
-            mock.MagicMock(name="request3()", status_code=200),
         ]
 
         expected_request_calls = [
@@ -1470,14 +2019,13 @@ class TestAggregator(unittest.TestCase):
                       "health/nodes/{}".format(DUMMYNODEID)), json=None, timeout=1.0),
             mock.call(method='POST', url=self.construct_url(AGGREGATOR_1, a.aggregator_apiversion, "resource"),
                       json={"data": {"id": DUMMYNODEID}, "type": "node"}, timeout=1.0),
-            mock.call(method='POST', url=self.construct_url(AGGREGATOR_1, a.aggregator_apiversion,
-                      "health/nodes/{}".format(DUMMYNODEID)), json=None, timeout=1.0),
+            # The next heartbeat isn't due until HEARTBEAT_INTERVAL after the first
         ]
 
         a.mdnsbridge.getHrefWithException.return_value = AGGREGATOR_1
 
         with mock.patch('gevent.sleep', side_effect=killloop):
-            with mock.patch('requests.request', side_effect=request_mocks) as request:
+            with mock.patch('requests.Session.request', side_effect=request_mocks) as request:
 
                 a._main_thread()
                 self.assertTrue(a._node_data["registered"])
@@ -1500,7 +2048,6 @@ class TestAggregator(unittest.TestCase):
             mock.MagicMock(name="request1()", status_code=200, headers={}),
             mock.MagicMock(name="request2()", status_code=204),
             mock.MagicMock(name="request3()", status_code=201),
-            mock.MagicMock(name="request4()", status_code=200),
         ]
 
         expected_request_calls = [
@@ -1510,14 +2057,13 @@ class TestAggregator(unittest.TestCase):
                       "resource/nodes/{}".format(DUMMYNODEID)), json=None, timeout=1.0),
             mock.call(method='POST', url=self.construct_url(AGGREGATOR_1, a.aggregator_apiversion, "resource"),
                       json={"data": {"id": DUMMYNODEID}, "type": "node"}, timeout=1.0),
-            mock.call(method='POST', url=self.construct_url(AGGREGATOR_1, a.aggregator_apiversion,
-                      "health/nodes/{}".format(DUMMYNODEID)), json=None, timeout=1.0),
+            # The next heartbeat isn't due until HEARTBEAT_INTERVAL after the first
         ]
 
         a.mdnsbridge.getHrefWithException.return_value = AGGREGATOR_1
 
         with mock.patch('gevent.sleep', side_effect=killloop):
-            with mock.patch('requests.request', side_effect=request_mocks) as request:
+            with mock.patch('requests.Session.request', side_effect=request_mocks) as request:
 
                 a._main_thread()
                 self.assertTrue(a._node_data["registered"])
@@ -1541,7 +2087,6 @@ class TestAggregator(unittest.TestCase):
             mock.MagicMock(name="request1()", status_code=500),
             mock.MagicMock(name="request2()", status_code=404),
             mock.MagicMock(name="request3()", status_code=201),
-            mock.MagicMock(name="request4()", status_code=200),
         ]
 
         expected_request_calls = [
@@ -1551,14 +2096,13 @@ class TestAggregator(unittest.TestCase):
                       "health/nodes/{}".format(DUMMYNODEID)), json=None, timeout=1.0),
             mock.call(method='POST', url=self.construct_url(AGGREGATOR_2, a.aggregator_apiversion, "resource"),
                       json={"data": {"id": DUMMYNODEID}, "type": "node"}, timeout=1.0),
-            mock.call(method='POST', url=self.construct_url(AGGREGATOR_2, a.aggregator_apiversion,
-                      "health/nodes/{}".format(DUMMYNODEID)), json=None, timeout=1.0),
+            # The next heartbeat isn't due until HEARTBEAT_INTERVAL after the first
         ]
 
         a.mdnsbridge.getHrefWithException.side_effect = [AGGREGATOR_1, AGGREGATOR_2]
 
         with mock.patch('gevent.sleep', side_effect=killloop):
-            with mock.patch('requests.request', side_effect=request_mocks) as request:
+            with mock.patch('requests.Session.request', side_effect=request_mocks) as request:
 
                 a._main_thread()
                 self.assertTrue(a._node_data["registered"])
@@ -1582,7 +2126,6 @@ class TestAggregator(unittest.TestCase):
             mock.MagicMock(name="request2()", status_code=200, headers={}),
             mock.MagicMock(name="request3()", status_code=204),
             mock.MagicMock(name="request4()", status_code=201),
-            mock.MagicMock(name="request5()", status_code=200),
         ]
 
         expected_request_calls = [
@@ -1594,14 +2137,13 @@ class TestAggregator(unittest.TestCase):
                       "resource/nodes/{}".format(DUMMYNODEID)), json=None, timeout=1.0),
             mock.call(method='POST', url=self.construct_url(AGGREGATOR_1, a.aggregator_apiversion, "resource"),
                       json={"data": {"id": DUMMYNODEID}, "type": "node"}, timeout=1.0),
-            mock.call(method='POST', url=self.construct_url(AGGREGATOR_1, a.aggregator_apiversion,
-                      "health/nodes/{}".format(DUMMYNODEID)), json=None, timeout=1.0),
+            # The next heartbeat isn't due until HEARTBEAT_INTERVAL after the first
         ]
 
         a.mdnsbridge.getHrefWithException.return_value = AGGREGATOR_1
 
         with mock.patch('gevent.sleep', side_effect=killloop):
-            with mock.patch('requests.request', side_effect=request_mocks) as request:
+            with mock.patch('requests.Session.request', side_effect=request_mocks) as request:
 
                 a._main_thread()
                 self.assertTrue(a._node_data["registered"])
@@ -1626,7 +2168,6 @@ class TestAggregator(unittest.TestCase):
             mock.MagicMock(name="request2()", status_code=500),
             mock.MagicMock(name="request3()", status_code=404),
             mock.MagicMock(name="request4()", status_code=201),
-            mock.MagicMock(name="request5()", status_code=200),
         ]
 
         expected_request_calls = [
@@ -1638,15 +2179,157 @@ class TestAggregator(unittest.TestCase):
                       "health/nodes/{}".format(DUMMYNODEID)), json=None, timeout=1.0),
             mock.call(method='POST', url=self.construct_url(AGGREGATOR_2, a.aggregator_apiversion, "resource"),
                       json={"data": {"id": DUMMYNODEID}, "type": "node"}, timeout=1.0),
-            mock.call(method='POST', url=self.construct_url(AGGREGATOR_2, a.aggregator_apiversion,
-                      "health/nodes/{}".format(DUMMYNODEID)), json=None, timeout=1.0),
+            # The next heartbeat isn't due until HEARTBEAT_INTERVAL after the first
         ]
 
         a.mdnsbridge.getHrefWithException.side_effect = [AGGREGATOR_1, AGGREGATOR_2]
 
         with mock.patch('gevent.sleep', side_effect=killloop):
-            with mock.patch('requests.request', side_effect=request_mocks) as request:
+            with mock.patch('requests.Session.request', side_effect=request_mocks) as request:
 
                 a._main_thread()
                 self.assertTrue(a._node_data["registered"])
                 self.assertListEqual(request.mock_calls, expected_request_calls)
+
+
+class TestRegistrationQueue(unittest.TestCase):
+    def request(self, method, key, res_type="flow"):
+        return {"method": method, "namespace": "resource", "res_type": res_type, "key": key}
+
+    def drain(self, queue):
+        items = []
+        while not queue.empty():
+            items.append(queue.get())
+        return items
+
+    def test_queue_is_fifo(self):
+        """Requests for different resources are returned in the order they were queued"""
+        queue = RegistrationQueue()
+        requests = [self.request("POST", "a", "device"), self.request("POST", "a"), self.request("DELETE", "b")]
+        for request in requests:
+            queue.put(request)
+        self.assertEqual(3, len(queue))
+        self.assertEqual(requests, self.drain(queue))
+        self.assertRaises(gevent.queue.Empty, queue.get, block=False)
+
+    def test_queue_keeps_latest_request_per_resource(self):
+        """A request for a resource which is already queued replaces the earlier request in its place"""
+        queue = RegistrationQueue()
+        for i in range(5):
+            queue.put(self.request("POST", "a"))
+            queue.put(self.request("DELETE", "a"))
+        queue.put(self.request("POST", "b"))
+        queue.put(self.request("DELETE", "a"))
+        self.assertEqual([self.request("DELETE", "a"), self.request("POST", "b")], self.drain(queue))
+
+    def test_queue_moves_request_with_new_method_to_back(self):
+        """A resource re-created after it was deleted is queued after requests made in the meantime, e.g. for the
+        new parent it was re-created under"""
+        queue = RegistrationQueue()
+        queue.put(self.request("DELETE", "x", "sender"))
+        queue.put(self.request("POST", "d2", "device"))
+        queue.put(self.request("POST", "x", "sender"))
+        self.assertEqual([self.request("POST", "d2", "device"), self.request("POST", "x", "sender")],
+                         self.drain(queue))
+
+    def test_put_front(self):
+        """A request returned to the front of the queue is next out, taking the place of any newer request"""
+        queue = RegistrationQueue()
+        queue.put(self.request("POST", "a"))
+        queue.put(self.request("POST", "b"))
+        failed = queue.get()
+        queue.put_front(failed)
+        self.assertEqual([self.request("POST", "a"), self.request("POST", "b")], self.drain(queue))
+
+        queue.put(self.request("POST", "a"))
+        queue.put(self.request("POST", "b"))
+        failed = queue.get()
+        queue.put(self.request("DELETE", "c"))
+        queue.put(self.request("DELETE", "a"))
+        queue.put_front(failed)
+        self.assertEqual(3, len(queue))
+        self.assertEqual([self.request("DELETE", "a"), self.request("POST", "b"), self.request("DELETE", "c")],
+                         self.drain(queue))
+
+    def test_get_blocks_until_request_queued(self):
+        """A blocking get waits for a request to be queued, or raises gevent.queue.Empty on timeout"""
+        queue = RegistrationQueue()
+        self.assertRaises(gevent.queue.Empty, queue.get, timeout=0.01)
+        gevent.spawn_later(0.01, queue.put, self.request("POST", "a"))
+        self.assertEqual(self.request("POST", "a"), queue.get(timeout=1))
+        self.assertRaises(gevent.queue.Empty, queue.get, block=False)
+
+    def test_interrupt_wakes_blocked_get(self):
+        """Interrupting the queue wakes a blocked get, which raises gevent.queue.Empty"""
+        queue = RegistrationQueue()
+        gevent.spawn_later(0.01, queue.interrupt)
+        self.assertRaises(gevent.queue.Empty, queue.get)
+        self.assertRaises(gevent.queue.Empty, queue.get, timeout=0.01)
+
+
+class TestHeartbeatScheduler(unittest.TestCase):
+    def setUp(self):
+        self.now = 100.0
+        patcher = mock.patch("nmosnode.aggregator.monotonic", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_schedule_does_not_drift(self):
+        """Heartbeats are due a whole number of intervals after the first, however long each takes to send"""
+        scheduler = HeartbeatScheduler(interval=5, jitter=0)
+        self.assertEqual(0, scheduler.delay())
+        scheduler.heartbeat_sent()
+        for i in range(1, 4):
+            self.now += 0.3  # Request latency
+            self.assertAlmostEqual(4.7, scheduler.delay())
+            self.now = 100.0 + 5 * i
+            scheduler.heartbeat_sent()
+        self.assertEqual({"sent": 4, "late": 0, "missed": 0, "max_lateness": 0.0}, scheduler.metrics)
+
+    def test_late_and_missed_heartbeats_are_counted(self):
+        """Heartbeats sent well after they were due are late, and skipped intervals are counted as missed"""
+        scheduler = HeartbeatScheduler(interval=5, jitter=0)
+        scheduler.heartbeat_sent()
+        self.now += 6
+        scheduler.heartbeat_sent()
+        self.assertEqual(1, scheduler.metrics["late"])
+        self.assertAlmostEqual(4, scheduler.delay())
+
+        self.now += 16
+        scheduler.heartbeat_sent()
+        self.assertEqual(2, scheduler.metrics["missed"])
+        self.assertAlmostEqual(12, scheduler.metrics["max_lateness"])
+        self.assertAlmostEqual(3, scheduler.delay())
+
+        scheduler.reset()
+        self.assertEqual(0, scheduler.delay())
+
+    def test_early_heartbeats_restart_schedule(self):
+        """Heartbeats sent back to back, e.g. to each registry tried during discovery, don't push the next one back
+        by an interval each"""
+        scheduler = HeartbeatScheduler(interval=5, jitter=0)
+        scheduler.reset()
+        for i in range(4):
+            scheduler.heartbeat_sent()
+            self.now += 0.2
+        self.assertAlmostEqual(4.8, scheduler.delay())
+        self.assertEqual({"sent": 4, "late": 0, "missed": 0, "max_lateness": 0.0}, scheduler.metrics)
+
+        # The schedule continues from the last heartbeat
+        self.now += 4.8
+        scheduler.heartbeat_sent()
+        self.assertAlmostEqual(5, scheduler.delay())
+
+    def test_jitter(self):
+        """Jitter offsets each heartbeat from its slot by up to the configured amount"""
+        scheduler = HeartbeatScheduler(interval=5, jitter=1)
+        scheduler.heartbeat_sent()
+        offsets = []
+        for i in range(1, 21):
+            offsets.append(scheduler.delay() - 5 * i)
+            self.now += scheduler.delay()
+            scheduler.heartbeat_sent()
+            self.now = 100.0
+        self.assertTrue(all(-1 <= offset <= 1 for offset in offsets))
+        self.assertNotEqual([0] * 20, offsets)
+        self.assertEqual(0, scheduler.metrics["missed"])
@@ -0,0 +1,191 @@
+# Copyright 2019 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function, absolute_import
+
+import json
+import mock
+import unittest
+from nmosnode.api import FacadeAPI, NODE_APIROOT, encode_list, encode_list_item, page_resources
+
+FLOWS = NODE_APIROOT + "v1.3/flows/"
+
+
+class TestFacadeAPI(unittest.TestCase):
+    def setUp(self):
+        self.registry = mock.MagicMock()
+        self.registry.list_resource_json.return_value = [encode_list_item({"id": "flow1"})]
+        self.registry.get_resource.return_value = {"id": "flow1"}
+        self.registry.change_count.return_value = 1
+        self.api = FacadeAPI(self.registry)
+        self.client = self.api.app.test_client()
+
+    def test_resource_list_has_etag(self):
+        """Resource lists carry an ETag and may be stored by clients provided they revalidate"""
+        response = self.client.get(FLOWS)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([{"id": "flow1"}], json.loads(response.get_data(as_text=True)))
+        self.assertIsNotNone(response.headers.get("ETag"))
+        self.assertEqual("no-cache", response.headers["Cache-Control"])
+        self.registry.change_count.assert_called_with("flow")
+
+    def test_unchanged_resource_list_is_served_from_cache(self):
+        """A list is built once, and served from the cache until resources of its type change"""
+        first = self.client.get(FLOWS)
+        second = self.client.get(FLOWS)
+        self.assertEqual(first.get_data(), second.get_data())
+        self.assertEqual(first.headers["ETag"], second.headers["ETag"])
+        self.assertEqual(1, self.registry.list_resource_json.call_count)
+
+        self.registry.list_resource_json.return_value = []
+        self.registry.change_count.return_value = 2
+        third = self.client.get(FLOWS)
+        self.assertEqual([], json.loads(third.get_data(as_text=True)))
+        self.assertNotEqual(first.headers["ETag"], third.headers["ETag"])
+        self.assertEqual(2, self.registry.list_resource_json.call_count)
+
+    def test_if_none_match_returns_not_modified(self):
+        """A client holding the current list is told so without the list being rebuilt"""
+        etag = self.client.get(FLOWS).headers["ETag"]
+        self.registry.list_resource_json.reset_mock()
+        response = self.client.get(FLOWS, headers={"If-None-Match": etag})
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(etag, response.headers["ETag"])
+        self.assertEqual(b"", response.get_data())
+        self.registry.list_resource_json.assert_not_called()
+
+        self.registry.change_count.return_value = 2
+        self.assertEqual(200, self.client.get(FLOWS, headers={"If-None-Match": etag}).status_code)
+
+    def test_resource_if_none_match_returns_not_modified(self):
+        """A client holding the current version of a single resource is told so without looking it up"""
+        etag = self.client.get(FLOWS + "flow1/").headers["ETag"]
+        self.registry.get_resource.reset_mock()
+        response = self.client.get(FLOWS + "flow1/", headers={"If-None-Match": etag})
+        self.assertEqual(304, response.status_code)
+        self.registry.get_resource.assert_not_called()
+
+    def test_resource_if_none_match_any(self):
+        """A client asking for a resource it holds any version of is told so only if the resource exists"""
+        response = self.client.get(FLOWS + "flow1/", headers={"If-None-Match": "*"})
+        self.assertEqual(304, response.status_code)
+
+        self.registry.get_resource.return_value = None
+        response = self.client.get(FLOWS + "flow2/", headers={"If-None-Match": "*"})
+        self.assertEqual(404, response.status_code)
+        self.registry.get_resource.assert_called_with("flow", "flow2", api_version="v1.3")
+
+    def test_invalid_api_version_has_no_etag(self):
+        """Requests which are rejected aren't tagged"""
+        response = self.client.get(NODE_APIROOT + "v0.1/flows/")
+        self.assertEqual(404, response.status_code)
+        self.assertIsNone(response.headers.get("ETag"))
+
+    def test_resource_list_is_joined_from_encoded_resources(self):
+        """Lists are built from the registry's encoded resources, without serialising the resources again"""
+        response = self.client.get(FLOWS)
+        self.assertEqual(encode_list([encode_list_item({"id": "flow1"})]), response.get_data())
+        self.registry.list_resource_json.assert_called_with("flow", api_version="v1.3")
+        self.registry.list_resource.assert_not_called()
+
+    def test_filtered_resource_list(self):
+        """Filters are passed to the registry, and the response isn't served from or stored in the list cache"""
+        self.registry.list_resource.return_value = {"flow1": {"id": "flow1", "device_id": "device1"}}
+        response = self.client.get(FLOWS + "?device_id=device1&format=urn:x-nmos:format:video&label=x")
+        self.assertEqual([{"id": "flow1", "device_id": "device1"}], json.loads(response.get_data(as_text=True)))
+        self.registry.list_resource.assert_called_with("flow", api_version="v1.3", filters={
+            "device_id": "device1", "format": "urn:x-nmos:format:video"})
+        self.assertEqual({}, self.api._response_cache)
+        self.assertEqual(encode_list([encode_list_item({"id": "flow1"})]), self.client.get(FLOWS).get_data())
+
+    def test_paged_resource_list(self):
+        """Paged lists are returned most recent first, with paging headers"""
+        self.registry.list_resource.return_value = dict(
+            ("flow{}".format(i), {"id": "flow{}".format(i), "version": "100:{}".format(i)}) for i in range(5))
+        response = self.client.get(FLOWS + "?paging.limit=2&paging.until=100:3&device_id=device1")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(["flow3", "flow2"], [flow["id"] for flow in json.loads(response.get_data(as_text=True))])
+        self.assertEqual("2", response.headers["X-Paging-Limit"])
+        self.assertEqual("100:1", response.headers["X-Paging-Since"])
+        self.assertEqual("100:3", response.headers["X-Paging-Until"])
+        self.assertIn("?device_id=device1&paging.limit=2&paging.since=100%3A3>; rel=\"next\"", response.headers["Link"])
+        self.assertIn("?device_id=device1&paging.limit=2&paging.until=100%3A1>; rel=\"prev\"", response.headers["Link"])
+
+    def test_paged_resource_list_with_invalid_versions(self):
+        """Resources with a missing or invalid version are paged as the oldest, rather than failing the request"""
+        self.registry.list_resource.return_value = {
+            "flow1": {"id": "flow1", "version": "100:1"},
+            "flow2": {"id": "flow2", "version": "bad"},
+            "flow3": {"id": "flow3"},
+        }
+        response = self.client.get(FLOWS + "?paging.limit=3")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(["flow1", "flow2", "flow3"],
+                         [flow["id"] for flow in json.loads(response.get_data(as_text=True))])
+        self.assertEqual("0:0", response.headers["X-Paging-Since"])
+
+    def test_invalid_paging_parameters(self):
+        """Invalid paging parameters are rejected"""
+        self.registry.list_resource.return_value = {}
+        for query in ["paging.limit=0", "paging.limit=x", "paging.since=1", "paging.since=2:0&paging.until=1:0"]:
+            self.assertEqual(400, self.client.get(FLOWS + "?" + query).status_code, query)
+
+
+class TestEncodeList(unittest.TestCase):
+    def test_matches_serialised_list(self):
+        """Joining encoded items gives the same JSON as serialising the whole list"""
+        resources = [{"id": "a", "tags": {"urn:x-nmos:tag:grouphint/v1.0": ["a\nb"]}, "caps": {}},
+                     {"id": "b", "parents": [], "label": u"\u00e9"}]
+        for items in [resources, resources[:1], []]:
+            self.assertEqual(json.dumps(items, indent=4).encode("utf-8"),
+                             encode_list([encode_list_item(item) for item in items]))
+
+
+class TestPageResources(unittest.TestCase):
+    def setUp(self):
+        self.resources = [{"id": i, "version": "100:{}".format(i)} for i in [2, 0, 4, 1, 3]]
+
+    def ids(self, page):
+        return [resource["id"] for resource in page[0]]
+
+    def test_most_recent_page(self):
+        """Without `since`, the page holds the most recent resources, and `since` is narrowed to fit the page"""
+        page = page_resources(self.resources, 2, until=(100, 3))
+        self.assertEqual([3, 2], self.ids(page))
+        self.assertEqual(((100, 1), (100, 3)), page[1:])
+
+    def test_unversioned_resources_are_oldest(self):
+        """Resources without a valid version are in the default range as the oldest, but not after any `since`"""
+        resources = [{"id": "a"}, {"id": "b", "version": "0:0"}, {"id": "c", "version": "1:x"}] + self.resources
+        page = page_resources(resources, 10)
+        self.assertEqual([4, 3, 2, 1, 0], self.ids(page)[:5])
+        self.assertEqual(["a", "b", "c"], sorted(self.ids(page)[5:]))
+        self.assertEqual((0, 0), page[1])
+
+        page = page_resources(resources, 6, until=(100, 4))
+        self.assertEqual((0, 0), page[1])
+        self.assertEqual(3, len(page_resources(resources, 10, until=(0, 0))[0]))
+        self.assertEqual([2, 1, 0], self.ids(page_resources(resources, 10, since=(0, 0), until=(100, 2))))
+
+    def test_oldest_page_after_since(self):
+        """With only `since`, the page holds the oldest resources after it, and `until` is narrowed to fit the page"""
+        page = page_resources(self.resources, 2, since=(100, 0))
+        self.assertEqual([2, 1], self.ids(page))
+        self.assertEqual(((100, 0), (100, 2)), page[1:])
+
+    def test_complete_page(self):
+        """A page holding all of the resources in range covers the whole range"""
+        page = page_resources(self.resources, 10, since=(100, 1), until=(100, 3))
+        self.assertEqual([3, 2], self.ids(page))
+        self.assertEqual(((100, 1), (100, 3)), page[1:])
@@ -18,7 +18,8 @@ from six import PY2
 from six import iteritems
 import unittest
 import mock
-from nmosnode.facade import Facade, FAC_SUCCESS, FAC_OTHERERROR
+from nmosnode.facade import Facade, FAC_SUCCESS, FAC_OTHERERROR, IPC_BATCH_SIZE
+from nmoscommon.ipc import RemoteException
 
 
 class TestFacade(unittest.TestCase):
@@ -318,6 +319,69 @@ class TestFacade(unittest.TestCase):
         self.assert_method_calls_remote_method_or_bails('delResource', 'res_unregister', ("dummytype", "dummykey"), ipc=False)
         self.assert_method_calls_remote_method_or_bails('delResource', 'res_unregister', ("dummytype", "dummykey"), raises=True)
 
+    def test_addResources(self):
+        def _extra_check(UUT):
+            self.assertEqual(UUT.resources["dummytype"], {"dummykey0": "dummyval0", "dummykey1": "dummyval1"})
+        resources = {"dummykey0": "dummyval0", "dummykey1": "dummyval1"}
+        self.assert_method_calls_remote_method_or_bails('addResources', 'res_register_many', ("dummytype", resources), extra_check=_extra_check)
+        self.assert_method_calls_remote_method_or_bails('addResources', 'res_register_many', ("dummytype", resources), registered=False)
+        self.assert_method_calls_remote_method_or_bails('addResources', 'res_register_many', ("dummytype", resources), ipc=False)
+        self.assert_method_calls_remote_method_or_bails('addResources', 'res_register_many', ("dummytype", resources), raises=True)
+
+    def test_addResources_batches_ipc_calls(self):
+        address = "ipc:///tmp/nmos-nodefacade.dummy.for.test"
+        UUT = Facade("dummy_type", address=address)
+        self.mocks['nmosnode.facade.Proxy'].return_value.srv_register.return_value = FAC_SUCCESS
+        UUT.register_service("http://dummy.example.com", "http://dummyproxy.example.com")
+
+        resources = {"key{}".format(i): "val{}".format(i) for i in range(0, IPC_BATCH_SIZE * 2 + 1)}
+        UUT.addResources("dummytype", resources)
+
+        calls = UUT.ipc.res_register_many.mock_calls
+        self.assertEqual(len(calls), 3)
+        sent = {}
+        for call in calls:
+            self.assertLessEqual(len(call[1][3]), IPC_BATCH_SIZE)
+            sent.update(call[1][3])
+        self.assertEqual(sent, resources)
+
+    def test_addResources_falls_back_when_batch_unsupported(self):
+        UUT = Facade("dummy_type", address="ipc:///tmp/nmos-nodefacade.dummy.for.test")
+        self.mocks['nmosnode.facade.Proxy'].return_value.srv_register.return_value = FAC_SUCCESS
+        UUT.register_service("http://dummy.example.com", "http://dummyproxy.example.com")
+        UUT.ipc.res_register_many.side_effect = RemoteException("AttributeError")
+        UUT.ipc.res_unregister_many.side_effect = RemoteException("AttributeError")
+
+        UUT.addResources("dummytype", {"dummykey0": "dummyval0", "dummykey1": "dummyval1"})
+        self.assertIsNotNone(UUT.ipc)
+        self.assertFalse(UUT.batch_ipc)
+        self.assertCountEqual(UUT.ipc.res_register.mock_calls,
+                              [mock.call("dummy_type", mock.ANY, "dummytype", "dummykey0", "dummyval0"),
+                               mock.call("dummy_type", mock.ANY, "dummytype", "dummykey1", "dummyval1")])
+
+        # Once the facade is known not to provide them, the batched methods aren't tried again
+        UUT.addResources("dummytype", {"dummykey2": "dummyval2"})
+        UUT.delResources("dummytype", ["dummykey0", "dummykey2"])
+        self.assertEqual(len(UUT.ipc.res_register_many.mock_calls), 1)
+        UUT.ipc.res_unregister_many.assert_not_called()
+        self.assertEqual(len(UUT.ipc.res_register.mock_calls), 3)
+        self.assertCountEqual(UUT.ipc.res_unregister.mock_calls,
+                              [mock.call("dummy_type", mock.ANY, "dummytype", "dummykey0"),
+                               mock.call("dummy_type", mock.ANY, "dummytype", "dummykey2")])
+
+    def test_delResources(self):
+        def _presetup(UUT):
+            UUT.resources["flow"] = {"dummykey0": "dummyval0", "dummykey1": "dummyval1", "dummykey2": "dummyval2"}
+            UUT.resources["transport"] = {"dummytransportkey": {"flow-id": "dummykey0"}}
+
+        def _extra_check(UUT):
+            self.assertEqual(UUT.resources["flow"], {"dummykey2": "dummyval2"})
+            self.assertNotIn("dummytransportkey", UUT.resources["transport"])
+        self.assert_method_calls_remote_method_or_bails('delResources', 'res_unregister_many', ("flow", ["dummykey0", "dummykey1"]), presetup=_presetup, extra_check=_extra_check)
+        self.assert_method_calls_remote_method_or_bails('delResources', 'res_unregister_many', ("dummytype", ["dummykey"]), registered=False)
+        self.assert_method_calls_remote_method_or_bails('delResources', 'res_unregister_many', ("dummytype", ["dummykey"]), ipc=False)
+        self.assert_method_calls_remote_method_or_bails('delResources', 'res_unregister_many', ("dummytype", ["dummykey"]), raises=True)
+
     def test_addControl(self):
         def _extra_check(UUT):
             self.assertIn("dummyid", UUT.controls)
@@ -384,19 +448,39 @@ class TestFacade(unittest.TestCase):
         for con in controls:
             UUT.addControl(*con)
 
-        expected_res_register_calls = [mock.call(srv_type, mock.ANY, *res) for res in resources] + [mock.call(srv_type, mock.ANY, "receiver", "rkey", {"dummy": "DUMMY2"})]
+        expected_res_register_calls = [mock.call(srv_type, mock.ANY, "type0", {"key0": "val0", "key1": "val1"}),
+                                       mock.call(srv_type, mock.ANY, "type2", {"key2": "val2"}),
+                                       mock.call(srv_type, mock.ANY, "receiver", {"rkey": {"dummy": "DUMMY2"}})]
         expected_control_register_calls = [mock.call(srv_type, mock.ANY, *con) for con in controls]
 
-        UUT.ipc.res_register.reset_mock()
+        UUT.ipc.res_register_many.reset_mock()
         UUT.ipc.control_register.reset_mock()
 
         UUT.reregister_all()
 
         self.assertFalse(UUT.reregister)
         self.assertTrue(UUT.srv_registered)
-        self.assertCountEqual(UUT.ipc.res_register.mock_calls, expected_res_register_calls)
+        self.assertCountEqual(UUT.ipc.res_register_many.mock_calls, expected_res_register_calls)
         self.assertCountEqual(UUT.ipc.control_register.mock_calls, expected_control_register_calls)
 
+    def test_reregister_all_falls_back_when_batch_unsupported(self):
+        srv_type = "dummy_type"
+        UUT = Facade(srv_type, address="ipc:///tmp/nmos-nodefacade.dummy.for.test")
+        self.mocks['nmosnode.facade.Proxy'].return_value.srv_register.return_value = FAC_SUCCESS
+        UUT.register_service("http://dummy.example.com", "http://dummyproxy.example.com")
+        UUT.addResource("type0", "key0", "val0")
+        UUT.addResource("type0", "key1", "val1")
+        UUT.ipc.res_register.reset_mock()
+        UUT.ipc.res_register_many.side_effect = RemoteException("AttributeError")
+
+        UUT.reregister_all()
+
+        self.assertFalse(UUT.reregister)
+        self.assertIsNotNone(UUT.ipc)
+        self.assertCountEqual(UUT.ipc.res_register.mock_calls,
+                              [mock.call(srv_type, mock.ANY, "type0", "key0", "val0"),
+                               mock.call(srv_type, mock.ANY, "type0", "key1", "val1")])
+
     def test_reregister_all_bails_if_failed_to_unregister(self):
         address = "ipc:///tmp/nmos-nodefacade.dummy.for.test"
         srv_type = "dummy_type"
@@ -409,12 +493,12 @@ class TestFacade(unittest.TestCase):
         proxy_path = "http://dummyproxy.example.com"
         UUT.register_service(href, proxy_path)
 
-        UUT.ipc.res_register.reset_mock()
+        UUT.ipc.res_register_many.reset_mock()
         UUT.ipc.control_register.reset_mock()
 
         UUT.reregister_all()
 
-        self.mocks['nmosnode.facade.Proxy'].return_value.res_register.assert_not_called()
+        self.mocks['nmosnode.facade.Proxy'].return_value.res_register_many.assert_not_called()
         self.mocks['nmosnode.facade.Proxy'].return_value.control_register.assert_not_called()
 
     def test_reregister_all_bails_if_failed_to_register(self):
@@ -428,14 +512,14 @@ class TestFacade(unittest.TestCase):
         proxy_path = "http://dummyproxy.example.com"
         UUT.register_service(href, proxy_path)
 
-        UUT.ipc.res_register.reset_mock()
+        UUT.ipc.res_register_many.reset_mock()
         UUT.ipc.control_register.reset_mock()
 
         self.mocks['nmosnode.facade.Proxy'].return_value.srv_register.side_effect = Exception
 
         UUT.reregister_all()
 
-        self.mocks['nmosnode.facade.Proxy'].return_value.res_register.assert_not_called()
+        self.mocks['nmosnode.facade.Proxy'].return_value.res_register_many.assert_not_called()
         self.mocks['nmosnode.facade.Proxy'].return_value.control_register.assert_not_called()
 
     def test_reregister_all_bails_when_res_register_raises(self):
@@ -463,16 +547,16 @@ class TestFacade(unittest.TestCase):
         for con in controls:
             UUT.addControl(*con)
 
-        UUT.ipc.res_register.reset_mock()
+        UUT.ipc.res_register_many.reset_mock()
         UUT.ipc.control_register.reset_mock()
 
-        UUT.ipc.res_register.side_effect = Exception
+        UUT.ipc.res_register_many.side_effect = Exception
 
         with mock.patch('gevent.sleep'):
             UUT.reregister_all()
 
         self.assertIsNone(UUT.ipc)
-        self.assertEqual(len(self.mocks['nmosnode.facade.Proxy'].return_value.res_register.mock_calls), 1)
+        self.assertEqual(len(self.mocks['nmosnode.facade.Proxy'].return_value.res_register_many.mock_calls), 1)
         self.assertEqual(len(self.mocks['nmosnode.facade.Proxy'].return_value.control_register.mock_calls), 0)
 
     def test_reregister_all_bails_when_control_register_raises(self):
@@ -497,12 +581,14 @@ class TestFacade(unittest.TestCase):
             UUT.addResource(*res)
         UUT.addResource("receiver", "rkey", {"pipel_id": "DUMMY0", "pipeline_id": "DUMMY1", "dummy": "DUMMY2"})
 
-        expected_res_register_calls = [mock.call(srv_type, mock.ANY, *res) for res in resources] + [mock.call(srv_type, mock.ANY, "receiver", "rkey", {"dummy": "DUMMY2"})]
+        expected_res_register_calls = [mock.call(srv_type, mock.ANY, "type0", {"key0": "val0", "key1": "val1"}),
+                                       mock.call(srv_type, mock.ANY, "type2", {"key2": "val2"}),
+                                       mock.call(srv_type, mock.ANY, "receiver", {"rkey": {"dummy": "DUMMY2"}})]
 
         for con in controls:
             UUT.addControl(*con)
 
-        UUT.ipc.res_register.reset_mock()
+        UUT.ipc.res_register_many.reset_mock()
         UUT.ipc.control_register.reset_mock()
 
         UUT.ipc.control_register.side_effect = Exception
@@ -511,5 +597,5 @@ class TestFacade(unittest.TestCase):
             UUT.reregister_all()
 
         self.assertIsNone(UUT.ipc)
-        self.assertCountEqual(self.mocks['nmosnode.facade.Proxy'].return_value.res_register.mock_calls, expected_res_register_calls)
+        self.assertCountEqual(self.mocks['nmosnode.facade.Proxy'].return_value.res_register_many.mock_calls, expected_res_register_calls)
         self.assertEqual(len(self.mocks['nmosnode.facade.Proxy'].return_value.control_register.mock_calls), 1)
@@ -0,0 +1,65 @@
+# Copyright 2019 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function, absolute_import
+
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+from nmosnode.journal import MirrorJournal
+
+
+class TestMirrorJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, "journal.db")
+
+    def reopen(self, journal):
+        journal.close()
+        journal = MirrorJournal(self.path)
+        self.addCleanup(journal.close)
+        return journal
+
+    def test_replay_restores_latest_values_in_order(self):
+        """Replaying a reopened journal returns each live entity's latest value, in the order they were last changed"""
+        journal = MirrorJournal(self.path)
+        journal.record("resource", "node", "", {"type": "node", "data": {"id": "node1"}})
+        journal.record("resource", "device", "device1", {"type": "device", "data": {"id": "device1", "label": "a"}})
+        journal.record("resource", "flow", "flow1", {"type": "flow", "data": {"id": "flow1"}})
+        journal.record("resource", "flow", "flow2", {"type": "flow", "data": {"id": "flow2"}})
+        journal.record("resource", "device", "device1", {"type": "device", "data": {"id": "device1", "label": "b"}})
+        journal.record("resource", "flow", "flow1")
+
+        self.assertListEqual(self.reopen(journal).replay(), [
+            ("resource", "node", "", {"type": "node", "data": {"id": "node1"}}),
+            ("resource", "flow", "flow2", {"type": "flow", "data": {"id": "flow2"}}),
+            ("resource", "device", "device1", {"type": "device", "data": {"id": "device1", "label": "b"}})])
+
+    def test_compaction_drops_superseded_records(self):
+        """Once enough records have been appended, superseded records and removals are dropped from the journal"""
+        journal = MirrorJournal(self.path)
+        self.addCleanup(journal.close)
+        with mock.patch("nmosnode.journal.COMPACT_MIN_RECORDS", 10):
+            for i in range(9):
+                journal.record("resource", "flow", "flow1", {"type": "flow", "data": {"id": "flow1", "label": i}})
+            self.assertEqual(9, journal._db.execute("SELECT COUNT(*) FROM journal").fetchone()[0])
+            journal.record("resource", "flow", "flow2", {"type": "flow", "data": {"id": "flow2"}})
+
+        self.assertEqual(2, journal._db.execute("SELECT COUNT(*) FROM journal").fetchone()[0])
+        self.assertListEqual(journal.replay(), [
+            ("resource", "flow", "flow1", {"type": "flow", "data": {"id": "flow1", "label": 8}}),
+            ("resource", "flow", "flow2", {"type": "flow", "data": {"id": "flow2"}})])
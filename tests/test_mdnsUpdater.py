@@ -19,7 +19,7 @@ import unittest
 import mock
 import time
 
-from nmosnode.aggregator import MDNSUpdater
+from nmosnode.aggregator import MDNSUpdater, TokenBucket
 
 MAX_ITERATIONS = 10
 
@@ -52,7 +52,16 @@ class TestMDNSUpdater(unittest.TestCase):
             self.mappings,
             self.port,
             self.logger,
-            txt_recs=self.txt_recs)
+            txt_recs=self.txt_recs,
+            min_update_interval=0)
+        self.addCleanup(self.UUT.stop)
+
+    def wait_for_mdns_update(self):
+        """Wait for the updater thread to apply any pending change to the TXT records"""
+        counter = 0
+        while self.UUT._update_pending.is_set() and counter < MAX_ITERATIONS:
+            time.sleep(0.1)
+            counter += 1
 
     def test_init(self):
         """Test of initialisation of an MDNSUpdater"""
@@ -76,10 +85,7 @@ class TestMDNSUpdater(unittest.TestCase):
 
         self.assertTrue(self.UUT.p2p_enable)
         self.txt_recs.update(self.UUT.service_versions)
-        counter = 0
-        while not self.UUT._mdns_update_queue.empty() and counter < MAX_ITERATIONS:
-            time.sleep(0.1)
-            counter += 1
+        self.wait_for_mdns_update()
         self.UUT.mdns.update.assert_called_once_with(self.mdnsname, self.mdnstype, self.txt_recs)
 
     def test_inc_P2P_enable_count(self):
@@ -90,37 +96,25 @@ class TestMDNSUpdater(unittest.TestCase):
             self.UUT.inc_P2P_enable_count()
 
             self.assertFalse(self.UUT.p2p_enable)
-            counter = 0
-            while not self.UUT._mdns_update_queue.empty() and counter < MAX_ITERATIONS:
-                time.sleep(0.1)
-                counter += 1
+            self.wait_for_mdns_update()
             self.UUT.mdns.update.assert_not_called()
 
         self.UUT.inc_P2P_enable_count()
         self.assertTrue(self.UUT.p2p_enable)
         self.txt_recs.update(self.UUT.service_versions)
-        counter = 0
-        while not self.UUT._mdns_update_queue.empty() and counter < MAX_ITERATIONS:
-            time.sleep(0.1)
-            counter += 1
+        self.wait_for_mdns_update()
         self.UUT.mdns.update.assert_called_once_with(self.mdnsname, self.mdnstype, self.txt_recs)
 
     def test_P2P_disable_when_enabled(self):
         """When an MDNSUpdater is already enabled for P2P calling P2P_disable should disable P2P"""
 
         self.UUT.P2P_enable()
-        counter = 0
-        while not self.UUT._mdns_update_queue.empty() and counter < MAX_ITERATIONS:
-            time.sleep(0.1)
-            counter += 1
+        self.wait_for_mdns_update()
         self.UUT.mdns.update.reset_mock()
         self.UUT.P2P_disable()
 
         self.assertFalse(self.UUT.p2p_enable)
-        counter = 0
-        while not self.UUT._mdns_update_queue.empty() and counter < MAX_ITERATIONS:
-            time.sleep(0.1)
-            counter += 1
+        self.wait_for_mdns_update()
         self.UUT.mdns.update.assert_called_once_with(self.mdnsname, self.mdnstype, self.txt_recs)
 
     def test_P2P_disable_resets_enable_count(self):
@@ -131,10 +125,7 @@ class TestMDNSUpdater(unittest.TestCase):
             self.UUT.inc_P2P_enable_count()
 
             self.assertFalse(self.UUT.p2p_enable)
-            counter = 0
-            while not self.UUT._mdns_update_queue.empty() and counter < MAX_ITERATIONS:
-                time.sleep(0.1)
-                counter += 1
+            self.wait_for_mdns_update()
             self.UUT.mdns.update.assert_not_called()
 
         self.UUT.P2P_disable()
@@ -143,19 +134,13 @@ class TestMDNSUpdater(unittest.TestCase):
             self.UUT.inc_P2P_enable_count()
 
             self.assertFalse(self.UUT.p2p_enable)
-            counter = 0
-            while not self.UUT._mdns_update_queue.empty() and counter < MAX_ITERATIONS:
-                time.sleep(0.1)
-                counter += 1
+            self.wait_for_mdns_update()
             self.UUT.mdns.update.assert_not_called()
 
         self.UUT.inc_P2P_enable_count()
         self.assertTrue(self.UUT.p2p_enable)
         self.txt_recs.update(self.UUT.service_versions)
-        counter = 0
-        while not self.UUT._mdns_update_queue.empty() and counter < MAX_ITERATIONS:
-            time.sleep(0.1)
-            counter += 1
+        self.wait_for_mdns_update()
         self.UUT.mdns.update.assert_called_once_with(self.mdnsname, self.mdnstype, self.txt_recs)
 
     def test_update_mdns_does_nothing_when_not_enabled(self):
@@ -163,10 +148,7 @@ class TestMDNSUpdater(unittest.TestCase):
 
         self.UUT.update_mdns("device", "register")
         self.assertEqual(self.UUT.service_versions[self.mappings["device"]], 0)
-        counter = 0
-        while not self.UUT._mdns_update_queue.empty() and counter < MAX_ITERATIONS:
-            time.sleep(0.1)
-            counter += 1
+        self.wait_for_mdns_update()
         self.UUT.mdns.update.assert_not_called()
 
     def test_update_mdns(self):
@@ -175,22 +157,89 @@ class TestMDNSUpdater(unittest.TestCase):
         the limits of 1 byte."""
 
         self.UUT.P2P_enable()
+        self.wait_for_mdns_update()
+        self.UUT.mdns.update.reset_mock()
 
-        # Don't check the mDNS update calls here as it'll take forever and it's handled by other tests already
-        for i in range(1, 256):
-            self.UUT.mdns.update.reset_mock()
-            self.UUT.update_mdns("device", "register")
-            self.assertEqual(self.UUT.service_versions[self.mappings["device"]], i)
-            self.txt_recs.update(self.UUT.service_versions)
+        self.UUT.update_mdns("device", "register")
+        self.wait_for_mdns_update()
+        self.assertEqual(self.UUT.service_versions[self.mappings["device"]], 1)
+        self.txt_recs.update(self.UUT.service_versions)
+        self.UUT.mdns.update.assert_called_once_with(self.mdnsname, self.mdnstype, self.txt_recs)
 
+        self.UUT.service_versions[self.mappings["device"]] = 255
         self.UUT.mdns.update.reset_mock()
-        while not self.UUT._mdns_update_queue.empty():
-            self.UUT._mdns_update_queue.get()
         self.UUT.update_mdns("device", "register")
+        self.wait_for_mdns_update()
         self.assertEqual(self.UUT.service_versions[self.mappings["device"]], 0)
         self.txt_recs.update(self.UUT.service_versions)
-        counter = 0
-        while not self.UUT._mdns_update_queue.empty() and counter < MAX_ITERATIONS:
-            time.sleep(0.1)
-            counter += 1
         self.UUT.mdns.update.assert_called_once_with(self.mdnsname, self.mdnstype, self.txt_recs)
+
+    def test_update_mdns_coalesces_changes(self):
+        """A burst of changes made within the minimum interval after an update should result in a single further
+        update, with each changed counter incremented once"""
+        self.UUT._min_update_interval = 0.2
+        self.UUT.P2P_enable()
+        self.wait_for_mdns_update()
+        self.UUT.mdns.update.reset_mock()
+
+        for i in range(0, 100):
+            self.UUT.update_mdns("flow", "register")
+            self.UUT.update_mdns("sender", "update")
+        self.wait_for_mdns_update()
+
+        self.txt_recs.update(self.UUT.service_versions)
+        self.assertEqual(self.UUT.service_versions[self.mappings["flow"]], 1)
+        self.assertEqual(self.UUT.service_versions[self.mappings["sender"]], 1)
+        self.UUT.mdns.update.assert_called_once_with(self.mdnsname, self.mdnstype, self.txt_recs)
+
+    def test_update_mdns_limits_counter_increments(self):
+        """A counter which has been incremented too often should not be incremented again until the rate limit allows,
+        while changes to other counters are announced straight away"""
+        self.UUT._counter_buckets[self.mappings["flow"]] = TokenBucket(rate=5, burst=1)
+        self.UUT.P2P_enable()
+        self.wait_for_mdns_update()
+        self.UUT.update_mdns("flow", "register")
+        self.wait_for_mdns_update()
+        self.UUT.mdns.update.reset_mock()
+
+        self.UUT.update_mdns("flow", "register")
+        self.UUT.update_mdns("device", "register")
+        self.wait_for_mdns_update()
+
+        txt_recs = dict(self.txt_recs)
+        txt_recs.update(self.UUT.service_versions)
+        txt_recs[self.mappings["flow"]] = 1
+        self.assertListEqual(self.UUT.mdns.update.mock_calls, [
+            mock.call(self.mdnsname, self.mdnstype, dict(txt_recs)),
+            mock.call(self.mdnsname, self.mdnstype, dict(txt_recs, ver_flw=2))])
+
+    def test_update_mdns_skips_unchanged_txt_records(self):
+        """Enabling then disabling P2P before the update is made leaves the TXT records as they were, so no update
+        should be made"""
+        self.UUT.P2P_enable()
+        self.UUT.P2P_disable()
+        self.wait_for_mdns_update()
+
+        self.UUT.mdns.update.assert_not_called()
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_token_bucket_allows_bursts_then_limits_rate(self):
+        """A token bucket should allow a burst of events, then events at its rate, refilling up to its burst size"""
+        with mock.patch("nmosnode.aggregator.monotonic") as monotonic:
+            monotonic.return_value = 100.0
+            bucket = TokenBucket(rate=2, burst=3)
+            for i in range(0, 3):
+                self.assertEqual(bucket.delay(), 0)
+                self.assertTrue(bucket.consume())
+            self.assertFalse(bucket.consume())
+            self.assertAlmostEqual(bucket.delay(), 0.5)
+
+            monotonic.return_value = 100.5
+            self.assertTrue(bucket.consume())
+            self.assertFalse(bucket.consume())
+
+            monotonic.return_value = 110.0
+            for i in range(0, 3):
+                self.assertTrue(bucket.consume())
+            self.assertFalse(bucket.consume())
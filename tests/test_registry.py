@@ -15,10 +15,12 @@
 from __future__ import print_function, absolute_import
 import six
 
+import json
 import mock
 import unittest
 from nmosnode import registry
 import time
+import threading
 import nmosnode
 
 # to run: python test_registry.py
@@ -38,6 +40,10 @@ class MockAggregator:
     def register_into(self, *args, **kwargs):
         self.register_invocations.append([args, kwargs])
 
+    def register_many_into(self, namespace, res_type, resources):
+        for (key, data) in resources.items():
+            self.register_into(namespace, res_type, key, **data)
+
     def unregister(self, *args, **kwargs):
         self.unregister_invocations.append([args, kwargs])
 
@@ -125,11 +131,51 @@ class TestRegistryServices(unittest.TestCase):
 
     def test_cleanup_services(self):
         """Services with a heartbeat older than HEARTBEAT_TIMEOUT are removed"""
-        self.registry.register_service("a", "test", 1, "a_href")
-        self.registry.register_service("b", "test", 2, "b_href")
-        self.registry.services["a"]["heartbeat"] = time.time() - registry.HEARTBEAT_TIMEOUT - 1
-        self.registry.cleanup_services()
+        with mock.patch("time.time", return_value=1000.0):
+            self.registry.register_service("a", "test", 1, "a_href")
+        with mock.patch("time.time", return_value=1005.0):
+            self.registry.register_service("b", "test", 2, "b_href")
+        with mock.patch("time.time", return_value=1000.0 + registry.HEARTBEAT_TIMEOUT + 1):
+            delay = self.registry.cleanup_services()
         self.assertEqual(["b"], self.registry.list_services())
+        self.assertEqual(4.0, delay)
+
+    def test_cleanup_services_respects_heartbeats(self):
+        """Services which have heartbeated since registering are not removed until their latest heartbeat expires"""
+        with mock.patch("time.time", return_value=1000.0):
+            self.registry.register_service("a", "test", 1, "a_href")
+        with mock.patch("time.time", return_value=1010.0):
+            self.registry.heartbeat_service("a", 1)
+        with mock.patch("time.time", return_value=1000.0 + registry.HEARTBEAT_TIMEOUT + 1):
+            delay = self.registry.cleanup_services()
+        self.assertEqual(["a"], self.registry.list_services())
+        self.assertEqual(9.0, delay)
+        with mock.patch("time.time", return_value=1010.0 + registry.HEARTBEAT_TIMEOUT):
+            delay = self.registry.cleanup_services()
+        self.assertEqual([], self.registry.list_services())
+        self.assertIsNone(delay)
+
+    def test_cleaner_removes_expired_services(self):
+        """The cleaner thread removes a service once its heartbeat expires"""
+        with mock.patch("nmosnode.registry.HEARTBEAT_TIMEOUT", 0.2):
+            cleaner = registry.FacadeRegistryCleaner(self.registry)
+            cleaner.start()
+            self.registry.register_service("a", "test", 1, "a_href")
+            time.sleep(0.5)
+            cleaner.stop()
+        self.assertEqual([], self.registry.list_services())
+
+    def test_cleanup_services_ignores_reregistered_services(self):
+        """A service which is unregistered and registered again is timed out from its new registration"""
+        with mock.patch("time.time", return_value=1000.0):
+            self.registry.register_service("a", "test", 1, "a_href")
+            self.registry.unregister_service("a", 1)
+        with mock.patch("time.time", return_value=1010.0):
+            self.registry.register_service("a", "test", 1, "a_href")
+        with mock.patch("time.time", return_value=1000.0 + registry.HEARTBEAT_TIMEOUT + 1):
+            self.registry.cleanup_services()
+        self.assertEqual(["a"], self.registry.list_services())
+        self.assertEqual(1, len(self.registry._expiry_heap))
 
 
 class TestRegistry(unittest.TestCase):
@@ -210,6 +256,248 @@ class TestRegistry(unittest.TestCase):
             for control in device_resources["device_a_key"]["controls"]:
                 self.assertIn(control["href"].split("://")[0], ["https", "wss"])
 
+    def test_find_service(self):
+        """find_service returns the name of the service which registered a resource"""
+        self.registry.register_resource("a", 1, "flow", "flow_a_key", {"label": "flow_a"})
+        self.registry.register_resource("b", 2, "flow", "flow_b_key", {"label": "flow_b"})
+        self.assertEqual("a", self.registry.find_service("flow", "flow_a_key"))
+        self.assertEqual("b", self.registry.find_service("flow", "flow_b_key"))
+        self.assertIsNone(self.registry.find_service("flow", "flow_c_key"))
+        self.assertIsNone(self.registry.find_service("device", "flow_a_key"))
+
+        self.registry.unregister_resource("a", 1, "flow", "flow_a_key")
+        self.assertIsNone(self.registry.find_service("flow", "flow_a_key"))
+
+    def test_find_service_after_timeout(self):
+        """Resources belonging to a timed out service are removed from the index"""
+        self.registry.register_resource("a", 1, "flow", "flow_a_key", {"label": "flow_a"})
+        with mock.patch("time.time", return_value=time.time() + registry.HEARTBEAT_TIMEOUT + 1):
+            self.registry.cleanup_services()
+        self.assertIsNone(self.registry.find_service("flow", "flow_a_key"))
+        self.assertEqual(0, self.registry._len_resource("flow"))
+
+    def test_get_resource(self):
+        """get_resource returns a single resource, respecting its max_api_version"""
+        self.registry.register_resource("a", 1, "flow", "flow_a_key", {"label": "flow_a", "max_api_version": "v1.2"})
+        self.assertEqual("flow_a", self.registry.get_resource("flow", "flow_a_key", "v1.2")["label"])
+        self.assertIsNone(self.registry.get_resource("flow", "flow_a_key", "v1.3"))
+        self.assertIsNone(self.registry.get_resource("flow", "flow_b_key", "v1.2"))
+
+    def test_control_registration_updates_device(self):
+        """Registering a control re-registers the Device it belongs to"""
+        self.registry.register_resource("a", 1, "device", "device_a_key", {"label": "device_a", "controls": []})
+        self.mock_aggregator.register_invocations = []
+        control = {"type": "some-type", "href": "http://some-url.com"}
+        self.registry.register_control("b", 2, "device_a_key", control)
+        self.assertEqual(1, len(self.mock_aggregator.register_invocations))
+        args, kwargs = self.mock_aggregator.register_invocations[0]
+        self.assertEqual(('resource', 'device', 'device_a_key'), args)
+        self.assertEqual(1, len(kwargs["controls"]))
+
+    def test_preprocessed_resources_are_cached(self):
+        """Repeated listings reuse preprocessed resources until the resource is re-registered"""
+        self.registry.register_resource("a", 1, "flow", "flow_a_key", {"label": "flow_a", "version": "1:0"})
+        first = self.registry.list_resource("flow")["flow_a_key"]
+        self.assertIs(first, self.registry.list_resource("flow")["flow_a_key"])
+
+        self.registry.update_resource("a", 1, "flow", "flow_a_key", {"label": "flow_a2", "version": "1:0"})
+        second = self.registry.list_resource("flow")["flow_a_key"]
+        self.assertEqual("flow_a2", second["label"])
+
+        self.registry.unregister_resource("a", 1, "flow", "flow_a_key")
+        self.registry.register_resource("a", 1, "flow", "flow_a_key", {"label": "flow_a3", "version": "1:0"})
+        self.assertEqual("flow_a3", self.registry.list_resource("flow")["flow_a_key"]["label"])
+
+    def test_encoded_resources_are_cached(self):
+        """Resources are encoded once, and encoded again once re-registered"""
+        self.registry.register_resource("a", 1, "flow", "flow_a_key", {"label": "flow_a", "version": "1:0"})
+        first = self.registry.list_resource_json("flow")
+        self.assertEqual([{"label": "flow_a", "version": "1:0"}], [json.loads(x) for x in first])
+        self.assertIs(first[0], self.registry.list_resource_json("flow")[0])
+
+        self.registry.update_resource("a", 1, "flow", "flow_a_key", {"label": "flow_a2", "version": "1:1"})
+        self.assertEqual("flow_a2", json.loads(self.registry.list_resource_json("flow")[0])["label"])
+        self.assertEqual(registry.RES_UNSUPPORTED, self.registry.list_resource_json("source"))
+
+    def test_list_resource_filters(self):
+        """Resources can be filtered on indexed attributes, which follow updates and handover between services"""
+        self.registry.register_resource("a", 1, "sender", "sender_a_key", {"device_id": "d1", "transport": "t1"})
+        self.registry.register_resource("a", 1, "sender", "sender_b_key", {"device_id": "d1", "transport": "t2"})
+        self.registry.register_resource("a", 1, "sender", "sender_c_key", {"device_id": "d2", "transport": "t1"})
+        self.assertEqual({"sender_a_key", "sender_b_key"},
+                         set(self.registry.list_resource("sender", filters={"device_id": "d1"})))
+        self.assertEqual({"sender_a_key"},
+                         set(self.registry.list_resource("sender", filters={"device_id": "d1", "transport": "t1"})))
+        self.assertEqual({}, self.registry.list_resource("sender", filters={"device_id": "d3"}))
+
+        self.registry.update_resource("a", 1, "sender", "sender_a_key", {"device_id": "d2", "transport": "t1"})
+        self.assertEqual({"sender_a_key", "sender_c_key"},
+                         set(self.registry.list_resource("sender", filters={"device_id": "d2"})))
+
+        # Another service registering the same key takes it over, and hands it back when it unregisters
+        self.registry.register_resource("b", 2, "sender", "sender_a_key", {"device_id": "d3", "transport": "t1"})
+        self.assertEqual({"sender_a_key"}, set(self.registry.list_resource("sender", filters={"device_id": "d3"})))
+        self.registry.unregister_resource("b", 2, "sender", "sender_a_key")
+        self.assertEqual({}, self.registry.list_resource("sender", filters={"device_id": "d3"}))
+        self.assertEqual({"sender_a_key", "sender_c_key"},
+                         set(self.registry.list_resource("sender", filters={"device_id": "d2"})))
+
+        self.registry.unregister_resource("a", 1, "sender", "sender_c_key")
+        self.assertEqual({"sender_a_key"}, set(self.registry.list_resource("sender", filters={"transport": "t1"})))
+        self.assertEqual({"d1": frozenset(["sender_b_key"]), "d2": frozenset(["sender_a_key"])},
+                         self.registry._attribute_index["sender"]["device_id"])
+
+    def test_control_registration_invalidates_cached_device(self):
+        """Adding or removing a control is reflected in the Device returned by the registry"""
+        self.registry.register_resource("a", 1, "device", "device_a_key", {"label": "device_a", "controls": [],
+                                                                               "max_api_version": "v1.2"})
+        self.assertEqual([], self.registry.list_resource("device", "v1.2")["device_a_key"]["controls"])
+        control = {"type": "some-type", "href": "http://some-url.com"}
+        self.registry.register_control("b", 2, "device_a_key", control)
+        self.assertEqual(1, len(self.registry.list_resource("device", "v1.2")["device_a_key"]["controls"]))
+        self.registry.unregister_control("b", 2, "device_a_key", control)
+        self.assertEqual([], self.registry.list_resource("device", "v1.2")["device_a_key"]["controls"])
+
+    def test_modify_node_host_invalidates_cached_urls(self):
+        """Changing the Node's host rewrites cached Sender manifest URLs"""
+        self.registry.register_resource("a", 1, "sender", "sender_a_key", {"manifest_href": "http://some-url.com/"})
+        self.assertEqual("http://abcd/", self.registry.list_resource("sender")["sender_a_key"]["manifest_href"])
+        self.registry.modify_node(host="efgh")
+        self.assertEqual("http://efgh/", self.registry.list_resource("sender")["sender_a_key"]["manifest_href"])
+
+    def test_changes_are_counted_by_type(self):
+        """Registering, updating and unregistering a resource each count as a change to its type only"""
+        self.assertEqual(0, self.registry.change_count("flow"))
+        self.registry.register_resource("a", 1, "flow", "flow_a_key", {"label": "flow_a", "version": "1:0"})
+        self.registry.update_resource("a", 1, "flow", "flow_a_key", {"label": "flow_a2", "version": "1:0"})
+        self.registry.unregister_resource("a", 1, "flow", "flow_a_key")
+        self.assertEqual(3, self.registry.change_count("flow"))
+        self.assertEqual(0, self.registry.change_count("sender"))
+
+        node_changes = self.registry.change_count("node")
+        self.registry.modify_node(host="efgh")
+        self.assertEqual(4, self.registry.change_count("flow"))
+        self.assertEqual(1, self.registry.change_count("sender"))
+        self.assertEqual(node_changes + 1, self.registry.change_count("node"))
+
+    def test_list_self_is_prebuilt(self):
+        """list_self serves the same Node document until the Node is updated"""
+        node = self.registry.list_self("v1.2")
+        self.assertIs(node, self.registry.list_self("v1.2"))
+        self.assertEqual("test", node["label"])
+
+        self.registry.modify_node(label="modified")
+        node = self.registry.list_self("v1.2")
+        self.assertEqual("modified", node["label"])
+        self.assertIs(node, self.registry.list_self("v1.2"))
+
+    def test_update_node_skipped_when_unchanged(self):
+        """The Node is only re-registered and its version bumped when its content changes"""
+        version = self.registry.node_data["version"] = "0:0"
+        self.registry.update_service("a", 1)
+        self.assertEqual([], self.mock_aggregator.register_invocations)
+        self.assertEqual(version, self.registry.node_data["version"])
+
+        self.registry.update_service("a", 1, "http://a", "a_proxy")
+        self.assertEqual(1, len(self.mock_aggregator.register_invocations))
+        self.assertNotEqual(version, self.registry.node_data["version"])
+
+        self.registry.modify_node(label="test")
+        self.assertEqual(1, len(self.mock_aggregator.register_invocations))
+        self.registry.modify_node(label="modified")
+        self.assertEqual(2, len(self.mock_aggregator.register_invocations))
+
+    def test_register_resources(self):
+        """Resources may be registered and unregistered in bulk, with a result code for each"""
+        r = self.registry.register_resources("a", 1, "flow", {"flow_a_key": {"label": "flow_a"},
+                                                              "flow_b_key": {"label": "flow_b"}})
+        self.assertEqual({"flow_a_key": registry.RES_SUCCESS, "flow_b_key": registry.RES_SUCCESS}, r)
+        six.assertCountEqual(self, ["flow_a_key", "flow_b_key"], self.registry.list_resource("flow").keys())
+
+        self.assertEqual([('flow', 'update')], self.mock_mdns_updater.update_mdns_invocations)
+        self.assertEqual(2, len(self.mock_aggregator.register_invocations))
+
+        r = self.registry.register_resources("b", 1, "flow", {"flow_c_key": {"label": "flow_c"}})
+        self.assertEqual({"flow_c_key": registry.RES_UNAUTHORISED}, r)
+        r = self.registry.register_resources("a", 1, "source", {"source_a_key": {"label": "source_a"}})
+        self.assertEqual({"source_a_key": registry.RES_UNSUPPORTED}, r)
+
+        self.mock_mdns_updater.update_mdns_invocations = []
+        r = self.registry.unregister_resources("a", 1, "flow", ["flow_a_key", "flow_b_key"])
+        self.assertEqual({"flow_a_key": registry.RES_SUCCESS, "flow_b_key": registry.RES_SUCCESS}, r)
+        self.assertEqual({}, self.registry.list_resource("flow"))
+        self.assertEqual([('flow', 'unregister')], self.mock_mdns_updater.update_mdns_invocations)
+        self.assertEqual(2, len(self.mock_aggregator.unregister_invocations))
+
+    def test_list_resource_reads_from_snapshot(self):
+        """Listings are built from a snapshot which later writes replace rather than modify"""
+        self.registry.register_resource("a", 1, "flow", "flow_a_key", {"label": "flow_a"})
+        snapshot = self.registry._snapshot("flow")
+        self.assertIs(snapshot, self.registry._snapshot("flow"))
+
+        self.registry.register_resource("a", 1, "flow", "flow_b_key", {"label": "flow_b"})
+        self.assertEqual(["flow_a_key"], list(snapshot.keys()))
+        six.assertCountEqual(self, ["flow_a_key", "flow_b_key"], self.registry.list_resource("flow").keys())
+
+    def test_cached_resource_is_checked_against_value(self):
+        """A reader holding an outdated value doesn't leave its output in the cache for the newer value"""
+        old_value = {"label": "flow_a", "version": "1:0"}
+        self.registry.register_resource("a", 1, "flow", "flow_a_key", old_value)
+        self.registry.register_resource("a", 1, "flow", "flow_a_key", {"label": "flow_a2", "version": "1:0"})
+        self.assertEqual("flow_a", self.registry.preprocess_resource("flow", "flow_a_key", old_value)["label"])
+        self.assertEqual("flow_a2", self.registry.list_resource("flow")["flow_a_key"]["label"])
+
+    def test_listing_does_not_wait_for_writers(self):
+        """Resources changed by a writer can be listed while the writer still holds the lock"""
+        self.registry.register_resource("a", 1, "flow", "flow_a_key", {"label": "flow_a"})
+        self.registry.list_resource("flow")
+        changed = threading.Event()
+        done = threading.Event()
+
+        def writer():
+            with self.registry._lock:
+                self.registry._store_resource("a", "flow", "flow_b_key", {"label": "flow_b"})
+                changed.set()
+                done.wait(5)
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(done.set)
+        changed.wait(5)
+
+        listed = []
+        reader = threading.Thread(target=lambda: listed.append(self.registry.list_resource("flow")))
+        reader.start()
+        reader.join(1)
+        self.assertEqual([{"flow_a_key", "flow_b_key"}], [set(x) for x in listed])
+
+    def test_concurrent_listing_and_registration(self):
+        """Listing resources while another thread registers and unregisters them doesn't fail"""
+        errors = []
+
+        def writer():
+            try:
+                for i in range(200):
+                    self.registry.register_resource("a", 1, "flow", "flow_{}".format(i), {"label": str(i)})
+                    if i % 2:
+                        self.registry.unregister_resource("a", 1, "flow", "flow_{}".format(i - 1))
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        while thread.is_alive():
+            try:
+                self.registry.list_resource("flow")
+                self.registry.get_resource("flow", "flow_0")
+            except Exception as e:
+                errors.append(e)
+                break
+        thread.join()
+        self.assertEqual([], errors)
+        self.assertEqual(100, len(self.registry.list_resource("flow")))
+
 
 if __name__ == '__main__':
     unittest.main()